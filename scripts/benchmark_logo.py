@@ -0,0 +1,75 @@
+"""Compare single-process and segment-parallel logo overlay on synthetic videos.
+
+Usage:
+  python scripts/benchmark_logo.py
+  python scripts/benchmark_logo.py --lengths 60 300 1200 --segments 8 --workers 8
+
+Test videos (testsrc2 + sine tone, 2 s GOP) and a PNG logo are generated with ffmpeg in --work-dir
+and reused between runs.
+"""
+import argparse
+import os
+import subprocess
+import time
+from pathlib import Path
+
+from src.logo import overlay_logo, overlay_logo_parallel
+
+
+def make_video(path: Path, seconds: int, size: str, fps: int):
+    if path.exists():
+        return
+    subprocess.run([
+        "ffmpeg", "-y", "-v", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={size}:rate={fps}:duration={seconds}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-g", str(fps * 2), "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-shortest", str(path),
+    ], check=True)
+
+
+def make_logo(path: Path):
+    if path.exists():
+        return
+    subprocess.run([
+        "ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", "color=c=red@0.8:size=400x200",
+        "-frames:v", "1", str(path),
+    ], check=True)
+
+
+def timed(fn, *args, **kwargs):
+    start = time.time()
+    fn(*args, **kwargs)
+    return time.time() - start
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--lengths", type=int, nargs="+", default=[30, 120, 600], help="video lengths in seconds")
+    p.add_argument("--size", default="1280x720")
+    p.add_argument("--fps", type=int, default=24)
+    p.add_argument("--segments", type=int, default=0, help="chunks per video (default: one per worker)")
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    p.add_argument("--work-dir", default="/tmp/logo_bench")
+    args = p.parse_args()
+
+    work = Path(args.work_dir)
+    work.mkdir(parents=True, exist_ok=True)
+    logo = work / "logo.png"
+    make_logo(logo)
+
+    print(f"{'length':>8} {'single':>10} {'parallel':>10} {'speedup':>8}")
+    for seconds in args.lengths:
+        video = work / f"src_{seconds}s.mp4"
+        make_video(video, seconds, args.size, args.fps)
+        single = timed(overlay_logo, video, logo, work / f"single_{seconds}s.mp4")
+        parallel = timed(
+            overlay_logo_parallel, video, logo, work / f"parallel_{seconds}s.mp4",
+            segments=args.segments or None, workers=args.workers,
+            preset="medium", crf=23,  # ffmpeg's libx264 defaults, as used by overlay_logo
+        )
+        print(f"{seconds:>7}s {single:>9.2f}s {parallel:>9.2f}s {single / parallel:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
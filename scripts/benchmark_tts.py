@@ -2,15 +2,19 @@
 
 Usage:
   python scripts/benchmark_tts.py --n 10
+  python scripts/benchmark_tts.py --n 200 --in-flight 8 --base-url http://127.0.0.1:8765
 
 If ELEVENLABS_API_KEY is not set, runs in dry-run mode (no real HTTP calls).
+Use scripts/tts_stub_server.py as --base-url to measure client overhead without the real API,
+or --backend local to measure the local CPU engine (batched VITS, no network).
 """
 import argparse
+import asyncio
 import time
 from pathlib import Path
 import os
 
-from src.tts import ElevenTTS
+from src.tts import get_tts
 from src.tts_cache import get_cached
 
 
@@ -18,28 +22,46 @@ def gen_texts(n):
     return [f"Hello, this is test sentence number {i}." for i in range(n)]
 
 
+async def synthesize(tts, texts):
+    items = [
+        {"text": t, "out_path": Path("/tmp") / f"bench_{i}.wav", "voice_gender": "female"}
+        for i, t in enumerate(texts)
+    ]
+    async with tts:
+        results = await tts.synthesize_many(items)
+    return sum(1 for r in results if isinstance(r, Exception))
+
+
 def main():
     p = argparse.ArgumentParser()
     p.add_argument("--n", type=int, default=20)
+    p.add_argument("--in-flight", type=int, default=None)
+    p.add_argument("--rate", type=float, default=None)
+    p.add_argument("--base-url", default=None)
+    p.add_argument("--backend", default="elevenlabs", choices=["elevenlabs", "local"])
     args = p.parse_args()
 
     texts = gen_texts(args.n)
     tts = None
     try:
-        tts = ElevenTTS()
+        kwargs = {}
+        if args.backend == "elevenlabs":
+            kwargs["base_url"] = args.base_url
+            if args.in_flight:
+                kwargs["max_in_flight"] = args.in_flight
+            if args.rate is not None:
+                kwargs["rate"] = args.rate
+        tts = get_tts(args.backend, **kwargs)
     except Exception as e:
-        print("ElevenLabs not configured, running dry-run (no real synth)")
+        print(f"{args.backend} TTS not available ({e}), running dry-run (no real synth)")
 
     start = time.time()
-    for t in texts:
-        c = get_cached(t, voice_gender='female')
-        if c:
-            continue
-        if tts:
-            tmp = Path("/tmp") / f"bench_{abs(hash(t)) % (10**8)}.wav"
-            tts.synthesize_to_wav(t, tmp, voice_gender='female')
+    missing = [t for t in texts if not get_cached(t, voice_gender='female')]
+    failed = 0
+    if tts and missing:
+        failed = asyncio.run(synthesize(tts, missing))
     elapsed = time.time() - start
-    print(f"Processed {len(texts)} texts in {elapsed:.2f}s")
+    print(f"Processed {len(texts)} texts ({len(missing)} synthesized, {failed} failed) in {elapsed:.2f}s")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,97 @@
+"""Local stand-in for the ElevenLabs API, for exercising the TTS clients without a key.
+
+Usage:
+  python scripts/tts_stub_server.py --port 8765 --latency 0.3 --max-concurrent 4 --fail-rate 0.1
+  ELEVENLABS_API_KEY=stub ELEVENLABS_BASE_URL=http://127.0.0.1:8765 python scripts/benchmark_tts.py --n 100
+
+Serves GET /v1/voices and POST /v1/text-to-speech/<voice_id> (a silent WAV whose length
+grows with the text). Requests above --max-concurrent, and a random --fail-rate share of
+requests, get 429 with Retry-After so retry/backoff paths are exercised.
+"""
+import argparse
+import io
+import json
+import random
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+VOICES = [
+    {"voice_id": "stub-female-1", "name": "Stub Female", "labels": {"gender": "female"}},
+    {"voice_id": "stub-male-1", "name": "Stub Male", "labels": {"gender": "male"}},
+]
+
+
+def make_wav(seconds: float, sample_rate: int = 22050):
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(b"\x00\x00" * int(seconds * sample_rate))
+    return buf.getvalue()
+
+
+def make_handler(args):
+    in_flight = [0]
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body: bytes, content_type="application/json", headers=None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.startswith("/v1/voices"):
+                return self._send(200, json.dumps({"voices": VOICES}).encode())
+            self._send(404, b"{}")
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.startswith("/v1/text-to-speech/"):
+                return self._send(404, b"{}")
+            with lock:
+                busy = in_flight[0] >= args.max_concurrent
+                if not busy:
+                    in_flight[0] += 1
+            if busy or random.random() < args.fail_rate:
+                if not busy:
+                    with lock:
+                        in_flight[0] -= 1
+                return self._send(429, b'{"detail": "too_many_concurrent_requests"}', headers={"Retry-After": "0.2"})
+            try:
+                time.sleep(args.latency)
+                text = payload.get("text", "")
+                self._send(200, make_wav(0.05 * max(1, len(text.split()))), content_type="audio/wav")
+            finally:
+                with lock:
+                    in_flight[0] -= 1
+
+        def log_message(self, *a):
+            pass
+
+    return Handler
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--latency", type=float, default=0.3)
+    p.add_argument("--max-concurrent", type=int, default=4)
+    p.add_argument("--fail-rate", type=float, default=0.0)
+    args = p.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args))
+    print(f"ElevenLabs stub listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,364 @@
+import multiprocessing
+import os
+import queue
+import threading
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+try:
+    import whisper
+except Exception:
+    whisper = None
+
+try:
+    import torch
+except Exception:
+    torch = None
+
+SAMPLE_RATE = 16000
+# Whisper decodes fixed 30 s windows; shorter clips can share one batched forward pass
+WINDOW_SECONDS = 30
+
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "small")
+# comma separated model names loaded (and warmed up) when a worker process starts
+WHISPER_PRELOAD_MODELS = [m.strip() for m in os.getenv("WHISPER_PRELOAD_MODELS", "").split(",") if m.strip()]
+ASR_BATCH_SIZE = int(os.getenv("ASR_BATCH_SIZE", "8"))
+# how long the batcher waits for more requests before running a partial batch (seconds)
+ASR_BATCH_WAIT = float(os.getenv("ASR_BATCH_WAIT", "0.05"))
+ASR_THREADS = int(os.getenv("ASR_THREADS", "0"))
+# chunked transcription: process count and chunk length bounds (seconds)
+ASR_WORKERS = int(os.getenv("ASR_WORKERS", str(max(1, (os.cpu_count() or 1) // 2))))
+ASR_CHUNK_MIN = float(os.getenv("ASR_CHUNK_MIN", "60"))
+ASR_CHUNK_MAX = float(os.getenv("ASR_CHUNK_MAX", "180"))
+# audio longer than this (seconds) is split into chunks and transcribed in parallel
+ASR_CHUNKED_MIN_DURATION = float(os.getenv("ASR_CHUNKED_MIN_DURATION", "600"))
+
+_models = {}
+_models_lock = threading.Lock()
+_services = {}
+_services_lock = threading.Lock()
+
+
+def warm_up(model):
+    """Run one tiny transcription so lazy kernels/allocations happen before the first real job."""
+    model.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32), fp16=False)
+
+
+def get_model(name: str = None):
+    """Return a resident Whisper model, loading and warming it up once per process."""
+    name = name or WHISPER_MODEL
+    with _models_lock:
+        model = _models.get(name)
+        if model is None:
+            if whisper is None:
+                raise RuntimeError("Whisper is not installed")
+            if torch is not None and ASR_THREADS:
+                torch.set_num_threads(ASR_THREADS)
+            model = whisper.load_model(name)
+            warm_up(model)
+            _models[name] = model
+        return model
+
+
+def preload(names=None):
+    for name in names or WHISPER_PRELOAD_MODELS or [WHISPER_MODEL]:
+        get_service(name)
+
+
+def _load(audio):
+    if isinstance(audio, np.ndarray):
+        return audio.astype(np.float32, copy=False)
+    return whisper.load_audio(str(audio))
+
+
+def _segments_from_tokens(tokenizer, tokens, duration: float):
+    """Split a decoded token sequence on its timestamp tokens into transcript segments."""
+    ts_begin = tokenizer.timestamp_begin
+    segments = []
+    start = None
+    text_tokens = []
+    for tok in tokens:
+        if tok >= ts_begin:
+            t = (tok - ts_begin) * 0.02
+            if start is not None and text_tokens:
+                segments.append((start, t, text_tokens))
+                start, text_tokens = None, []
+            else:
+                start = t
+        else:
+            text_tokens.append(tok)
+    if text_tokens:
+        segments.append((start or 0.0, duration, text_tokens))
+    return [
+        {"id": i, "start": float(s), "end": float(min(e, duration)), "text": tokenizer.decode(toks)}
+        for i, (s, e, toks) in enumerate(segments)
+    ]
+
+
+class TranscriptionService:
+    """Resident Whisper model with a batching request queue.
+
+    Callers from any thread (Celery thread-pool tasks, web handlers) `submit` audio and get a
+    Future. A single service thread drains up to `batch_size` requests at a time: clips that fit
+    in one 30 s window are decoded together in one batched forward pass, longer audio goes
+    through `model.transcribe`. One process therefore holds one copy of the model and serves
+    many jobs concurrently.
+    """
+
+    def __init__(self, model_name: str = None, batch_size: int = ASR_BATCH_SIZE, batch_wait: float = ASR_BATCH_WAIT):
+        self.model_name = model_name or WHISPER_MODEL
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait
+        self.model = get_model(self.model_name)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name=f"asr-{self.model_name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, audio, **options):
+        fut = Future()
+        self._queue.put((audio, options, fut))
+        return fut
+
+    def transcribe(self, audio, **options):
+        return self.submit(audio, **options).result()
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get(timeout=self.batch_wait))
+            except queue.Empty:
+                pass
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        short, long = [], []
+        for audio, options, fut in batch:
+            if not fut.set_running_or_notify_cancel():
+                continue
+            try:
+                samples = _load(audio)
+            except Exception as e:
+                fut.set_exception(e)
+                continue
+            target = short if len(samples) <= WINDOW_SECONDS * SAMPLE_RATE and not options else long
+            target.append((samples, options, fut))
+
+        if short:
+            try:
+                results = self._decode_batch([s for s, _, _ in short])
+                for (_, _, fut), res in zip(short, results):
+                    fut.set_result(res)
+            except Exception:
+                # fall back to one-by-one so a single bad clip does not fail the whole batch
+                long.extend(short)
+
+        for samples, options, fut in long:
+            try:
+                fut.set_result(self.model.transcribe(samples, fp16=False, **options))
+            except Exception as e:
+                fut.set_exception(e)
+
+    def _decode_batch(self, clips):
+        model = self.model
+        mels = [
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(c), model.dims.n_mels)
+            for c in clips
+        ]
+        mel = torch.stack(mels).to(model.device)
+        _, probs = model.detect_language(mel)
+        languages = [max(p, key=p.get) for p in probs]
+        out = []
+        # decode per detected language group so each gets the right language token
+        for lang in set(languages):
+            idx = [i for i, l in enumerate(languages) if l == lang]
+            options = whisper.DecodingOptions(language=lang, fp16=False)
+            decoded = whisper.decode(model, mel[idx], options)
+            tokenizer = whisper.tokenizer.get_tokenizer(
+                model.is_multilingual, num_languages=model.num_languages, language=lang, task="transcribe"
+            )
+            for i, res in zip(idx, decoded):
+                duration = len(clips[i]) / SAMPLE_RATE
+                segments = _segments_from_tokens(tokenizer, res.tokens, duration)
+                for s in segments:
+                    s["avg_logprob"] = res.avg_logprob
+                    s["no_speech_prob"] = res.no_speech_prob
+                out.append((i, {"text": res.text, "segments": segments, "language": lang}))
+        return [r for _, r in sorted(out, key=lambda x: x[0])]
+
+
+def get_service(model_name: str = None):
+    """Return the process-wide TranscriptionService for `model_name`."""
+    name = model_name or WHISPER_MODEL
+    with _services_lock:
+        svc = _services.get(name)
+        if svc is None:
+            svc = TranscriptionService(name)
+            _services[name] = svc
+        return svc
+
+
+def frame_energy_db(samples, sample_rate: int, frame_ms: int = 30, block_frames: int = 20000):
+    """Per-frame RMS level in dBFS, computed block by block so long memmapped audio stays out of RAM."""
+    frame = max(1, int(sample_rate * frame_ms / 1000))
+    n_frames = len(samples) // frame
+    out = np.empty(n_frames, dtype=np.float32)
+    for b in range(0, n_frames, block_frames):
+        e = min(n_frames, b + block_frames)
+        block = np.asarray(samples[b * frame:e * frame], dtype=np.float32).reshape(-1, frame) / 32768.0
+        rms = np.sqrt(np.mean(block * block, axis=1))
+        out[b:e] = 20.0 * np.log10(np.maximum(rms, 1e-6))
+    return out, frame
+
+
+def split_on_silence(samples, sample_rate: int, min_chunk: float = ASR_CHUNK_MIN, max_chunk: float = ASR_CHUNK_MAX, frame_ms: int = 30):
+    """Return `(start, end)` sample ranges covering the audio, cut at the quietest point.
+
+    Each cut is placed at the lowest-energy stretch (smoothed over ~0.3 s) between `min_chunk`
+    and `max_chunk` seconds after the previous cut, so chunks end in pauses rather than mid-word.
+    """
+    total = len(samples)
+    energy, frame = frame_energy_db(samples, sample_rate, frame_ms)
+    if len(energy) == 0:
+        return [(0, total)] if total else []
+    smooth = max(1, int(300 / frame_ms))
+    energy = np.convolve(energy, np.ones(smooth, dtype=np.float32) / smooth, mode="same")
+
+    fps = sample_rate / frame
+    min_f, max_f = int(min_chunk * fps), max(int(max_chunk * fps), int(min_chunk * fps) + 1)
+    ranges = []
+    pos = 0
+    while len(energy) - pos > max_f:
+        window = energy[pos + min_f:pos + max_f]
+        cut = pos + min_f + int(np.argmin(window))
+        ranges.append((pos * frame, cut * frame))
+        pos = cut
+    ranges.append((pos * frame, total))
+    return ranges
+
+
+_chunk_model = None
+_chunk_pools = {}
+_chunk_pools_lock = threading.Lock()
+
+
+def _init_chunk_worker(model_name: str, threads: int):
+    global _chunk_model
+    if torch is not None and threads:
+        torch.set_num_threads(threads)
+    _chunk_model = whisper.load_model(model_name)
+    warm_up(_chunk_model)
+
+
+def get_chunk_pool(model_name: str = None):
+    """Return the process-wide chunk pool for `model_name` (ASR_WORKERS processes, each with a resident model).
+
+    Concurrent transcriptions in one worker share the pool, so their chunks queue up behind each
+    other instead of each call starting its own processes and loading the model again.
+    """
+    name = model_name or WHISPER_MODEL
+    with _chunk_pools_lock:
+        pool = _chunk_pools.get(name)
+        if pool is None:
+            workers = max(1, ASR_WORKERS)
+            # spawn, not fork: the caller is a threaded worker with torch loaded and a live service thread
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_chunk_worker,
+                                       initargs=(name, max(1, (os.cpu_count() or 1) // workers)),
+                                       mp_context=multiprocessing.get_context("spawn"))
+            _chunk_pools[name] = pool
+        return pool
+
+
+def _drop_chunk_pool(name: str, pool):
+    # a chunk process died (e.g. OOM): the next call starts a fresh pool
+    with _chunk_pools_lock:
+        if _chunk_pools.get(name) is pool:
+            del _chunk_pools[name]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _transcribe_chunk(audio_path: str, start: int, end: int, options: dict):
+    from src.audio import open_wav, to_float
+    samples, _ = open_wav(audio_path)
+    return _chunk_model.transcribe(to_float(samples[start:end]), fp16=False, **options)
+
+
+def _detect_chunk_language(audio_path: str, starts):
+    """Most likely language over 30 s windows starting at `starts` (Whisper's probabilities summed)."""
+    from src.audio import open_wav, to_float
+    samples, _ = open_wav(audio_path)
+    model = _chunk_model
+    mel = torch.stack([
+        whisper.log_mel_spectrogram(whisper.pad_or_trim(to_float(samples[s:s + WINDOW_SECONDS * SAMPLE_RATE])), model.dims.n_mels)
+        for s in starts
+    ]).to(model.device)
+    _, probs = model.detect_language(mel)
+    total = Counter()
+    for p in probs:
+        total.update(p)
+    return max(total, key=total.get)
+
+
+def stitch_results(results, offsets):
+    """Merge per-chunk Whisper results into one result with global timestamps."""
+    segments = []
+    texts = []
+    languages = Counter()
+    for res, offset in zip(results, offsets):
+        texts.append(res.get("text", ""))
+        if res.get("language"):
+            languages[res["language"]] += 1
+        for seg in res.get("segments", []):
+            seg = dict(seg)
+            seg["id"] = len(segments)
+            seg["start"] = float(seg.get("start", 0)) + offset
+            seg["end"] = float(seg.get("end", 0)) + offset
+            if "seek" in seg:
+                seg["seek"] = int(seg["seek"]) + int(offset * 100)
+            if seg.get("words"):
+                seg["words"] = [
+                    dict(w, start=float(w["start"]) + offset, end=float(w["end"]) + offset) for w in seg["words"]
+                ]
+            segments.append(seg)
+    return {
+        "text": "".join(texts),
+        "segments": segments,
+        "language": languages.most_common(1)[0][0] if languages else None,
+    }
+
+
+def transcribe_chunked(audio_path: str, model_name: str = None, **options):
+    """Transcribe a 16-bit PCM WAV in silence-split chunks across the chunk pool (see get_chunk_pool).
+
+    Each pool process keeps its model loaded and reads only its own chunk from the memmapped file,
+    so memory is bounded by chunk length and throughput scales with cores. The language is
+    detected once up front and used for every chunk. The result has the same shape as
+    `model.transcribe` (text/segments/language) with global timestamps.
+    """
+    from src.audio import open_wav
+    if whisper is None:
+        raise RuntimeError("Whisper is not installed")
+    model_name = model_name or WHISPER_MODEL
+    samples, sr = open_wav(audio_path)
+    if sr != SAMPLE_RATE or samples.ndim != 1:
+        raise RuntimeError("Chunked transcription expects 16 kHz mono audio from extract_audio")
+    ranges = split_on_silence(samples, sr)
+    total = len(samples)
+    del samples
+    pool = get_chunk_pool(model_name)
+    try:
+        if not options.get("language"):
+            # one language for the whole file (sampled at 25/50/75 %), so no chunk decodes in another one
+            window = WINDOW_SECONDS * SAMPLE_RATE
+            starts = [max(0, min(int(total * q) - window // 2, total - window)) for q in (0.25, 0.5, 0.75)]
+            options = dict(options, language=pool.submit(_detect_chunk_language, str(audio_path), starts).result())
+        futures = [pool.submit(_transcribe_chunk, str(audio_path), s, e, options) for s, e in ranges]
+        results = [f.result() for f in futures]
+    except BrokenProcessPool:
+        _drop_chunk_pool(model_name, pool)
+        raise
+    return stitch_results(results, [s / sr for s, _ in ranges])
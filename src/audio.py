@@ -0,0 +1,114 @@
+import os
+import struct
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+
+def open_wav(path: str):
+    """Memory-map the samples of a 16-bit PCM WAV (as written by `extract_audio`).
+
+    Returns `(samples, sample_rate)` where `samples` is a read-only int16 memmap of shape
+    (frames,) for mono or (frames, channels). Nothing is decoded or loaded up front, so slices
+    of multi-hour audio cost only the pages they touch.
+    """
+    path = Path(path)
+    file_size = path.stat().st_size
+    with path.open("rb") as f:
+        riff, _, wave_id = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave_id != b"WAVE":
+            raise RuntimeError(f"Not a WAV file: {path}")
+        channels = sample_rate = bits = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise RuntimeError(f"WAV file has no data chunk: {path}")
+            chunk_id, size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                fmt = f.read(size)
+                audio_format, channels, sample_rate = struct.unpack("<HHI", fmt[:8])
+                bits = struct.unpack("<H", fmt[14:16])[0]
+                if audio_format not in (1, 0xFFFE) or bits != 16:
+                    raise RuntimeError(f"Only 16-bit PCM WAV is supported: {path}")
+            elif chunk_id == b"data":
+                offset = f.tell()
+                # streamed writers leave the size unset; fall back to the actual file length
+                if size == 0 or offset + size > file_size:
+                    size = file_size - offset
+                break
+            else:
+                f.seek(size + (size & 1), 1)
+    if sample_rate is None:
+        raise RuntimeError(f"WAV file has no fmt chunk: {path}")
+    frames = size // (2 * channels)
+    shape = (frames,) if channels == 1 else (frames, channels)
+    samples = np.memmap(str(path), dtype="<i2", mode="r", offset=offset, shape=shape)
+    return samples, sample_rate
+
+
+def to_float(samples):
+    """Convert int16 PCM to float32 in [-1, 1)."""
+    return np.asarray(samples, dtype=np.float32) / 32768.0
+
+
+class PcmBuffer:
+    """Decoded job audio shared by all analysis stages (ASR, diarization, gender).
+
+    Backed by a memmap of the WAV produced once by `extract_audio`; stages slice it by
+    sample index instead of re-running ffmpeg or writing temp clips.
+    """
+
+    def __init__(self, samples, sample_rate: int):
+        if samples.ndim > 1:
+            samples = samples.mean(axis=1)
+        self.samples = samples
+        self.sample_rate = sample_rate
+
+    @classmethod
+    def from_wav(cls, path: str):
+        samples, sr = open_wav(path)
+        return cls(samples, sr)
+
+    @property
+    def duration(self):
+        return len(self.samples) / self.sample_rate
+
+    def index(self, seconds: float):
+        return min(max(int(round(float(seconds) * self.sample_rate)), 0), len(self.samples))
+
+    def slice(self, start: float, end: float):
+        """float32 samples between `start` and `end` seconds."""
+        return to_float(self.samples[self.index(start):self.index(end)])
+
+    def to_float(self):
+        return to_float(self.samples)
+
+
+# decoded buffers kept per process; the least recently used are dropped so long-running workers
+# do not hold a memmap (and its file descriptor) for every job they have processed
+PCM_CACHE_SIZE = int(os.getenv("PCM_CACHE_SIZE", "4"))
+
+_buffers = OrderedDict()
+_buffers_lock = threading.Lock()
+
+
+def load_pcm(path: str):
+    """Return the PcmBuffer for `path`, reusing it while the file is unchanged."""
+    path = Path(path)
+    st = path.stat()
+    key = str(path.resolve())
+    stamp = (st.st_size, st.st_mtime_ns)
+    with _buffers_lock:
+        cached = _buffers.get(key)
+        if cached and cached[0] == stamp:
+            _buffers.move_to_end(key)
+            return cached[1]
+    buf = PcmBuffer.from_wav(path)
+    with _buffers_lock:
+        _buffers[key] = (stamp, buf)
+        _buffers.move_to_end(key)
+        while len(_buffers) > max(PCM_CACHE_SIZE, 1):
+            _buffers.popitem(last=False)
+    return buf
@@ -1,8 +1,66 @@
 import os
 from celery import Celery
+from celery.signals import worker_process_init, worker_ready
 
 broker = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
 backend = os.getenv("CELERY_RESULT_BACKEND", broker)
 
-celery_app = Celery("anime", broker=broker, backend=backend)
-celery_app.conf.update(task_track_started=True)
+# with acks_late, Redis redelivers a task not acknowledged within this many seconds; it must exceed
+# the longest stage (e.g. ASR of a full-length movie) or a running stage starts on a second worker
+CELERY_VISIBILITY_TIMEOUT = int(os.getenv("CELERY_VISIBILITY_TIMEOUT", str(12 * 3600)))
+
+# job priority -> message priority (the Redis transport serves 0 first)
+PRIORITIES = {"high": 0, "normal": 5, "low": 9}
+
+# workers start with `-A src.celery_app.celery_app`, so the task module must be listed to get registered
+celery_app = Celery("anime", broker=broker, backend=backend, include=["src.tasks"])
+celery_app.conf.update(
+    task_track_started=True,
+    # per-stage tasks are long; reserve one at a time (raise with --prefetch-multiplier on I/O queues)
+    # and acknowledge after completion so a lost worker's stage is redelivered
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    task_default_priority=PRIORITIES["normal"],
+    broker_transport_options={"priority_steps": list(range(10)), "sep": ":", "queue_order_strategy": "priority",
+                              "visibility_timeout": CELERY_VISIBILITY_TIMEOUT},
+)
+
+
+def queue_depths(names):
+    """Messages waiting in each broker queue, summed over all priority levels (Redis broker only)."""
+    import redis
+    opts = celery_app.conf.broker_transport_options
+    sep = opts.get("sep", ":")
+    r = redis.Redis.from_url(broker)
+    with r.pipeline() as pipe:
+        for name in names:
+            # the Redis transport keeps one list per priority step; step 0 uses the bare queue name
+            for step in opts.get("priority_steps", [0]):
+                pipe.llen(f"{name}{sep}{step}" if step else name)
+        counts = pipe.execute()
+    per_queue = len(opts.get("priority_steps", [0]))
+    return {name: sum(counts[i * per_queue:(i + 1) * per_queue]) for i, name in enumerate(names)}
+
+
+def _preload_models():
+    # Dedicated analysis workers load and warm up their models before taking jobs
+    if os.getenv("WHISPER_PRELOAD_MODELS"):
+        from src.asr import preload
+        preload()
+    if os.getenv("DIARIZATION_PRELOAD"):
+        from src.diarize import get_pipeline
+        get_pipeline()
+
+
+@worker_process_init.connect
+def _preload_in_child(**kwargs):
+    # prefork pool: every child process gets its own resident model
+    _preload_models()
+
+
+@worker_ready.connect
+def _preload_in_worker(sender=None, **kwargs):
+    # threads/solo pools run tasks in the main process, which shares one model between threads
+    pool = getattr(sender, "pool", None)
+    if pool is not None and "prefork" not in type(pool).__module__:
+        _preload_models()
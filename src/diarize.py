@@ -1,4 +1,6 @@
+import json
 import os
+import threading
 from pathlib import Path
 
 try:
@@ -7,23 +9,72 @@ except Exception:
     Pipeline = None
 
 HUGGINGFACE_TOKEN = os.getenv("HUGGINGFACE_TOKEN")
+# Hub id, or a local directory / config.yaml for air-gapped workers (no token or network needed)
+DIARIZATION_MODEL = os.getenv("DIARIZATION_MODEL", "pyannote/speaker-diarization")
+DIARIZATION_DEVICE = os.getenv("DIARIZATION_DEVICE")
+DIARIZATION_MIN_SPEAKERS = int(os.getenv("DIARIZATION_MIN_SPEAKERS", "0")) or None
+DIARIZATION_MAX_SPEAKERS = int(os.getenv("DIARIZATION_MAX_SPEAKERS", "0")) or None
 
+_pipelines = {}
+_pipelines_lock = threading.Lock()
 
-def diarize_audio(audio_path: str, job_dir: str):
+
+def get_pipeline(model: str = None):
+    """Return the process-resident diarization pipeline, loading weights on first use only."""
+    model = model or DIARIZATION_MODEL
+    with _pipelines_lock:
+        pipeline = _pipelines.get(model)
+        if pipeline is not None:
+            return pipeline
+        if Pipeline is None:
+            raise RuntimeError("pyannote.audio is not installed or available")
+        local = Path(model)
+        if local.exists():
+            if local.is_dir():
+                local = local / "config.yaml"
+            pipeline = Pipeline.from_pretrained(str(local))
+        else:
+            if not HUGGINGFACE_TOKEN:
+                raise RuntimeError("HUGGINGFACE_TOKEN is required for pyannote pretrained pipelines")
+            pipeline = Pipeline.from_pretrained(model, use_auth_token=HUGGINGFACE_TOKEN)
+        if pipeline is None:
+            raise RuntimeError(f"Could not load diarization pipeline {model}")
+        if DIARIZATION_DEVICE:
+            import torch
+            pipeline.to(torch.device(DIARIZATION_DEVICE))
+        _pipelines[model] = pipeline
+        return pipeline
+
+
+def _pipeline_input(audio):
+    from src.audio import PcmBuffer
+    if isinstance(audio, PcmBuffer):
+        import torch
+        return {"waveform": torch.from_numpy(audio.to_float()).unsqueeze(0), "sample_rate": audio.sample_rate}
+    return str(audio)
+
+
+def diarize_audio(audio, job_dir: str, min_speakers: int = None, max_speakers: int = None, model: str = None):
     """Run speaker diarization using pyannote.audio Pipeline if available.
+    `audio` is a file path or an already decoded PcmBuffer (passed to pyannote as a waveform,
+    so the file is not decoded a second time). The pipeline is loaded once per process.
     Saves `diarization.json` containing segments with speaker labels.
     """
     job_dir = Path(job_dir)
     job_dir.mkdir(parents=True, exist_ok=True)
-    audio_path = str(audio_path)
-
-    if Pipeline is None:
-        raise RuntimeError("pyannote.audio is not installed or available")
-    if not HUGGINGFACE_TOKEN:
-        raise RuntimeError("HUGGINGFACE_TOKEN is required for pyannote pretrained pipelines")
 
-    pipeline = Pipeline.from_pretrained("pyannote/speaker-diarization", use_auth_token=HUGGINGFACE_TOKEN)
-    diarization = pipeline(audio_path)
+    pipeline = get_pipeline(model)
+    options = {}
+    min_speakers = min_speakers or DIARIZATION_MIN_SPEAKERS
+    max_speakers = max_speakers or DIARIZATION_MAX_SPEAKERS
+    if min_speakers and max_speakers and min_speakers == max_speakers:
+        options["num_speakers"] = min_speakers
+    else:
+        if min_speakers:
+            options["min_speakers"] = min_speakers
+        if max_speakers:
+            options["max_speakers"] = max_speakers
+    diarization = pipeline(_pipeline_input(audio), **options)
 
     segments = []
     for turn, _, speaker in diarization.itertracks(yield_label=True):
@@ -34,5 +85,5 @@ def diarize_audio(audio_path: str, job_dir: str):
         })
 
     out = {"segments": segments}
-    (job_dir / "diarization.json").write_text(str(out))
+    (job_dir / "diarization.json").write_text(json.dumps(out, ensure_ascii=False))
     return out
@@ -1,51 +1,124 @@
-import subprocess
-from pathlib import Path
+import os
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
-try:
-    import librosa
-except Exception:
-    librosa = None
-
-
-def extract_segment(audio_path: str, start: float, end: float, out_path: str):
-    # use ffmpeg to trim audio segment
-    cmd = [
-        "ffmpeg", "-y", "-i", str(audio_path), "-ss", str(start), "-to", str(end), "-ar", "16000", "-ac", "1", str(out_path)
-    ]
-    subprocess.run(cmd, check=True)
-
-
-def estimate_gender_from_wav(wav_path: str):
-    if librosa is None:
-        return "unknown"
-    y, sr = librosa.load(wav_path, sr=None)
-    # Use librosa.pyin for f0 estimation if available
-    try:
-        f0, voiced_flag, voiced_probs = librosa.pyin(y, fmin=50, fmax=500, sr=sr)
-        # f0 can be array; take median of voiced values
-        voiced = f0[~np.isnan(f0)]
-        if len(voiced) == 0:
-            return "unknown"
-        median_f0 = float(np.median(voiced))
-        # Basic heuristic thresholds (Hz): female > 160, male <= 160
-        return "female" if median_f0 > 160 else "male"
-    except Exception:
-        # fallback: use piptrack
-        try:
-            pitches, magnitudes = librosa.piptrack(y=y, sr=sr)
-            pitches = pitches[magnitudes > np.median(magnitudes)]
-            if len(pitches) == 0:
-                return "unknown"
-            median_f0 = float(np.median(pitches))
-            return "female" if median_f0 > 160 else "male"
-        except Exception:
-            return "unknown"
-
-
-def detect_speaker_gender(audio_path: str, start: float, end: float, job_dir: str):
-    job_dir = Path(job_dir)
-    job_dir.mkdir(parents=True, exist_ok=True)
-    sample = job_dir / f"gender_sample_{int(start*1000)}_{int(end*1000)}.wav"
-    extract_segment(audio_path, start, end, sample)
-    return estimate_gender_from_wav(str(sample))
+# Seconds of speech analysed per speaker (longest turns first)
+GENDER_MAX_SECONDS = float(os.getenv("GENDER_MAX_SECONDS", "10"))
+# Basic heuristic threshold (Hz): female > 160, male <= 160
+F0_THRESHOLD = 160.0
+# Below this share of agreeing voiced frames the suggestion is not auto-applied
+GENDER_MIN_CONFIDENCE = float(os.getenv("GENDER_MIN_CONFIDENCE", "0.6"))
+
+
+def _frames(y, frame_length: int, hop: int):
+    if len(y) < frame_length:
+        return np.empty((0, frame_length), dtype=np.float32)
+    return sliding_window_view(y, frame_length)[::hop]
+
+
+def yin_f0(frames, sr: int, fmin: float = 60.0, fmax: float = 400.0, threshold: float = 0.15):
+    """Vectorized YIN over a (n_frames, frame_length) matrix.
+
+    Returns (f0, voiced) arrays; all frames are processed in a handful of NumPy/FFT calls
+    instead of librosa.pyin's per-frame HMM.
+    """
+    n, length = frames.shape
+    tau_min = max(2, int(sr / fmax))
+    tau_max = min(int(sr / fmin), length // 2)
+    w = length - tau_max
+    if n == 0 or tau_max <= tau_min:
+        return np.zeros(n, dtype=np.float32), np.zeros(n, dtype=bool)
+    frames = frames - frames.mean(axis=1, keepdims=True)
+    nfft = 1 << int(np.ceil(np.log2(length + w)))
+    # r[t] = sum_j x[j] * x[j + t] over the first w samples, for every lag at once
+    spec = np.conj(np.fft.rfft(frames[:, :w], nfft)) * np.fft.rfft(frames, nfft)
+    r = np.fft.irfft(spec, nfft)[:, :tau_max + 1]
+    sq = np.concatenate([np.zeros((n, 1)), np.cumsum(frames * frames, axis=1)], axis=1)
+    lags = np.arange(tau_max + 1)
+    energy_lag = sq[:, lags + w] - sq[:, lags]
+    diff = np.maximum(sq[:, [w]] + energy_lag - 2.0 * r, 0.0)
+    # cumulative mean normalized difference
+    cum = np.cumsum(diff[:, 1:], axis=1)
+    cmnd = np.ones_like(diff)
+    cmnd[:, 1:] = diff[:, 1:] * lags[1:] / np.maximum(cum, 1e-12)
+
+    band = cmnd[:, tau_min:tau_max + 1]
+    below = band < threshold
+    # first dip under the threshold, otherwise the global minimum
+    first = np.where(below.any(axis=1), below.argmax(axis=1), band.argmin(axis=1))
+    # walk to the local minimum of that dip
+    rows = np.arange(n)
+    for _ in range(band.shape[1]):
+        nxt = np.minimum(first + 1, band.shape[1] - 1)
+        step = band[rows, nxt] < band[rows, first]
+        if not step.any():
+            break
+        first = np.where(step, nxt, first)
+    tau = (first + tau_min).astype(np.float64)
+    # parabolic interpolation around the chosen lag
+    i = np.clip(tau.astype(int), 1, tau_max - 1)
+    a, b, c = cmnd[rows, i - 1], cmnd[rows, i], cmnd[rows, i + 1]
+    denom = a - 2 * b + c
+    shift = np.where(np.abs(denom) > 1e-12, 0.5 * (a - c) / np.where(denom == 0, 1, denom), 0.0)
+    tau = i + np.clip(shift, -1, 1)
+    voiced = band[rows, first] < threshold
+    return (sr / tau).astype(np.float32), voiced
+
+
+def estimate_speaker_genders(pcm, turns, max_seconds: float = GENDER_MAX_SECONDS, frame_ms: float = 50.0, hop_ms: float = 20.0):
+    """Suggest a gender per diarized speaker in one vectorized pass.
+
+    For each speaker up to `max_seconds` of its longest turns are framed; loud frames of all
+    speakers are stacked into a single matrix and run through `yin_f0` together. Returns
+    `{speaker: {"suggested_gender", "gender_confidence", "median_f0", "turns", "duration"}}`
+    where confidence is the share of voiced frames that agree with the decision.
+    """
+    sr = pcm.sample_rate
+    frame_length = int(sr * frame_ms / 1000)
+    hop = max(1, int(sr * hop_ms / 1000))
+    by_speaker = {}
+    for t in turns:
+        by_speaker.setdefault(t["speaker"], []).append(t)
+
+    blocks, owners = [], []
+    for idx, spk_turns in enumerate(by_speaker.values()):
+        used = 0.0
+        for t in sorted(spk_turns, key=lambda t: t["end"] - t["start"], reverse=True):
+            if used >= max_seconds:
+                break
+            end = min(t["end"], t["start"] + max_seconds - used)
+            used += end - t["start"]
+            fr = _frames(pcm.slice(t["start"], end), frame_length, hop)
+            if len(fr):
+                blocks.append(fr)
+                owners.append(np.full(len(fr), idx, dtype=np.int32))
+
+    f0 = np.empty(0, dtype=np.float32)
+    voiced = np.empty(0, dtype=bool)
+    owner = np.empty(0, dtype=np.int32)
+    if blocks:
+        frames = np.concatenate(blocks).astype(np.float32)
+        owner = np.concatenate(owners)
+        # skip near-silent frames (relative to the loudest analysed frame) before pitch tracking
+        rms = np.sqrt(np.mean(frames * frames, axis=1))
+        loud = rms > max(float(rms.max()) * 0.05, 1e-4)
+        frames, owner = frames[loud], owner[loud]
+        f0, voiced = yin_f0(frames, sr)
+
+    speakers = {}
+    for idx, (spk, spk_turns) in enumerate(by_speaker.items()):
+        values = f0[(owner == idx) & voiced]
+        info = {
+            "suggested_gender": "unknown",
+            "gender_confidence": 0.0,
+            "median_f0": None,
+            "turns": len(spk_turns),
+            "duration": round(sum(t["end"] - t["start"] for t in spk_turns), 2),
+        }
+        if len(values):
+            median_f0 = float(np.median(values))
+            gender = "female" if median_f0 > F0_THRESHOLD else "male"
+            agree = np.mean(values > F0_THRESHOLD) if gender == "female" else np.mean(values <= F0_THRESHOLD)
+            info.update(suggested_gender=gender, gender_confidence=round(float(agree), 3), median_f0=round(median_f0, 1))
+        speakers[spk] = info
+    return speakers
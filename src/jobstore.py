@@ -0,0 +1,243 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import redis
+except Exception:
+    redis = None
+
+# Redis when a broker is configured (API and workers then share it), SQLite otherwise
+JOBSTORE_URL = os.getenv("JOBSTORE_URL") or os.getenv("CELERY_BROKER_URL")
+JOBSTORE_PATH = Path(os.getenv("JOBSTORE_PATH", "data/jobs.sqlite"))
+JOBSTORE_PREFIX = os.getenv("JOBSTORE_PREFIX", "anime:job:")
+UPLOAD_DIR = Path("data/uploads")
+
+# Fields are stored one per key so writers touching different fields never overwrite each other.
+# Nested values use dotted names ("errors.transcription", "progress.transcribe") and are
+# reassembled into dicts on read.
+
+
+def _flatten(fields: dict):
+    flat = {}
+    for name, value in fields.items():
+        if name in ("errors", "progress") and isinstance(value, dict):
+            for k, v in value.items():
+                flat[f"{name}.{k}"] = v
+        else:
+            flat[name] = value
+    return flat
+
+
+def _unflatten(flat: dict):
+    out = {}
+    for name, value in flat.items():
+        if "." in name:
+            group, key = name.split(".", 1)
+            out.setdefault(group, {})[key] = value
+        else:
+            out[name] = value
+    return out
+
+
+# HSET the fields and move the job between status indexes in one atomic step
+_REDIS_UPDATE = """
+local now = tonumber(ARGV[2])
+if ARGV[1] ~= '' then
+  local old = redis.call('HGET', KEYS[1], 'status')
+  if old then redis.call('ZREM', KEYS[2] .. cjson.decode(old), ARGV[3]) end
+  redis.call('ZADD', KEYS[2] .. ARGV[1], now, ARGV[3])
+end
+if redis.call('HEXISTS', KEYS[1], 'created') == 0 then
+  redis.call('HSET', KEYS[1], 'created', ARGV[2])
+  redis.call('ZADD', KEYS[2] .. '*', now, ARGV[3])
+end
+for i = 4, #ARGV, 2 do redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1]) end
+redis.call('HSET', KEYS[1], 'updated', ARGV[2])
+return 1
+"""
+
+
+class RedisJobStore:
+    """One hash per job plus one sorted set per status (scored by last change)."""
+
+    def __init__(self, url: str = JOBSTORE_URL, prefix: str = JOBSTORE_PREFIX):
+        self.r = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._update = self.r.register_script(_REDIS_UPDATE)
+
+    def _key(self, job_id: str):
+        return f"{self.prefix}{job_id}"
+
+    def update(self, job_id: str, fields: dict):
+        flat = _flatten(fields)
+        status = flat.get("status") or ""
+        args = [status, repr(time.time()), job_id]
+        for name, value in flat.items():
+            args += [name, json.dumps(value, ensure_ascii=False)]
+        self._update(keys=[self._key(job_id), f"{self.prefix}status:"], args=args)
+
+    def get(self, job_id: str):
+        raw = self.r.hgetall(self._key(job_id))
+        if not raw:
+            return None
+        return _unflatten({k.decode(): json.loads(v) for k, v in raw.items()})
+
+    def list(self, status: str = None, limit: int = 100, offset: int = 0):
+        ids = self.r.zrevrange(f"{self.prefix}status:{status or '*'}", offset, offset + limit - 1)
+        return [i.decode() for i in ids]
+
+    def count(self, status: str = None):
+        return self.r.zcard(f"{self.prefix}status:{status or '*'}")
+
+
+class SqliteJobStore:
+    """Same model on SQLite: a jobs row (status, timestamps) plus one row per field."""
+
+    def __init__(self, path: Path = JOBSTORE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY, status TEXT, created REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, updated)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_fields ("
+                " job_id TEXT NOT NULL, name TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (job_id, name))"
+            )
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _tx(self):
+        conn = self._db()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def update(self, job_id: str, fields: dict):
+        flat = _flatten(fields)
+        now = time.time()
+        with self._tx() as conn:
+            conn.execute("INSERT OR IGNORE INTO jobs (job_id, status, created, updated) VALUES (?, NULL, ?, ?)", (job_id, now, now))
+            if flat.get("status"):
+                conn.execute("UPDATE jobs SET status = ?, updated = ? WHERE job_id = ?", (flat["status"], now, job_id))
+            else:
+                conn.execute("UPDATE jobs SET updated = ? WHERE job_id = ?", (now, job_id))
+            conn.executemany(
+                "INSERT OR REPLACE INTO job_fields (job_id, name, value) VALUES (?, ?, ?)",
+                [(job_id, name, json.dumps(value, ensure_ascii=False)) for name, value in flat.items()],
+            )
+
+    def get(self, job_id: str):
+        conn = self._db()
+        row = conn.execute("SELECT created, updated FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        flat = {name: json.loads(value) for name, value in conn.execute("SELECT name, value FROM job_fields WHERE job_id = ?", (job_id,))}
+        flat["created"], flat["updated"] = row
+        return _unflatten(flat)
+
+    def list(self, status: str = None, limit: int = 100, offset: int = 0):
+        if status:
+            rows = self._db().execute(
+                "SELECT job_id FROM jobs WHERE status = ? ORDER BY updated DESC LIMIT ? OFFSET ?", (status, limit, offset)
+            )
+        else:
+            rows = self._db().execute("SELECT job_id FROM jobs ORDER BY created DESC LIMIT ? OFFSET ?", (limit, offset))
+        return [r[0] for r in rows]
+
+    def count(self, status: str = None):
+        if status:
+            return self._db().execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+        return self._db().execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            if redis is not None and JOBSTORE_URL and JOBSTORE_URL.startswith(("redis://", "rediss://")):
+                _store = RedisJobStore(JOBSTORE_URL)
+            else:
+                _store = SqliteJobStore(JOBSTORE_PATH)
+        return _store
+
+
+def create_job(job_id: str, meta: dict):
+    get_store().update(job_id, dict(meta, job_id=job_id))
+    if meta.get("status"):
+        _emit(job_id, "status", status=meta["status"])
+
+
+def get_job(job_id: str):
+    """Job state as a dict, or None. Jobs created before the store existed are imported from meta.json."""
+    job = get_store().get(job_id)
+    if job is None:
+        legacy = UPLOAD_DIR / job_id / "meta.json"
+        if legacy.exists():
+            create_job(job_id, json.loads(legacy.read_text()))
+            job = get_store().get(job_id)
+    return job
+
+
+def update_job(job_id: str, **fields):
+    """Atomically set the given fields; fields not named are left untouched."""
+    get_store().update(job_id, fields)
+
+
+def _emit(job_id: str, event_type: str, **data):
+    # mirror state changes into the job's event log for streaming clients (never fails the caller)
+    try:
+        from src.notify import append_event
+        append_event(UPLOAD_DIR / job_id, event_type, **data)
+    except Exception:
+        pass
+
+
+def set_status(job_id: str, status: str, **fields):
+    update_job(job_id, status=status, **fields)
+    _emit(job_id, "status", status=status)
+
+
+def record_error(job_id: str, where: str, message: str, status: str = None):
+    fields = {f"errors.{where}": str(message)}
+    if status:
+        fields["status"] = status
+    get_store().update(job_id, fields)
+    _emit(job_id, "error", where=where, message=str(message), **({"status": status} if status else {}))
+
+
+def set_progress(job_id: str, stage: str, percent: float):
+    percent = round(float(percent), 1)
+    get_store().update(job_id, {f"progress.{stage}": percent})
+    _emit(job_id, "progress", stage=stage, percent=percent)
+
+
+def list_jobs(status: str = None, limit: int = 100, offset: int = 0):
+    return get_store().list(status, limit, offset)
+
+
+def count_jobs(status: str = None):
+    return get_store().count(status)
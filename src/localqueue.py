@@ -0,0 +1,108 @@
+import multiprocessing
+import os
+import threading
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Without a broker, jobs run in worker processes next to the API (never in the web process itself):
+# LOCAL_WORKERS run at once and up to LOCAL_QUEUE_SIZE more wait; further submissions are refused
+LOCAL_WORKERS = int(os.getenv("LOCAL_WORKERS", "1"))
+LOCAL_QUEUE_SIZE = int(os.getenv("LOCAL_QUEUE_SIZE", "8"))
+
+
+class QueueFull(RuntimeError):
+    pass
+
+
+def process_video(job_id: str, file_path: str, meta: dict):
+    """Full pipeline for one job (runs in a pool process)."""
+    from src.jobstore import record_error
+    try:
+        from src.processor import process_job
+        process_job(job_id, file_path, meta)
+    except Exception as e:
+        record_error(job_id, "process_video", e, status="failed")
+
+
+def process_synthesize_with_mapping(job_id: str, mapping: dict):
+    """Re-run synthesis with a new speaker mapping (runs in a pool process)."""
+    from src.jobstore import get_job, set_status, record_error
+    from src.processor import synthesize_and_mix
+    try:
+        job_dir = os.path.join("data/uploads", job_id)
+        meta = get_job(job_id) or {}
+        original = os.path.join(job_dir, meta.get("filename"))
+        set_status(job_id, "synthesizing")
+        out = synthesize_and_mix(job_dir, original, voice_gender=meta.get("voice_gender", "auto"),
+                                 use_translated=meta.get("translate", True), speakers_map=mapping)
+        set_status(job_id, "done", output=str(out))
+    except Exception as e:
+        record_error(job_id, "synthesize_with_mapping", e, status="failed")
+
+
+class LocalExecutor:
+    """Process pool with a bounded backlog; `submit` raises QueueFull instead of queueing without limit."""
+
+    def __init__(self, workers: int = LOCAL_WORKERS, queue_size: int = LOCAL_QUEUE_SIZE):
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self._pool = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        if self._pool is None:
+            # spawn: a forked copy of the web process (event loop, sockets, threads) is never reused
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def _done(self, job_id, fut):
+        exc = None if fut.cancelled() else fut.exception()
+        with self._lock:
+            self._pending -= 1
+            if isinstance(exc, BrokenProcessPool):
+                # a worker died (e.g. OOM); start a fresh pool for the next job
+                self._pool = None
+        if exc is not None:
+            # the job functions record their own errors, so this is a crashed worker: fail the job
+            # instead of leaving it in its last status forever
+            from src.jobstore import record_error
+            record_error(job_id, "local_worker", f"Worker process failed: {exc!r}", status="failed")
+
+    def submit(self, fn, job_id, *args):
+        """Run `fn(job_id, *args)` in the pool."""
+        with self._lock:
+            if self._pending >= self.workers + self.queue_size:
+                raise QueueFull("Local job queue is full")
+            self._pending += 1
+            try:
+                fut = self._get_pool().submit(fn, job_id, *args)
+            except Exception:
+                self._pending -= 1
+                self._pool = None
+                raise
+        fut.add_done_callback(partial(self._done, job_id))
+        return fut
+
+    def depth(self):
+        with self._lock:
+            pending = self._pending
+        return {
+            "running": min(pending, self.workers),
+            "queued": max(pending - self.workers, 0),
+            "workers": self.workers,
+            "capacity": self.workers + self.queue_size,
+        }
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = LocalExecutor()
+        return _executor
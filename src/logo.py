@@ -1,4 +1,8 @@
+import os
+import shutil
 import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 POS_MAP = {
@@ -32,3 +36,104 @@ def overlay_logo(video_path: str, logo_path: str, out_path: str, position: str =
     ]
     subprocess.run(cmd, check=True)
     return out_path
+
+
+def _logo_filter(position: str, scale: float, logo_input: int = 1, video_label: str = "0:v"):
+    pos = POS_MAP.get(position, POS_MAP["bottom-left"])
+    return f"[{logo_input}]scale=trunc(iw*{scale}):-1[logo];[{video_label}][logo]overlay={pos}"
+
+
+def split_at_keyframes(video_path: str, out_dir: str, segments: int):
+    """Cut the video stream (no audio) into ~`segments` GOP-aligned chunks without re-encoding.
+
+    The stream-copy segmenter can only cut on keyframes, so every chunk starts with one and
+    the chunks can be encoded independently and concatenated back losslessly.
+    """
+    from src.mixer import probe_duration
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    duration = probe_duration(video_path) or 0
+    seg_time = max(duration / max(segments, 1), 1.0)
+    cmd = [
+        "ffmpeg", "-y", "-v", "error", "-i", str(video_path), "-map", "0:v:0", "-an", "-c", "copy",
+        "-f", "segment", "-segment_time", f"{seg_time:.3f}", "-reset_timestamps", "1",
+        str(out_dir / "chunk_%04d.mp4"),
+    ]
+    subprocess.run(cmd, check=True)
+    return sorted(str(p) for p in out_dir.glob("chunk_*.mp4"))
+
+
+def _encode_chunk(chunk: str, logo_path: str, out_path: str, position: str, scale: float, preset: str, crf: int, threads: int):
+    cmd = [
+        "ffmpeg", "-y", "-v", "error", "-i", chunk, "-i", logo_path,
+        "-filter_complex", _logo_filter(position, scale), "-an",
+        "-c:v", "libx264", "-preset", preset, "-crf", str(crf), "-pix_fmt", "yuv420p", "-threads", str(threads),
+        out_path,
+    ]
+    subprocess.run(cmd, check=True)
+    return out_path
+
+
+def _single_pass(video_path, logo_path, out_path, position, scale, audio_path, audio_filter, preset, crf, audio_bitrate):
+    cmd = ["ffmpeg", "-y", "-v", "error", "-i", str(video_path), "-i", str(logo_path)]
+    filters = [_logo_filter(position, scale) + "[v]"]
+    if audio_path:
+        cmd += ["-i", str(audio_path)]
+        filters.append(f"[2:a]{audio_filter or 'anull'}[a]")
+        audio = ["-map", "[a]", "-c:a", "aac", "-b:a", audio_bitrate, "-shortest"]
+    else:
+        audio = ["-map", "0:a?", "-c:a", "copy"]
+    cmd += ["-filter_complex", ";".join(filters), "-map", "[v]"] + audio
+    cmd += ["-c:v", "libx264", "-preset", preset, "-crf", str(crf), "-pix_fmt", "yuv420p", "-movflags", "+faststart", str(out_path)]
+    subprocess.run(cmd, check=True)
+
+
+def overlay_logo_parallel(video_path: str, logo_path: str, out_path: str, position: str = "bottom-left", scale: float = 0.15,
+                          segments: int = None, workers: int = None, audio_path: str = None, audio_filter: str = None,
+                          preset: str = "veryfast", crf: int = 20, audio_bitrate: str = None):
+    """Split-encode-concat logo overlay for long videos.
+
+    The video is cut at keyframes into `segments` chunks, each chunk is overlaid and encoded by
+    its own ffmpeg process (`workers` at a time, threads split between them), and the results
+    are joined with the concat demuxer (stream copy). Audio comes from `audio_path` (optionally
+    through `audio_filter`, encoded at `audio_bitrate`) or is copied from the source.
+    """
+    if audio_bitrate is None:
+        from src.render import RENDER_AUDIO_BITRATE
+        audio_bitrate = RENDER_AUDIO_BITRATE
+    cpus = os.cpu_count() or 1
+    workers = workers or cpus
+    segments = segments or workers
+    out_path = Path(out_path)
+    work = Path(tempfile.mkdtemp(prefix="logo_", dir=str(out_path.parent)))
+    try:
+        chunks = split_at_keyframes(video_path, work / "src", segments)
+        if not chunks:
+            # the segmenter produced nothing to split: overlay in a single ffmpeg run instead
+            _single_pass(video_path, logo_path, out_path, position, scale, audio_path, audio_filter, preset, crf, audio_bitrate)
+            return str(out_path)
+        threads = max(1, cpus // min(workers, len(chunks)))
+        encoded = [str(work / f"enc_{i:04d}.mp4") for i in range(len(chunks))]
+        # each job is an ffmpeg process; the pool only bounds how many run at once
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            list(ex.map(lambda a: _encode_chunk(*a), [
+                (c, str(logo_path), e, position, scale, preset, crf, threads) for c, e in zip(chunks, encoded)
+            ]))
+        listing = work / "concat.txt"
+        listing.write_text("".join(f"file '{Path(e).resolve()}'\n" for e in encoded))
+
+        cmd = ["ffmpeg", "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", str(listing)]
+        if audio_path:
+            cmd += ["-i", str(audio_path)]
+            if audio_filter:
+                cmd += ["-filter_complex", f"[1:a]{audio_filter}[a]", "-map", "0:v:0", "-map", "[a]"]
+            else:
+                cmd += ["-map", "0:v:0", "-map", "1:a:0"]
+            cmd += ["-c:v", "copy", "-c:a", "aac", "-b:a", audio_bitrate, "-shortest"]
+        else:
+            cmd += ["-i", str(video_path), "-map", "0:v:0", "-map", "1:a?", "-c", "copy"]
+        cmd += ["-movflags", "+faststart", str(out_path)]
+        subprocess.run(cmd, check=True)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    return str(out_path)
@@ -1,13 +1,28 @@
-from fastapi import FastAPI, UploadFile, File, Form, BackgroundTasks, HTTPException
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from pydantic import BaseModel
 from pathlib import Path
+import asyncio
+import fcntl
+import hashlib
+import os
 import uuid
-import shutil
 import json
 
+import aiofiles
+import aiofiles.os
+
+from src.jobstore import create_job, get_job, update_job, set_status, record_error, list_jobs, count_jobs
+from src.localqueue import get_executor, QueueFull, process_video, process_synthesize_with_mapping
+
 UPLOAD_DIR = Path("data/uploads")
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+# chunk size used when streaming uploads to disk, and the size suggested to chunked-upload clients
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+# event stream: how often the job's event log is checked for new lines, and keep-alive period (seconds)
+EVENTS_POLL_INTERVAL = float(os.getenv("EVENTS_POLL_INTERVAL", "0.25"))
+EVENTS_KEEPALIVE = float(os.getenv("EVENTS_KEEPALIVE", "15"))
+TERMINAL_STATUSES = ("done", "failed")
 
 app = FastAPI(title="Anime AI Озвучка - API")
 
@@ -30,170 +45,418 @@ class UploadResponse(BaseModel):
     status: str
 
 
-def save_upload(file: UploadFile, dest: Path):
-    with dest.open("wb") as f:
-        shutil.copyfileobj(file.file, f)
+async def save_upload(file: UploadFile, dest: Path):
+    async with aiofiles.open(dest, "wb") as f:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            await f.write(chunk)
+
+
+# The API only does async file I/O; job store, broker and filesystem scans run in threads
+# (asyncio.to_thread), and pipeline work always runs elsewhere: on Celery workers, or without a
+# broker in the bounded local process pool (src.localqueue), which answers 429 when it is full.
+
+
+def _check_local_capacity():
+    if not os.getenv("CELERY_BROKER_URL"):
+        depth = get_executor().depth()
+        if depth["running"] + depth["queued"] >= depth["capacity"]:
+            raise HTTPException(status_code=429, detail="Job queue is full", headers={"Retry-After": "30"})
+
+
+def _submit_local(fn, job_id: str, *args):
+    try:
+        get_executor().submit(fn, job_id, *args)
+    except QueueFull:
+        raise HTTPException(status_code=429, detail="Job queue is full", headers={"Retry-After": "30"})
+
+
+async def _enqueue_job(job_id: str, file_path: Path, meta: dict, fail_when_full: bool = True):
+    """Enqueue background processing: prefer Celery if configured, else the local process pool.
+
+    A full local queue raises 429; the job is marked failed unless `fail_when_full` is False
+    (the caller can still retry).
+    """
+    if os.getenv("CELERY_BROKER_URL"):
+        try:
+            from src.tasks import enqueue_job
+            await asyncio.to_thread(enqueue_job, job_id, str(file_path), meta.get("priority"))
+            await asyncio.to_thread(update_job, job_id, events=["enqueued_via_celery"])
+            return
+        except Exception:
+            # broker unavailable: fall back to the local pool
+            pass
+    try:
+        _submit_local(process_video, job_id, str(file_path), meta)
+    except HTTPException:
+        if fail_when_full:
+            await asyncio.to_thread(record_error, job_id, "queue", "Job queue is full", "failed")
+        raise
 
 
 @app.post("/api/upload", response_model=UploadResponse)
-async def upload_video(background_tasks: BackgroundTasks,
-                       file: UploadFile = File(...),
+async def upload_video(file: UploadFile = File(...),
                        target_language: str = Form(...),
                        translate: bool = Form(True),
                        voice_gender: str = Form("auto"),
                        add_logo: bool = Form(False),
                        logo: UploadFile = File(None),
                        logo_position: str = Form("bottom-left"),
+                       translate_backend: str = Form(None),
+                       tts_backend: str = Form(None),
+                       priority: str = Form("normal"),
                        ):
     # Basic validation
     if not file.content_type or not file.content_type.startswith("video"):
         raise HTTPException(status_code=400, detail="Uploaded file is not a video")
+    _check_local_capacity()
 
     job_id = uuid.uuid4().hex
     job_dir = UPLOAD_DIR / job_id
-    job_dir.mkdir(parents=True, exist_ok=True)
-    file_path = job_dir / file.filename
-    save_upload(file, file_path)
+    await aiofiles.os.makedirs(job_dir, exist_ok=True)
+    file_path = job_dir / Path(file.filename).name
+    await save_upload(file, file_path)
 
     meta = {
         "job_id": job_id,
-        "filename": file.filename,
+        "filename": file_path.name,
         "target_language": target_language,
         "translate": translate,
         "voice_gender": voice_gender,
         "status": "queued",
     }
+    if translate_backend:
+        meta["translate_backend"] = translate_backend
+    if tts_backend:
+        meta["tts_backend"] = tts_backend
+    if priority in ("high", "normal", "low"):
+        meta["priority"] = priority
 
     if add_logo and logo is not None:
-        logo_path = job_dir / f"logo_{logo.filename}"
-        save_upload(logo, logo_path)
+        logo_path = job_dir / f"logo_{Path(logo.filename).name}"
+        await save_upload(logo, logo_path)
         meta["logo"] = str(logo_path)
         meta["logo_position"] = logo_position
 
-    (job_dir / "meta.json").write_text(json.dumps(meta))
+    await asyncio.to_thread(create_job, job_id, meta)
 
-    # Enqueue background processing: prefer Celery if configured
-    import os as _os
-    if _os.getenv("CELERY_BROKER_URL"):
-        try:
-            from src.tasks import process_video_task
-            process_video_task.delay(job_id, str(file_path))
-            meta.setdefault("events", []).append("enqueued_via_celery")
-            (job_dir / "meta.json").write_text(json.dumps(meta))
-        except Exception as e:
-            # fallback to background task
-            background_tasks.add_task(process_video, job_id, str(file_path), meta)
-    else:
-        background_tasks.add_task(process_video, job_id, str(file_path), meta)
+    await _enqueue_job(job_id, file_path, meta)
 
     # Return job info
-    return UploadResponse(job_id=job_id, filename=file.filename, status="queued")
+    return UploadResponse(job_id=job_id, filename=file_path.name, status="queued")
+
+
+# Resumable chunked uploads: init -> PUT chunks at byte offsets -> finalize with checksum.
+# A client that loses its connection asks for the current offset and continues from there.
+
+class ChunkedUploadInit(BaseModel):
+    filename: str
+    size: int
+    target_language: str
+    translate: bool = True
+    voice_gender: str = "auto"
+    translate_backend: str = None
+    tts_backend: str = None
+    priority: str = "normal"
+
+
+class ChunkedUploadFinalize(BaseModel):
+    sha256: str = None
+
+
+async def _upload_state(upload_id: str):
+    try:
+        async with aiofiles.open(UPLOAD_DIR / upload_id / "upload.json") as f:
+            return json.loads(await f.read())
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+
+def _part_path(upload_id: str, state: dict):
+    return UPLOAD_DIR / upload_id / (state["filename"] + ".part")
 
-    return UploadResponse(job_id=job_id, filename=file.filename, status="queued")
 
+def _lock_part(part: Path):
+    """Non-blocking exclusive flock on the part file, shared by every API process; None if already held.
 
-def process_video(job_id: str, file_path: str, meta: dict):
-    """Compatibility wrapper: delegate to centralized processor.process_job."""
+    The lock is released when the returned descriptor is closed (or the process dies), so an abandoned
+    upload leaves nothing behind."""
+    try:
+        fd = os.open(part, os.O_RDWR)
+    except FileNotFoundError:
+        raise HTTPException(status_code=409, detail="Upload already finalized")
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _upload_busy(part: Path):
+    return JSONResponse({"detail": "Upload is busy", "offset": os.stat(part).st_size}, status_code=409)
+
+
+@app.post("/api/uploads")
+async def init_chunked_upload(body: ChunkedUploadInit):
+    if body.size <= 0:
+        raise HTTPException(status_code=400, detail="size must be positive")
+    _check_local_capacity()
+    upload_id = uuid.uuid4().hex
+    job_dir = UPLOAD_DIR / upload_id
+    await aiofiles.os.makedirs(job_dir, exist_ok=True)
+    state = body.dict()
+    state["filename"] = Path(body.filename).name
+    state["status"] = "uploading"
+    async with aiofiles.open(job_dir / "upload.json", "w") as f:
+        await f.write(json.dumps(state))
+    async with aiofiles.open(_part_path(upload_id, state), "wb"):
+        pass
+    return {"upload_id": upload_id, "offset": 0, "size": body.size, "chunk_size": UPLOAD_CHUNK_SIZE}
+
+
+@app.get("/api/uploads/{upload_id}")
+async def chunked_upload_status(upload_id: str):
+    state = await _upload_state(upload_id)
+    part = _part_path(upload_id, state)
+    offset = (await aiofiles.os.stat(part)).st_size if await aiofiles.os.path.exists(part) else state["size"]
+    return {"upload_id": upload_id, "offset": offset, "size": state["size"], "status": state["status"]}
+
+
+@app.put("/api/uploads/{upload_id}")
+async def put_upload_chunk(upload_id: str, offset: int, request: Request):
+    """Append the raw request body at `offset`; the offset must equal the bytes received so far."""
+    state = await _upload_state(upload_id)
+    if state["status"] != "uploading":
+        raise HTTPException(status_code=409, detail="Upload already finalized")
+    part = _part_path(upload_id, state)
+    # a PUT for the same upload in flight (in this or another API process) gets the same 409 as a stale offset
+    fd = _lock_part(part)
+    if fd is None:
+        return _upload_busy(part)
+    try:
+        current = (await aiofiles.os.stat(part)).st_size
+        if offset != current:
+            return JSONResponse({"detail": "Offset mismatch", "offset": current}, status_code=409)
+        written = current
+        async with aiofiles.open(part, "r+b") as f:
+            await f.seek(current)
+            async for chunk in request.stream():
+                if written + len(chunk) > state["size"]:
+                    await f.truncate(current)
+                    raise HTTPException(status_code=413, detail="Chunk exceeds declared upload size")
+                await f.write(chunk)
+                written += len(chunk)
+    finally:
+        os.close(fd)
+    return {"upload_id": upload_id, "offset": written, "size": state["size"]}
+
+
+async def _sha256_file(path: Path):
+    h = hashlib.sha256()
+    async with aiofiles.open(path, "rb") as f:
+        while True:
+            block = await f.read(UPLOAD_CHUNK_SIZE)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+@app.post("/api/uploads/{upload_id}/finalize", response_model=UploadResponse)
+async def finalize_chunked_upload(upload_id: str, body: ChunkedUploadFinalize):
+    """Turn a complete upload into a queued job; on 429 the upload stays open so finalize can be retried."""
+    state = await _upload_state(upload_id)
+    if state["status"] != "uploading":
+        raise HTTPException(status_code=409, detail="Upload already finalized")
+    job_dir = UPLOAD_DIR / upload_id
+    part = _part_path(upload_id, state)
+    fd = _lock_part(part)
+    if fd is None:
+        return _upload_busy(part)
     try:
-        from src.processor import process_job
-        process_job(job_id, file_path, meta)
-    except Exception as e:
-        job_dir = UPLOAD_DIR / job_id
-        meta.setdefault("errors", {})["process_video"] = str(e)
-        meta["status"] = "failed"
-        (job_dir / "meta.json").write_text(json.dumps(meta))
+        if not await aiofiles.os.path.exists(part):
+            raise HTTPException(status_code=409, detail="Upload already finalized")
+        size = (await aiofiles.os.stat(part)).st_size
+        if size != state["size"]:
+            return JSONResponse({"detail": "Upload incomplete", "offset": size}, status_code=409)
+        if body.sha256 and (await _sha256_file(part)) != body.sha256.lower():
+            raise HTTPException(status_code=422, detail="Checksum mismatch")
+        _check_local_capacity()
+
+        meta = {
+            "job_id": upload_id,
+            "filename": state["filename"],
+            "target_language": state["target_language"],
+            "translate": state["translate"],
+            "voice_gender": state["voice_gender"],
+            "status": "queued",
+        }
+        for key in ("translate_backend", "tts_backend", "priority"):
+            if state.get(key):
+                meta[key] = state[key]
+        file_path = job_dir / state["filename"]
+        await aiofiles.os.rename(part, file_path)
+        await asyncio.to_thread(create_job, upload_id, meta)
+        try:
+            await _enqueue_job(upload_id, file_path, meta, fail_when_full=False)
+        except HTTPException:
+            # the queue filled up since the capacity check: reopen the upload for a retried finalize
+            await aiofiles.os.rename(file_path, part)
+            raise
+        state["status"] = "complete"
+        async with aiofiles.open(job_dir / "upload.json", "w") as f:
+            await f.write(json.dumps(state))
+    finally:
+        os.close(fd)
+    return UploadResponse(job_id=upload_id, filename=state["filename"], status="queued")
 
 
 @app.get("/api/job/{job_id}")
-def get_job_status(job_id: str):
-    job_dir = UPLOAD_DIR / job_id
-    meta_file = job_dir / "meta.json"
-    if not meta_file.exists():
+async def get_job_status(job_id: str):
+    job = await asyncio.to_thread(get_job, job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
-    return json.loads(meta_file.read_text())
+    return job
+
+
+@app.get("/api/jobs")
+async def list_jobs_by_status(status: str = None, limit: int = 100, offset: int = 0):
+    """Job ids with the given status (or all jobs), most recently changed first."""
+    limit = max(1, min(limit, 1000))
+    total = await asyncio.to_thread(count_jobs, status)
+    jobs = await asyncio.to_thread(list_jobs, status, limit, max(offset, 0))
+    return {"status": status, "total": total, "jobs": jobs}
+
+
+@app.get("/api/queue")
+async def queue_depth():
+    """Waiting/running work: per-queue message counts on the broker, or the local pool's load."""
+    if os.getenv("CELERY_BROKER_URL"):
+        from src.celery_app import queue_depths
+        from src.processor import JOB_STEPS
+        names = ["celery"] + sorted({queue for queue, _ in JOB_STEPS})
+        try:
+            return {"backend": "celery", "queues": await asyncio.to_thread(queue_depths, names)}
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"Broker unavailable: {e}")
+    return {"backend": "local", **get_executor().depth()}
 
 
 @app.get("/api/job/{job_id}/notifications")
-def get_notifications(job_id: str):
+async def get_notifications(job_id: str):
     job_dir = UPLOAD_DIR / job_id
     from src.notify import get_notifications
-    return get_notifications(job_dir)
+    return await asyncio.to_thread(get_notifications, job_dir)
+
+
+@app.get("/api/job/{job_id}/events")
+async def stream_events(job_id: str, request: Request, offset: int = 0):
+    """Server-sent events for a job: stage progress, status changes, errors and notifications.
+
+    Every event's `id` is its byte offset in the job's event log; reconnecting with
+    `?offset=<id>` (or the `Last-Event-ID` header EventSource sends automatically) resumes right
+    after it. The stream ends once the job is done/failed and all events were sent.
+    """
+    from src.notify import EVENTS_FILE, parse_events
+    job = await asyncio.to_thread(get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    last_id = request.headers.get("last-event-id")
+    if last_id and last_id.isdigit():
+        offset = int(last_id)
+    path = UPLOAD_DIR / job_id / EVENTS_FILE
+
+    async def events():
+        # a reconnect after the final event must end right away instead of polling forever
+        pos, idle, finished = max(offset, 0), 0.0, job.get("status") in TERMINAL_STATUSES
+        yield "retry: 1000\n\n"
+        while not await request.is_disconnected():
+            size = (await aiofiles.os.stat(path)).st_size if await aiofiles.os.path.exists(path) else 0
+            if size > pos:
+                async with aiofiles.open(path, "rb") as f:
+                    await f.seek(pos)
+                    chunk = await f.read(size - pos)
+                batch = parse_events(chunk, pos)
+                for next_offset, event in batch:
+                    pos = next_offset
+                    # status changes and errors that fail the job both carry `status`
+                    if event.get("status"):
+                        finished = event["status"] in TERMINAL_STATUSES
+                    yield f"id: {pos}\nevent: {event.get('type', 'message')}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+                if batch:
+                    idle = 0.0
+                    continue
+            elif finished:
+                break
+            await asyncio.sleep(EVENTS_POLL_INTERVAL)
+            idle += EVENTS_POLL_INTERVAL
+            if idle >= EVENTS_KEEPALIVE:
+                idle = 0.0
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @app.get("/api/job/{job_id}/download")
-def download_result(job_id: str):
+async def download_result(job_id: str):
     job_dir = UPLOAD_DIR / job_id
-    meta_file = job_dir / "meta.json"
-    if meta_file.exists():
-        meta = json.loads(meta_file.read_text())
-        if meta.get("s3_url"):
-            return {"s3_url": meta.get("s3_url")}
-    out_files = list(job_dir.glob("*_processed.mp4"))
+    meta = await asyncio.to_thread(get_job, job_id)
+    if meta and meta.get("s3_url"):
+        return {"s3_url": meta.get("s3_url")}
+    out_files = await asyncio.to_thread(lambda: list(job_dir.glob("*_processed.mp4")))
     if not out_files:
         raise HTTPException(status_code=404, detail="Output not ready")
     return FileResponse(out_files[0], filename=out_files[0].name, media_type="video/mp4")
 
 
+async def _read_json(path: Path, detail: str):
+    try:
+        async with aiofiles.open(path) as f:
+            return json.loads(await f.read())
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=detail)
+
+
 @app.get("/api/job/{job_id}/transcript")
-def get_transcript(job_id: str):
-    job_dir = UPLOAD_DIR / job_id
-    tfile = job_dir / "transcript.json"
-    if not tfile.exists():
-        raise HTTPException(status_code=404, detail="Transcript not found or not ready")
-    return json.loads(tfile.read_text())
+async def get_transcript(job_id: str):
+    return await _read_json(UPLOAD_DIR / job_id / "transcript.json", "Transcript not found or not ready")
 
 
 @app.get("/api/job/{job_id}/speakers")
-def get_speakers(job_id: str):
-    job_dir = UPLOAD_DIR / job_id
-    sfile = job_dir / "speakers.json"
-    if not sfile.exists():
-        raise HTTPException(status_code=404, detail="Speakers info not ready")
-    return json.loads(sfile.read_text())
+async def get_speakers(job_id: str):
+    return await _read_json(UPLOAD_DIR / job_id / "speakers.json", "Speakers info not ready")
 
 
 @app.post("/api/job/{job_id}/assign_voices")
-def assign_voices(job_id: str, mapping: dict):
+async def assign_voices(job_id: str, mapping: dict):
     """Accepts JSON like {"speaker1": {"gender":"female"}, "speaker2": "male"} or voice ids.
     Saves mapping and starts TTS re-synthesis in background.
     """
     job_dir = UPLOAD_DIR / job_id
-    if not (job_dir / "meta.json").exists():
+    job = await asyncio.to_thread(get_job, job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
-    (job_dir / "speakers_mapping.json").write_text(json.dumps(mapping, ensure_ascii=False))
+    async with aiofiles.open(job_dir / "speakers_mapping.json", "w") as f:
+        await f.write(json.dumps(mapping, ensure_ascii=False))
 
-    # enqueue synthesize with mapping (prefer Celery)
-    import os as _os
-    if _os.getenv("CELERY_BROKER_URL"):
+    # set before returning so event streams opened right after this call follow the re-synthesis
+    await asyncio.to_thread(set_status, job_id, "synthesizing")
+    # enqueue synthesize -> render -> upload on their queues (prefer Celery)
+    if os.getenv("CELERY_BROKER_URL"):
         try:
-            from src.tasks import synthesize_with_mapping_task
-            synthesize_with_mapping_task.delay(job_id, mapping)
+            from src.tasks import enqueue_resynthesis
+            await asyncio.to_thread(enqueue_resynthesis, job_id, str(job_dir / job["filename"]), job.get("priority"))
             return JSONResponse({"status": "queued_via_celery"})
         except Exception:
-            # fallback to background
-            background_tasks = BackgroundTasks()
-            background_tasks.add_task(process_synthesize_with_mapping, job_id, str(job_dir), mapping)
-            return JSONResponse({"status": "queued"}, background=background_tasks)
-    else:
-        background_tasks = BackgroundTasks()
-        background_tasks.add_task(process_synthesize_with_mapping, job_id, str(job_dir), mapping)
-        return JSONResponse({"status": "queued"}, background=background_tasks)
-
-
-def process_synthesize_with_mapping(job_id: str, job_dir: str, mapping: dict):
-    # Re-run synthesis with mapping
+            # broker unavailable: fall back to the local pool
+            pass
     try:
-        jobd = UPLOAD_DIR / job_id
-        # find original file
-        meta = json.loads((jobd / "meta.json").read_text())
-        original = jobd / meta.get("filename")
-        from src.processor import synthesize_and_mix
-        out = synthesize_and_mix(jobd, str(original), voice_gender=meta.get("voice_gender","auto"), use_translated=meta.get("translate", True), speakers_map=mapping)
-        meta["status"] = "done"
-        meta["output"] = str(out)
-        (jobd / "meta.json").write_text(json.dumps(meta))
-    except Exception as e:
-        meta = json.loads((jobd / "meta.json").read_text())
-        meta["status"] = "failed"
-        meta.setdefault("errors", {})["synthesize_with_mapping"] = str(e)
-        (jobd / "meta.json").write_text(json.dumps(meta))
+        _submit_local(process_synthesize_with_mapping, job_id, mapping)
+    except HTTPException:
+        await asyncio.to_thread(set_status, job_id, job.get("status") or "done")
+        raise
+    return JSONResponse({"status": "queued"})
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import subprocess
+import wave
+from pathlib import Path
+
+import numpy as np
+
+MIX_SAMPLE_RATE = int(os.getenv("MIX_SAMPLE_RATE", "44100"))
+# Peak ceiling for the rendered track (fraction of full scale)
+MIX_CEILING = float(os.getenv("MIX_CEILING", "0.98"))
+# samples converted and written per step, so writing a feature-length mix needs no full-length temporaries
+WAV_BLOCK_SAMPLES = 1 << 20
+
+
+def probe_duration(media_path: str):
+    """Return media duration in seconds using ffprobe, or None if unknown."""
+    cmd = [
+        "ffprobe", "-v", "error", "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1", str(media_path),
+    ]
+    try:
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout.strip()
+        return float(out)
+    except Exception:
+        return None
+
+
+def decode_clip(path: str, sample_rate: int = MIX_SAMPLE_RATE):
+    """Decode any audio file to mono float32 samples at `sample_rate` (one ffmpeg call, no temp files)."""
+    cmd = [
+        "ffmpeg", "-v", "error", "-i", str(path),
+        "-f", "f32le", "-acodec", "pcm_f32le", "-ac", "1", "-ar", str(sample_rate), "-",
+    ]
+    raw = subprocess.run(cmd, check=True, capture_output=True).stdout
+    return np.frombuffer(raw, dtype=np.float32)
+
+
+class Timeline:
+    """Preallocated mono float32 buffer that clips are summed into at their sample offsets."""
+
+    def __init__(self, duration: float = 0.0, sample_rate: int = MIX_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.buffer = np.zeros(max(int(round((duration or 0.0) * sample_rate)), 0), dtype=np.float32)
+        self.length = len(self.buffer)
+
+    def _ensure(self, n: int):
+        if n <= len(self.buffer):
+            return
+        # grow geometrically so late clips past the probed duration stay cheap
+        grown = np.zeros(max(n, 2 * len(self.buffer)), dtype=np.float32)
+        grown[:len(self.buffer)] = self.buffer
+        self.buffer = grown
+
+    def add(self, samples, start: float, gain: float = 1.0):
+        """Sum `samples` into the timeline starting at `start` seconds. Overlaps are summed, not averaged."""
+        offset = int(round(float(start) * self.sample_rate))
+        if offset < 0:
+            samples = samples[-offset:]
+            offset = 0
+        if len(samples) == 0:
+            return
+        end = offset + len(samples)
+        self._ensure(end)
+        if gain != 1.0:
+            self.buffer[offset:end] += samples * gain
+        else:
+            self.buffer[offset:end] += samples
+        self.length = max(self.length, end)
+
+    def render(self, ceiling: float = MIX_CEILING):
+        """Return the mixed track, scaled down only if summed overlaps exceed `ceiling`.
+
+        Unlike ffmpeg amix this never divides by the number of inputs, so isolated lines keep
+        their original loudness.
+        """
+        out = self.buffer[:self.length]
+        scale = self._scale(ceiling)
+        return out * scale if scale != 1.0 else out
+
+    def _scale(self, ceiling: float):
+        # peak found block by block: np.abs over the whole buffer would be a full-length copy
+        peak = 0.0
+        for i in range(0, self.length, WAV_BLOCK_SAMPLES):
+            block = self.buffer[i:min(i + WAV_BLOCK_SAMPLES, self.length)]
+            peak = max(peak, float(block.max()), -float(block.min()))
+        return ceiling / peak if peak > ceiling else 1.0
+
+    def write_wav(self, out_path: str, ceiling: float = MIX_CEILING):
+        """Write the rendered track as 16-bit PCM, converting WAV_BLOCK_SAMPLES at a time."""
+        out_path = Path(out_path)
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        scale = self._scale(ceiling) * 32767.0
+        with wave.open(str(out_path), "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(self.sample_rate)
+            for i in range(0, self.length, WAV_BLOCK_SAMPLES):
+                block = self.buffer[i:min(i + WAV_BLOCK_SAMPLES, self.length)] * scale
+                np.clip(block, -32767.0, 32767.0, out=block)
+                w.writeframes(block.astype("<i2").tobytes())
+        return str(out_path)
+
+
+class StemSet:
+    """Per-speaker stems of a job, persisted so a voice change only rebuilds the affected speakers.
+
+    A stem is stored as the fitted clips themselves (one .npy of concatenated samples plus
+    `[offset, length]` pairs in `stems.json`) rather than a full-length track, so it costs
+    about as much as the speaker's speech and summing stems is a few array additions.
+    `stems.json` also keeps each stem's placement key and its part of the mix plan.
+    """
+
+    MANIFEST = "stems.json"
+
+    def __init__(self, stems_dir: str, sample_rate: int = MIX_SAMPLE_RATE):
+        self.dir = Path(stems_dir)
+        self.sample_rate = sample_rate
+        manifest = self.dir / self.MANIFEST
+        self.manifest = json.loads(manifest.read_text()) if manifest.exists() else {}
+        if self.manifest.get("sample_rate") != sample_rate:
+            self.manifest = {}
+        self.stems = self.manifest.setdefault("stems", {})
+        self.clips = {}
+
+    def _path(self, name: str):
+        return self.dir / f"{hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]}.npy"
+
+    def reusable(self, name: str, key: str):
+        entry = self.stems.get(name)
+        return bool(entry and entry.get("key") == key and self._path(name).exists())
+
+    def add(self, name: str, samples, start: float):
+        self.clips.setdefault(name, []).append((int(round(float(start) * self.sample_rate)), np.asarray(samples, dtype=np.float32)))
+
+    def save(self, name: str, key: str, plan):
+        """Write the clips recorded for stem `name` (replacing its previous version)."""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        clips = sorted(self.clips.pop(name, []), key=lambda c: c[0])
+        data = np.concatenate([c[1] for c in clips]) if clips else np.zeros(0, dtype=np.float32)
+        path = self._path(name)
+        tmp = path.with_name(path.stem + ".tmp.npy")
+        np.save(tmp, data)
+        os.replace(tmp, path)
+        self.stems[name] = {"key": key, "clips": [[offset, len(c)] for offset, c in clips], "plan": plan}
+
+    def keep_only(self, names):
+        """Forget stems of speakers that no longer have lines."""
+        for name in [n for n in self.stems if n not in names]:
+            self._path(name).unlink(missing_ok=True)
+            del self.stems[name]
+
+    def mix_into(self, timeline: Timeline):
+        for name, entry in self.stems.items():
+            data = np.load(self._path(name), mmap_mode="r")
+            pos = 0
+            for offset, length in entry["clips"]:
+                timeline.add(data[pos:pos + length], offset / self.sample_rate)
+                pos += length
+
+    def write_manifest(self):
+        self.manifest["sample_rate"] = self.sample_rate
+        self.dir.mkdir(parents=True, exist_ok=True)
+        path = self.dir / self.MANIFEST
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(self.manifest, ensure_ascii=False))
+        os.replace(tmp, path)
@@ -1,29 +1,65 @@
 import json
+import os
 from pathlib import Path
 from datetime import datetime
 
+# Append-only per-job event log (one JSON object per line). The byte offset after an event is
+# its id: readers resume from the last offset they saw instead of re-reading the whole log.
+EVENTS_FILE = "events.jsonl"
 
-def add_notification(job_dir: str, message: str, level: str = "info"):
+
+def append_event(job_dir: str, event_type: str, **data):
+    """Append one event; a single O_APPEND write keeps concurrent writers from interleaving lines."""
     job_dir = Path(job_dir)
     job_dir.mkdir(parents=True, exist_ok=True)
-    nfile = job_dir / "notifications.json"
-    if nfile.exists():
-        data = json.loads(nfile.read_text())
-    else:
-        data = []
-    entry = {
-        "time": datetime.utcnow().isoformat() + "Z",
-        "level": level,
-        "message": message,
-    }
-    data.append(entry)
-    nfile.write_text(json.dumps(data, ensure_ascii=False))
+    entry = {"type": event_type, "time": datetime.utcnow().isoformat() + "Z", **data}
+    line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+    fd = os.open(job_dir / EVENTS_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
     return entry
 
 
+def parse_events(chunk: bytes, offset: int = 0):
+    """Split raw log bytes read at `offset` into `[(next_offset, event)]`; a trailing partial line is left for later."""
+    events = []
+    pos = 0
+    while True:
+        end = chunk.find(b"\n", pos)
+        if end < 0:
+            break
+        line = chunk[pos:end]
+        pos = end + 1
+        if line.strip():
+            try:
+                events.append((offset + pos, json.loads(line)))
+            except ValueError:
+                continue
+    return events
+
+
+def read_events(job_dir: str, offset: int = 0):
+    path = Path(job_dir) / EVENTS_FILE
+    if not path.exists():
+        return []
+    with path.open("rb") as f:
+        f.seek(offset)
+        return parse_events(f.read(), offset)
+
+
+def add_notification(job_dir: str, message: str, level: str = "info"):
+    entry = append_event(job_dir, "notification", level=level, message=message)
+    return {"time": entry["time"], "level": level, "message": message}
+
+
 def get_notifications(job_dir: str):
     job_dir = Path(job_dir)
-    nfile = job_dir / "notifications.json"
-    if not nfile.exists():
-        return []
-    return json.loads(nfile.read_text())
+    # jobs from before the event log kept a notifications.json array
+    legacy = job_dir / "notifications.json"
+    out = json.loads(legacy.read_text()) if legacy.exists() else []
+    for _, e in read_events(job_dir):
+        if e.get("type") == "notification":
+            out.append({"time": e["time"], "level": e.get("level"), "message": e.get("message")})
+    return out
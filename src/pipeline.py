@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+CHECKPOINT_DIR = ".checkpoints"
+
+
+class Stage:
+    """One step of the job graph.
+
+    - `run(job_dir)` does the work and must write every path in `outputs`; returning False means
+      the outputs are usable but incomplete (e.g. some TTS lines failed), so no checkpoint is
+      written and the next run redoes the stage
+    - `inputs` are files whose content determines the result (paths, or a callable returning them)
+    - `params` are JSON-serializable settings that also determine the result (dict or callable)
+    - `when(job_dir)` returning False skips the stage entirely (e.g. no logo uploaded)
+    - `optional` stages log failures to `<name>_error.txt` instead of stopping the pipeline
+    """
+
+    def __init__(self, name: str, run, inputs=(), outputs=(), params=None, when=None, optional: bool = False, version: str = "1"):
+        self.name = name
+        self.run = run
+        self.inputs = inputs
+        self.outputs = outputs
+        self.params = params or {}
+        self.when = when
+        self.optional = optional
+        self.version = version
+
+    def resolve_inputs(self, job_dir: Path):
+        inputs = self.inputs(job_dir) if callable(self.inputs) else self.inputs
+        return [Path(p) for p in inputs if p]
+
+    def resolve_outputs(self, job_dir: Path):
+        outputs = self.outputs(job_dir) if callable(self.outputs) else self.outputs
+        return [Path(p) for p in outputs if p]
+
+    def resolve_params(self, job_dir: Path):
+        return self.params(job_dir) if callable(self.params) else self.params
+
+
+def _checkpoint_dir(job_dir: Path):
+    d = Path(job_dir) / CHECKPOINT_DIR
+    d.mkdir(parents=True, exist_ok=True)
+    return d
+
+
+def _write_json_atomic(path: Path, data):
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False))
+    os.replace(tmp, path)
+
+
+class _DigestCache:
+    """sha256 of file contents, memoized by (size, mtime) so large videos are hashed once."""
+
+    def __init__(self, job_dir: Path):
+        self.path = _checkpoint_dir(job_dir) / "digests.json"
+        self.entries = json.loads(self.path.read_text()) if self.path.exists() else {}
+        self.dirty = False
+
+    def digest(self, path: Path):
+        if not path.exists():
+            return "missing"
+        st = path.stat()
+        stamp = [st.st_size, st.st_mtime_ns]
+        key = str(path.resolve())
+        entry = self.entries.get(key)
+        if entry and entry["stamp"] == stamp:
+            return entry["sha256"]
+        h = hashlib.sha256()
+        with path.open("rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        self.entries[key] = {"stamp": stamp, "sha256": h.hexdigest()}
+        self.dirty = True
+        return self.entries[key]["sha256"]
+
+    def save(self):
+        if self.dirty:
+            _write_json_atomic(self.path, self.entries)
+            self.dirty = False
+
+
+def stage_hash(stage: Stage, job_dir: Path, digests: _DigestCache):
+    h = hashlib.sha256()
+    h.update(f"{stage.name}|{stage.version}|".encode("utf-8"))
+    h.update(json.dumps(stage.resolve_params(job_dir), sort_keys=True, default=str).encode("utf-8"))
+    for p in stage.resolve_inputs(job_dir):
+        h.update(f"|{p.name}:{digests.digest(p)}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def run_stages(job_dir: str, stages, only=None, force: bool = False, progress=None):
+    """Run `stages` in order, skipping any whose input hash matches its last checkpoint.
+
+    A stage's outputs are the next stage's inputs, so a change anywhere (new speaker mapping,
+    different target language) invalidates exactly the stages downstream of it. Returns
+    `{stage_name: "done" | "cached" | "skipped" | "failed" | "partial"}`. `progress(stage_name, percent)`
+    is called when a stage starts (0) and finishes (100).
+    """
+    def report(name, percent):
+        if progress is not None:
+            try:
+                progress(name, percent)
+            except Exception:
+                # progress reporting must never fail the job
+                pass
+
+    job_dir = Path(job_dir)
+    cdir = _checkpoint_dir(job_dir)
+    digests = _DigestCache(job_dir)
+    status = {}
+    try:
+        for stage in stages:
+            if only is not None and stage.name not in only:
+                continue
+            if stage.when is not None and not stage.when(job_dir):
+                status[stage.name] = "skipped"
+                report(stage.name, 100)
+                continue
+            cp_file = cdir / f"{stage.name}.json"
+            key = stage_hash(stage, job_dir, digests)
+            if not force and cp_file.exists():
+                cp = json.loads(cp_file.read_text())
+                if cp.get("hash") == key and all(p.exists() for p in stage.resolve_outputs(job_dir)):
+                    status[stage.name] = "cached"
+                    report(stage.name, 100)
+                    continue
+            report(stage.name, 0)
+            try:
+                result = stage.run(job_dir)
+            except Exception as e:
+                if not stage.optional:
+                    raise
+                (job_dir / f"{stage.name}_error.txt").write_text(str(e))
+                status[stage.name] = "failed"
+                report(stage.name, 100)
+                continue
+            if result is False:
+                cp_file.unlink(missing_ok=True)
+                status[stage.name] = "partial"
+                report(stage.name, 100)
+                continue
+            outputs = stage.resolve_outputs(job_dir)
+            _write_json_atomic(cp_file, {
+                "hash": key,
+                "outputs": {str(p): digests.digest(p) for p in outputs},
+            })
+            status[stage.name] = "done"
+            report(stage.name, 100)
+    finally:
+        digests.save()
+    return status
@@ -1,22 +1,21 @@
+import asyncio
+import contextlib
+import hashlib
+import os
 import subprocess
 import json
+import threading
+import uuid
 from pathlib import Path
 import shutil
 
-try:
-    import whisper
-except Exception as e:
-    whisper = None
+from src.pipeline import Stage, run_stages
 
-_model = None
 
-def get_model(name: str = "small"):
-    global _model
-    if _model is None:
-        if whisper is None:
-            raise RuntimeError("Whisper is not installed")
-        _model = whisper.load_model(name)
-    return _model
+def get_model(name: str = None):
+    """Process-resident Whisper model (loaded and warmed up once, see src.asr)."""
+    from src.asr import get_model as _get_model
+    return _get_model(name)
 
 
 def extract_audio(video_path: str, out_audio_path: str):
@@ -38,104 +37,182 @@ def extract_audio(video_path: str, out_audio_path: str):
     subprocess.run(cmd, check=True)
 
 
-def transcribe_audio(audio_path: str, model_name: str = "small"):
-    model = get_model(model_name)
-    result = model.transcribe(str(audio_path))
-    return result
-
-
-def process_job(job_id: str, file_path: str, meta: dict):
-    """Full processing pipeline for a job (used by Celery or sync call).
-    Performs transcription, translation, diarization, gender detection and synthesis.
+def transcribe_audio(audio_path: str, model_name: str = None):
+    """Transcribe through the resident model of this process (on split jobs, the `asr` worker's)."""
+    from src.asr import get_service, transcribe_chunked, ASR_WORKERS, ASR_CHUNKED_MIN_DURATION
+    from src.audio import load_pcm
+    pcm = load_pcm(audio_path)
+    # long episodes/movies: split on silence and transcribe chunks in parallel
+    if ASR_WORKERS > 1 and pcm.duration > ASR_CHUNKED_MIN_DURATION:
+        return transcribe_chunked(str(audio_path), model_name)
+    # hand Whisper the already decoded samples instead of letting it run ffmpeg again
+    return get_service(model_name).transcribe(pcm.to_float())
+
+
+def _read_meta(job_dir: Path):
+    from src.jobstore import get_job
+    return get_job(Path(job_dir).name) or {}
+
+
+def _stage_progress(job_dir: Path):
+    """run_stages progress callback that records per-stage percentages in the job store."""
+    from src.jobstore import set_progress
+    job_id = Path(job_dir).name
+    return lambda stage, percent: set_progress(job_id, stage, percent)
+
+
+def _transcript_for_tts(job_dir: Path, use_translated: bool = True):
+    for name in ("transcript_translated.json" if use_translated else None, "transcript_with_speakers.json", "transcript.json"):
+        if name and (job_dir / name).exists():
+            return job_dir / name
+    return job_dir / "transcript.json"
+
+
+def _logo_settings(job_dir: Path):
+    meta = _read_meta(job_dir)
+    logo_file = meta.get("logo")
+    # fallback: search for logo_*
+    if not logo_file:
+        logos = list(job_dir.glob("logo_*.png")) + list(job_dir.glob("logo_*.jpg")) + list(job_dir.glob("logo_*.jpeg"))
+        if logos:
+            logo_file = str(logos[0])
+    return logo_file, meta.get("logo_position") or "bottom-left"
+
+
+def assign_speakers(segments, turns):
+    """Attach the diarization speaker with the largest time overlap to each transcript segment."""
+    out = []
+    for seg in segments:
+        s0, s1 = float(seg.get("start", 0)), float(seg.get("end", 0))
+        overlap = {}
+        for t in turns:
+            o = min(s1, t["end"]) - max(s0, t["start"])
+            if o > 0:
+                overlap[t["speaker"]] = overlap.get(t["speaker"], 0.0) + o
+        seg = dict(seg)
+        if overlap:
+            seg["speakers"] = [max(overlap, key=overlap.get)]
+        out.append(seg)
+    return out
+
+
+async def _synthesize_and_place(engines, job_dir: Path, cached_items, missing_items, segments, timeline=None,
+                                slots=None, max_ratio: float = None, progress=None, stems=None, stem_of=None):
+    """Producer/consumer synthesis: every clip is decoded and placed on `timeline` as soon as it
+    is available (cache hits immediately, new lines the moment their request completes), so mixing
+    overlaps the network calls instead of waiting for all of them. Sets data["cached"] for new lines.
+
+    `engines` maps backend name -> TTS engine; each line goes to the engine named by data["backend"].
+    With `slots` (timefit.compute_slots) every placement is fitted to its slot first. Returns
+    `{segment index: {"start", "rate", "duration"}}` for the fitted placements. `progress(percent)`
+    is called every 5% of lines finished. With `stems` (mixer.StemSet) each clip is recorded on
+    the stem `stem_of[segment index]` instead of being summed into `timeline`.
     """
-    job_dir = Path("data/uploads") / job_id
-    job_dir.mkdir(parents=True, exist_ok=True)
-
-    # Save meta (in case it's not already saved)
-    (job_dir / "meta.json").write_text(json.dumps(meta))
-
-    # Transcription
-    try:
-        trans_out = transcribe_and_save(job_dir, file_path, meta.get("target_language"), meta.get("translate", True))
-        meta["status"] = "transcribed"
-        (job_dir / "meta.json").write_text(json.dumps(meta))
-    except Exception as e:
-        meta.setdefault("errors", {})["transcription"] = str(e)
-        (job_dir / "meta.json").write_text(json.dumps(meta))
-        raise
+    from src.tts_cache import store_cache
+    from src.mixer import decode_clip
+    from src.timefit import fit_clip, TIMEFIT_MAX_RATIO
+    loop = asyncio.get_running_loop()
+    place_lock = threading.Lock()
+    fits = {}
+    total = len(cached_items) + len(missing_items)
+    finished = {"count": 0, "reported": 0}
+
+    def advance():
+        with place_lock:
+            finished["count"] += 1
+            percent = 100.0 * finished["count"] / total
+            if progress is None or percent - finished["reported"] < 5 and finished["count"] < total:
+                return
+            finished["reported"] = percent
+        try:
+            progress(percent)
+        except Exception:
+            pass
 
-    # Auto-assign speakers mapping if available
-    try:
-        if (job_dir / "speakers.json").exists():
-            s = json.loads((job_dir / "speakers.json").read_text())
-            mapping = {}
-            for spk, info in s.items():
-                mapping[spk] = info.get("suggested_gender") or "auto"
-            (job_dir / "speakers_mapping.json").write_text(json.dumps(mapping, ensure_ascii=False))
-    except Exception as e:
-        (job_dir / "speakers_mapping_error.txt").write_text(str(e))
+    def place(data):
+        if timeline is None:
+            return
+        sr = timeline.sample_rate
+        samples = decode_clip(data["cached"], sr)
+        for seg_idx in data["segments"]:
+            start = segments[seg_idx].get("start", 0)
+            clip, rate = samples, 1.0
+            if slots is not None:
+                clip, start, rate = fit_clip(samples, sr, start, slots[seg_idx], max_ratio or TIMEFIT_MAX_RATIO)
+            with place_lock:
+                if stems is not None:
+                    stems.add(stem_of[seg_idx], clip, start)
+                else:
+                    timeline.add(clip, start)
+                fits[seg_idx] = {"start": start, "rate": rate, "duration": len(clip) / sr}
+
+    def place_and_count(data):
+        try:
+            place(data)
+        finally:
+            advance()
 
-    # Synthesis (may error — handle so job still ends)
-    try:
-        from src.notify import add_notification
-        add_notification(job_dir, "Synthesis started", level="info")
-        speakers_map = None
-        if (job_dir / "speakers_mapping.json").exists():
-            speakers_map = json.loads((job_dir / "speakers_mapping.json").read_text())
-        out_video = synthesize_and_mix(job_dir, file_path, voice_gender=meta.get("voice_gender", "auto"), use_translated=meta.get("translate", True), speakers_map=speakers_map)
-        meta["output"] = str(out_video)
-        add_notification(job_dir, "Synthesis finished", level="info")
-
-        # Try to upload result to S3 if configured
+    async def produce(data):
+        tmp = job_dir / f"_tmp_synth_{uuid.uuid4().hex}.wav"
         try:
-            from src.storage import upload_file, S3_BUCKET
-            if S3_BUCKET:
-                key = f"results/{job_id}/{Path(meta['output']).name}"
-                upload_file(meta["output"], key)
-                # save presigned URL
-                from src.storage import get_presigned_url
-                url = get_presigned_url(key)
-                meta["s3_key"] = key
-                meta["s3_url"] = url
+            await engines[data["backend"]].synthesize_to_wav(data["text"], tmp, voice_id=data.get("voice_id"), model=data.get("model"),
+                                                             voice_gender=data.get("voice_gender"))
         except Exception as e:
-            # do not fail job on S3 errors — just log
-            (job_dir / "s3_upload_error.txt").write_text(str(e))
+            # log error
+            (job_dir / f"tts_task_error_{abs(hash(data['text'])) % (10**8)}.txt").write_text(str(e))
+            advance()
+            return
+        # store under the same key used for lookup (the temp file is renamed into the cache)
+        data["cached"] = await loop.run_in_executor(
+            None, lambda: store_cache(str(tmp), data["text"], voice_id=data.get("voice_id"), voice_gender=data.get("voice_gender"),
+                                      model=data.get("model"), backend=data["backend"])
+        )
+        await loop.run_in_executor(None, place_and_count, data)
 
-    except Exception as e:
-        meta.setdefault("errors", {})["tts_pipeline"] = str(e)
-        # fallback copy
-        out_path = job_dir / f"{Path(file_path).stem}_processed.mp4"
-        shutil.copy(file_path, out_path)
-        meta["output"] = str(out_path)
+    placed = [loop.run_in_executor(None, place_and_count, data) for data in cached_items]
+    async with contextlib.AsyncExitStack() as stack:
+        for name in {data["backend"] for data in missing_items}:
+            await stack.enter_async_context(engines[name])
+        await asyncio.gather(*[produce(data) for data in missing_items], *placed)
+    return fits
 
-    meta["status"] = "done"
-    (job_dir / "meta.json").write_text(json.dumps(meta))
-    return meta
 
+def _line_text(seg):
+    return (seg.get("translated") or seg.get("text") or "").strip()
 
-def synthesize_and_mix(job_dir: str, video_path: str, voice_gender: str = "auto", use_translated: bool = True, speakers_map: dict = None):
-    """
-    Generate TTS for (translated) segments, mix them into a single audio track and overlay onto the video.
+
+def plan_synthesis(job_dir: Path, transcript_file: Path, voice_gender: str = "auto", speakers_map: dict = None, tts_backend: str = None):
+    """Group segments into unique (text, voice, backend) requests and look them up in the TTS cache.
+
+    Returns `(segments, requests_map)`; requests already cached carry data["cached"].
     """
-    job_dir = Path(job_dir)
-    transcript_file = job_dir / ("transcript_translated.json" if use_translated and (job_dir / "transcript_translated.json").exists() else "transcript.json")
-    if not transcript_file.exists():
-        raise RuntimeError("Transcript not available for TTS generation")
     trans = json.loads(transcript_file.read_text())
     segments = trans.get("segments", [])
 
-    # Prepare TTS engine with caching and parallel generation
+    from src.tts import TTS_BACKEND, ELEVEN_API_KEY, ELEVEN_BASE
+    from src.tts_cache import get_cached_many
+    from src.tts_local import VOICE_PREFIX, resolve_voice as resolve_local_voice
+    default_backend = tts_backend or TTS_BACKEND
+
+    # Resolve gender hints to concrete voices once per speaker (memoized catalog lookup),
+    # keeping voices chosen on earlier runs of this job stable
+    resolved_file = job_dir / "resolved_voices.json"
+    resolved = json.loads(resolved_file.read_text()) if resolved_file.exists() else {}
     try:
-        from src.tts import ElevenTTS
-        from src.tts_cache import get_cached, store_cache
-        tts = ElevenTTS()
-    except Exception as e:
-        raise RuntimeError(f"TTS initialization failed: {e}")
+        from src.voices import get_catalog
+        catalog = get_catalog(ELEVEN_API_KEY, ELEVEN_BASE) if ELEVEN_API_KEY else None
+    except Exception:
+        catalog = None
+
+    def resolve_voice(backend, gender, key):
+        if backend == "local":
+            return resolve_local_voice(gender, key)
+        return catalog.resolve(gender, key=key) if catalog is not None else None
 
     # Build unique synthesis requests (text + voice choice)
     requests_map = {}  # key -> dict(text, voice_id, voice_gender, segments_indices)
     for i, seg in enumerate(segments):
-        text = (seg.get("translated") or seg.get("text") or "").strip()
+        text = _line_text(seg)
         if not text:
             continue
         # Speaker/voice resolution
@@ -144,141 +221,479 @@ def synthesize_and_mix(job_dir: str, video_path: str, voice_gender: str = "auto"
             speaker = seg.get("speakers")[0]
         v_id = None
         v_gender = None
+        backend = None
         if speakers_map and speaker and speaker in speakers_map:
             mv = speakers_map.get(speaker)
             if isinstance(mv, dict):
                 v_id = mv.get("voice_id")
                 v_gender = mv.get("gender")
+                backend = mv.get("backend")
             else:
                 v_gender = mv
+        # per-speaker backend, else implied by a local voice id, else the job default
+        backend = backend or ("local" if (v_id or "").startswith(VOICE_PREFIX) else default_backend)
         if not v_id and not v_gender:
             # use overall voice_gender hint
             if voice_gender in ("male", "female"):
                 v_gender = voice_gender
+        if not v_id and (v_gender or backend == "local"):
+            slot = speaker or "_default"
+            prev = resolved.get(slot)
+            if prev and prev.get("gender") == v_gender and prev.get("backend", "elevenlabs") == backend:
+                v_id = prev["voice_id"]
+            else:
+                try:
+                    v_id = resolve_voice(backend, v_gender, f"{job_dir.name}:{slot}" if speaker else None)
+                except Exception:
+                    v_id = None
+                if v_id:
+                    resolved[slot] = {"gender": v_gender, "voice_id": v_id, "backend": backend}
 
         # final key is text + chosen voice identifier (voice_id if known else voice_gender)
-        key = (text, v_id or (v_gender or "auto"))
-        requests_map.setdefault(key, {"text": text, "voice_id": v_id, "voice_gender": v_gender, "segments": []})
+        key = (text, v_id or (v_gender or "auto"), backend)
+        requests_map.setdefault(key, {"text": text, "voice_id": v_id, "voice_gender": v_gender, "backend": backend, "segments": []})
         requests_map[key]["segments"].append(i)
 
-    # Check cache and create list of synth tasks
-    synth_tasks = []  # entries needing generation: (key, data)
-    for k, data in requests_map.items():
-        cached = get_cached(data["text"], voice_id=data.get("voice_id"), voice_gender=data.get("voice_gender"))
+    resolved_file.write_text(json.dumps(resolved, ensure_ascii=False))
+
+    # one batch lookup for the whole job: local cache, then the shared S3 tier in parallel
+    cached_paths = get_cached_many(list(requests_map.values()))
+    for data, cached in zip(requests_map.values(), cached_paths):
         if cached:
             data["cached"] = cached
-        else:
-            synth_tasks.append((k, data))
+    return segments, requests_map
 
-    # Parallel synthesize missing items
-    from concurrent.futures import ThreadPoolExecutor, as_completed
 
-    def synthesize_task(data):
-        # attempt to pick specific voice_id if only gender provided
-        v_id = data.get("voice_id")
-        if not v_id and data.get("voice_gender"):
-            try:
-                candidate = tts.pick_voice_by_gender(data.get("voice_gender"))
-                if candidate:
-                    v_id = candidate
-            except Exception:
-                v_id = None
-        # synthesize to temp path then store cache
-        tmp = job_dir / f"_tmp_synth_{abs(hash(data['text'])) % (10**8)}.wav"
-        tts.synthesize_to_wav(data["text"], tmp, voice_id=v_id, voice_gender=data.get("voice_gender"))
-        cached = store_cache(str(tmp), data["text"], voice_id=v_id, voice_gender=data.get("voice_gender"))
+def _get_engines(items):
+    from src.tts import get_tts
+    engines = {}
+    for name in {data["backend"] for data in items}:
         try:
-            tmp.unlink()
-        except Exception:
-            pass
-        return cached
-
-    if synth_tasks:
-        with ThreadPoolExecutor(max_workers=4) as ex:
-            futures = {ex.submit(synthesize_task, data): data for _, data in synth_tasks}
-            for fut in as_completed(futures):
-                data = futures[fut]
-                try:
-                    cached_path = fut.result()
-                    data["cached"] = cached_path
-                except Exception as e:
-                    # log error
-                    (job_dir / f"tts_task_error_{abs(hash(data['text'])) % (10**8)}.txt").write_text(str(e))
+            engines[name] = get_tts(name)
+        except Exception as e:
+            raise RuntimeError(f"TTS initialization failed: {e}")
+    return engines
+
+
+def _stem_keys(segments, requests_map, stem_of, slots, max_ratio, sample_rate):
+    """Placement key per speaker stem: changes whenever any of the speaker's clips would differ."""
+    from src.timefit import TIMEFIT_MAX_RATIO
+    lines = {}
+    for data in requests_map.values():
+        for seg_idx in data["segments"]:
+            lines.setdefault(stem_of[seg_idx], []).append(
+                [seg_idx, data["text"], data.get("voice_id"), data.get("voice_gender"), data["backend"],
+                 segments[seg_idx].get("start", 0), slots[seg_idx]]
+            )
+    head = [max_ratio or TIMEFIT_MAX_RATIO, sample_rate]
+    return {
+        name: hashlib.sha256(json.dumps(head + sorted(items), ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+        for name, items in lines.items()
+    }
+
+
+def synthesize_segments(job_dir: Path, transcript_file: Path, voice_gender: str = "auto", speakers_map: dict = None, timeline=None,
+                        tts_backend: str = None, timefit_max_ratio: float = None, progress=None, stems_dir: Path = None):
+    """Synthesize (or fetch from cache) one clip per unique (text, voice) and return the mix plan.
+
+    With a mixer.Timeline, clips are placed on it while synthesis is still in flight. With
+    `stems_dir` as well, clips are kept per speaker in a mixer.StemSet: speakers whose lines,
+    voices and slots are unchanged since the last run reuse their stem without synthesis,
+    decoding or fitting, and the timeline is the sum of all stems.
+    """
+    segments, requests_map = plan_synthesis(job_dir, transcript_file, voice_gender, speakers_map, tts_backend)
+
+    # lines are fitted between the previous segment's end and the next segment's start
+    from src.timefit import compute_slots
+    slots = compute_slots(segments, timeline.length / timeline.sample_rate if timeline is not None and timeline.length else None)
+
+    stems = stem_of = keys = None
+    work = list(requests_map.values())
+    if timeline is not None and stems_dir is not None:
+        from src.mixer import StemSet
+        stems = StemSet(stems_dir, timeline.sample_rate)
+        stem_of = [(seg.get("speakers") or ["_default"])[0] for seg in segments]
+        keys = _stem_keys(segments, requests_map, stem_of, slots, timefit_max_ratio, timeline.sample_rate)
+        rebuild = {name for name, key in keys.items() if not stems.reusable(name, key)}
+        # only the lines of changed speakers are synthesized and placed (a shared line keeps only those segments)
+        work = []
+        for data in requests_map.values():
+            segs = [i for i in data["segments"] if stem_of[i] in rebuild]
+            if segs:
+                work.append(dict(data, segments=segs))
+
+    # Synthesize missing items concurrently over one pooled, rate-limited HTTP client,
+    # decoding and placing each clip on the timeline as it lands
+    cached_items = [data for data in work if data.get("cached")]
+    missing_items = [data for data in work if not data.get("cached")]
+    engines = _get_engines(missing_items)
+    fits = asyncio.run(_synthesize_and_place(engines, job_dir, cached_items, missing_items, segments, timeline,
+                                             slots=slots, max_ratio=timefit_max_ratio, progress=progress,
+                                             stems=stems, stem_of=stem_of))
 
     # Map cached files to segment outputs
     tts_files = []
-    for k, data in requests_map.items():
+    for data in work:
         cached = data.get("cached")
         if not cached:
             continue
         for seg_idx in data.get("segments", []):
             seg = segments[seg_idx]
-            start = seg.get("start", 0)
-            tts_files.append({"file": cached, "start": start, "speaker": (seg.get("speakers") or [None])[0]})
+            item = {"file": cached, "start": seg.get("start", 0), "speaker": (seg.get("speakers") or [None])[0], "segment": seg_idx}
+            item.update(fits.get(seg_idx, {}))
+            tts_files.append(item)
+
+    if stems is not None:
+        expected = {}
+        for data in work:
+            for seg_idx in data["segments"]:
+                expected.setdefault(stem_of[seg_idx], []).append(seg_idx)
+        for name in rebuild:
+            # a stem with failed lines is still mixed, but rebuilt (and the lines retried) next time
+            complete = all(i in fits for i in expected.get(name, []))
+            stems.save(name, keys[name] if complete else None, [it for it in tts_files if stem_of[it["segment"]] == name])
+        tts_files += [it for name in keys if name not in rebuild for it in stems.stems[name]["plan"]]
+        tts_files.sort(key=lambda it: it["segment"])
+        stems.keep_only(keys)
+        stems.write_manifest()
+        stems.mix_into(timeline)
 
     if not tts_files:
         raise RuntimeError("No TTS segments were generated")
+    return tts_files
+
+
+ANALYSIS_STAGES = ("extract_audio", "transcribe", "diarize", "gender", "translate")
+# "synthesize" also produces the mixed track (pipelined, see _synthesize_and_place)
+RENDER_STAGES = ("synthesize", "render")
+
+# Celery queue per resource class; split jobs run each step below as its own task on its queue
+ASR_QUEUE = os.getenv("ASR_QUEUE", "asr")
+DIARIZE_QUEUE = os.getenv("DIARIZE_QUEUE", "diarize")
+TTS_QUEUE = os.getenv("TTS_QUEUE", "tts-io")
+ENCODE_QUEUE = os.getenv("ENCODE_QUEUE", "encode")
+# lines per subtask when a split job fans synthesis out over the tts-io workers (0 = synthesize in one task)
+TTS_FANOUT_BATCH = int(os.getenv("TTS_FANOUT_BATCH", "0"))
+# (queue, stages) in execution order
+JOB_STEPS = (
+    (ASR_QUEUE, ("extract_audio", "transcribe")),
+    (DIARIZE_QUEUE, ("diarize", "gender")),
+    (TTS_QUEUE, ("translate",)),
+    (TTS_QUEUE, ("synthesize",)),
+    (ENCODE_QUEUE, ("render",)),
+    (TTS_QUEUE, ("upload",)),
+)
+
+
+def build_stages(job_dir: str, video_path: str, meta: dict = None):
+    """Stage graph for one job. Each stage reads files written by earlier stages in `job_dir`.
+
+    The source is decoded once (extract_audio); transcription, diarization and gender
+    detection all slice the same memory-mapped PCM buffer.
+    """
+    from src.audio import load_pcm
+    from src.gender import GENDER_MAX_SECONDS
+    from src.translate import TRANSLATE_BACKEND
+    from src.timefit import TIMEFIT_MAX_RATIO
+    job_dir = Path(job_dir)
+    video_path = Path(video_path)
+    meta = meta if meta is not None else _read_meta(job_dir)
+    audio = job_dir / "audio.wav"
+    transcript = job_dir / "transcript.json"
+    diarization = job_dir / "diarization.json"
+    with_speakers = job_dir / "transcript_with_speakers.json"
+    speakers = job_dir / "speakers.json"
+    translated = job_dir / "transcript_translated.json"
+    mapping = job_dir / "speakers_mapping.json"
+    plan = job_dir / "tts_plan.json"
+    mixed = job_dir / "tts_mixed.wav"
+    stems_dir = job_dir / "stems"
+    output = job_dir / f"{video_path.stem}_processed.mp4"
+    uploaded = job_dir / "s3.json"
+    # what the picture of `output` was rendered from, so an audio-only change can copy its video stream
+    picture_state = job_dir / "render_picture.json"
+    report = _stage_progress(job_dir)
+    try:
+        from src.storage import S3_BUCKET
+    except Exception:
+        S3_BUCKET = None
+    use_translated = meta.get("translate", True)
+
+    def run_extract(_):
+        extract_audio(str(video_path), audio)
+
+    def run_transcribe(_):
+        result = transcribe_audio(audio, meta.get("whisper_model"))
+        transcript.write_text(json.dumps(result, ensure_ascii=False))
+
+    def run_diarize(_):
+        from src.diarize import diarize_audio
+        out = diarize_audio(load_pcm(audio), job_dir, min_speakers=meta.get("min_speakers"), max_speakers=meta.get("max_speakers"))
+        trans = json.loads(transcript.read_text())
+        trans["segments"] = assign_speakers(trans.get("segments", []), out["segments"])
+        with_speakers.write_text(json.dumps(trans, ensure_ascii=False))
+
+    def run_gender(_):
+        turns = json.loads(diarization.read_text())["segments"]
+        from src.gender import estimate_speaker_genders
+        # all speakers in one vectorized pitch-tracking pass
+        result = estimate_speaker_genders(load_pcm(audio), turns, max_seconds=meta.get("gender_max_seconds") or GENDER_MAX_SECONDS)
+        speakers.write_text(json.dumps(result, ensure_ascii=False))
+
+    def run_translate(_):
+        from src.translate import translate_segments
+        source = with_speakers if with_speakers.exists() else transcript
+        trans = json.loads(source.read_text())
+        trans["segments"] = translate_segments(
+            trans.get("segments", []), meta.get("target_language"), trans.get("language"), backend=meta.get("translate_backend"),
+        )
+        translated.write_text(json.dumps(trans, ensure_ascii=False))
+
+    def run_synthesize(_):
+        # synthesis and mixing are one stage: clips are mixed while other lines are still being synthesized
+        from src.mixer import Timeline, probe_duration
+        speakers_map = json.loads(mapping.read_text()) if mapping.exists() else None
+        timeline = Timeline(probe_duration(video_path) or 0.0)
+        tts_files = synthesize_segments(job_dir, _transcript_for_tts(job_dir, use_translated), meta.get("voice_gender", "auto"), speakers_map,
+                                        timeline=timeline, tts_backend=meta.get("tts_backend"),
+                                        timefit_max_ratio=meta.get("timefit_max_ratio"),
+                                        progress=lambda percent: report("synthesize", percent), stems_dir=stems_dir)
+        plan.write_text(json.dumps(tts_files, ensure_ascii=False))
+        timeline.write_wav(mixed)
+        # lines that failed (see tts_task_error_*.txt) leave the stage uncheckpointed so a retry redoes them
+        segments = json.loads(_transcript_for_tts(job_dir, use_translated).read_text()).get("segments", [])
+        return len(tts_files) == sum(1 for seg in segments if _line_text(seg))
+
+    def picture_key(logo_file, logo_pos, options):
+        from src.render import RENDER_PRESET, RENDER_CRF
+        stamp = lambda p: [str(p), Path(p).stat().st_size, Path(p).stat().st_mtime_ns]
+        return {"video": stamp(video_path), "logo": stamp(logo_file) if logo_file else None, "position": logo_pos,
+                "preset": options.get("preset", RENDER_PRESET), "crf": options.get("crf", RENDER_CRF)}
+
+    def save_picture_state(key):
+        st = output.stat()
+        picture_state.write_text(json.dumps({"key": key, "output": [st.st_size, st.st_mtime_ns]}))
+
+    def run_render(_):
+        from src.render import render_final, RENDER_LOUDNORM
+        logo_file, logo_pos = _logo_settings(job_dir)
+        options = render_options()
+        key = picture_key(logo_file, logo_pos, options)
+        state = json.loads(picture_state.read_text()) if picture_state.exists() else None
+        if state and state["key"] == key and output.exists() and state["output"] == [output.stat().st_size, output.stat().st_mtime_ns]:
+            # only the dub changed (e.g. a voice reassignment): swap the audio, keep the encoded picture
+            try:
+                render_final(output, mixed, output, loudnorm=options.get("loudnorm", RENDER_LOUDNORM))
+                save_picture_state(key)
+                return
+            except Exception as e:
+                (job_dir / "render_remux_error.txt").write_text(str(e))
+        try:
+            render_final(video_path, mixed, output, logo_path=logo_file, position=logo_pos, **options)
+        except Exception as e:
+            if not logo_file:
+                raise
+            # logo errors are logged but the un-branded output is still delivered
+            (job_dir / "logo_overlay_error.txt").write_text(str(e))
+            render_final(video_path, mixed, output, **options)
+            key["logo"] = None
+        save_picture_state(key)
+
+    def render_options():
+        options = {}
+        for key in ("loudnorm", "preset", "crf", "threads", "segments"):
+            if meta.get(f"render_{key}") is not None:
+                options[key] = meta[f"render_{key}"]
+        return options
+
+    def run_upload(_):
+        from src.storage import upload_file, get_presigned_url
+        output = final_output(job_dir, video_path)
+        key = f"results/{job_dir.name}/{Path(output).name}"
+        upload_file(output, key)
+        uploaded.write_text(json.dumps({"s3_key": key, "s3_url": get_presigned_url(key)}))
+
+    def render_params(_):
+        from src.render import RENDER_PRESET, RENDER_CRF, RENDER_LOUDNORM
+        params = {"position": _logo_settings(job_dir)[1], "preset": RENDER_PRESET, "crf": RENDER_CRF, "loudnorm": RENDER_LOUDNORM}
+        params.update(render_options())
+        return params
+
+    def render_inputs(_):
+        return [video_path, mixed, _logo_settings(job_dir)[0]]
+
+    return [
+        Stage("extract_audio", run_extract, inputs=[video_path], outputs=[audio]),
+        Stage("transcribe", run_transcribe, inputs=[audio], outputs=[transcript],
+              params={"model": meta.get("whisper_model")}),
+        Stage("diarize", run_diarize, inputs=[audio, transcript], outputs=[diarization, with_speakers],
+              params={"min_speakers": meta.get("min_speakers"), "max_speakers": meta.get("max_speakers")}, optional=True),
+        Stage("gender", run_gender, inputs=[audio, diarization], outputs=[speakers],
+              params={"max_seconds": meta.get("gender_max_seconds") or GENDER_MAX_SECONDS},
+              when=lambda _: diarization.exists(), optional=True, version="2"),
+        Stage("translate", run_translate, inputs=[transcript, with_speakers], outputs=[translated],
+              params={"target_language": meta.get("target_language"), "backend": meta.get("translate_backend") or TRANSLATE_BACKEND},
+              when=lambda _: bool(use_translated and meta.get("target_language"))),
+        Stage("synthesize", run_synthesize,
+              inputs=lambda _: [_transcript_for_tts(job_dir, use_translated), mapping, video_path],
+              outputs=[plan, job_dir / "resolved_voices.json", mixed],
+              params={"voice_gender": meta.get("voice_gender", "auto"), "tts_backend": meta.get("tts_backend"),
+                      "timefit_max_ratio": meta.get("timefit_max_ratio") or TIMEFIT_MAX_RATIO}, version="3"),
+        # one ffmpeg run for audio replacement, loudness normalization and logo overlay
+        Stage("render", run_render, inputs=render_inputs, outputs=[output],
+              params=render_params),
+        # do not fail job on S3 errors — they are logged to upload_error.txt
+        Stage("upload", run_upload, inputs=lambda _: [final_output(job_dir, video_path)], outputs=[uploaded],
+              params={"bucket": S3_BUCKET}, when=lambda _: bool(S3_BUCKET), optional=True),
+    ]
 
-    # Create delayed versions and mix them
-    delayed_files = []
-    for idx, it in enumerate(tts_files):
-        in_f = it["file"]
-        delay_ms = int(float(it.get("start", 0)) * 1000)
-        out_delayed = job_dir / f"tts_seg_{idx}_delayed.wav"
-        # Use ffmpeg to add silence delay in ms
-        cmd = [
-            "ffmpeg", "-y", "-i", str(in_f), "-af", f"adelay={delay_ms}|{delay_ms}", str(out_delayed)
-        ]
-        subprocess.run(cmd, check=True)
-        delayed_files.append(str(out_delayed))
 
-    # save speaker->voice mapping if provided
-    if speakers_map:
-        (job_dir / "speakers_mapping.json").write_text(json.dumps(speakers_map, ensure_ascii=False))
+def final_output(job_dir: str, video_path: str):
+    return str(Path(job_dir) / f"{Path(video_path).stem}_processed.mp4")
 
-    # Mix delayed files into single track
-    mix_out = job_dir / "tts_mixed.wav"
-    inputs = []
-    filter_inputs = []
-    for d in delayed_files:
-        inputs += ["-i", d]
-        filter_inputs.append("[{}:a]".format(len(filter_inputs)))
-    # ffmpeg amix
-    cmd = ["ffmpeg", "-y"] + sum([["-i", d] for d in delayed_files], []) + ["-filter_complex", f"amix=inputs={len(delayed_files)}:dropout_transition=0", str(mix_out)]
-    subprocess.run(cmd, check=True)
 
-    # Overlay audio onto original video
-    out_video = job_dir / f"{Path(video_path).stem}_processed.mp4"
-    cmd = [
-        "ffmpeg", "-y", "-i", str(video_path), "-i", str(mix_out), "-c:v", "copy", "-map", "0:v:0", "-map", "1:a:0", "-shortest", str(out_video)
-    ]
-    subprocess.run(cmd, check=True)
+def _auto_speaker_mapping(job_dir: Path):
+    """Write speakers_mapping.json from confident gender suggestions (keep a mapping the user already chose)."""
+    try:
+        from src.gender import GENDER_MIN_CONFIDENCE
+        if (job_dir / "speakers.json").exists() and not (job_dir / "speakers_mapping.json").exists():
+            s = json.loads((job_dir / "speakers.json").read_text())
+            mapping = {}
+            for spk, info in s.items():
+                confident = info.get("gender_confidence", 1.0) >= GENDER_MIN_CONFIDENCE
+                g = info.get("suggested_gender")
+                mapping[spk] = g if confident and g in ("male", "female") else "auto"
+            (job_dir / "speakers_mapping.json").write_text(json.dumps(mapping, ensure_ascii=False))
+    except Exception as e:
+        (job_dir / "speakers_mapping_error.txt").write_text(str(e))
+
+
+def run_job_step(job_id: str, file_path: str, index: int):
+    """Run step `index` of JOB_STEPS for a job.
+
+    Returns False when the remaining steps should be skipped: synthesis or rendering failed
+    and the untouched video was delivered instead (the job still ends as done).
+    """
+    from src.jobstore import get_job, set_status, update_job, record_error
+    from src.notify import add_notification
+    job_dir = Path("data/uploads") / job_id
+    job_dir.mkdir(parents=True, exist_ok=True)
+    meta = get_job(job_id) or {}
+    _, names = JOB_STEPS[index]
+    if index == 0:
+        set_status(job_id, "processing")
+    stages = build_stages(job_dir, file_path, meta)
+    progress = _stage_progress(job_dir)
+
+    if set(names) & set(ANALYSIS_STAGES):
+        try:
+            run_stages(job_dir, stages, only=names, progress=progress)
+        except Exception as e:
+            record_error(job_id, "transcription", e)
+            raise
+        if "translate" in names:
+            set_status(job_id, "transcribed")
+            _auto_speaker_mapping(job_dir)
+        return True
+
+    if set(names) & set(RENDER_STAGES):
+        if "synthesize" in names:
+            add_notification(job_dir, "Synthesis started", level="info")
+            if not _transcript_for_tts(job_dir, meta.get("translate", True)).exists():
+                record_error(job_id, "tts_pipeline", "Transcript not available for TTS generation")
+                return _deliver_original(job_id, job_dir, file_path)
+        try:
+            run_stages(job_dir, stages, only=names, progress=progress)
+        except Exception as e:
+            # synthesis errors do not fail the job: the original video is delivered instead
+            record_error(job_id, "tts_pipeline", e)
+            return _deliver_original(job_id, job_dir, file_path)
+        if "render" in names:
+            update_job(job_id, output=final_output(job_dir, file_path))
+            add_notification(job_dir, "Synthesis finished", level="info")
+        return True
 
-    # Apply logo overlay if provided in meta or job folder
     try:
-        meta_file = job_dir / "meta.json"
-        logo_file = None
-        logo_pos = None
-        if meta_file.exists():
-            m = json.loads(meta_file.read_text())
-            logo_file = m.get("logo")
-            logo_pos = m.get("logo_position")
-        # fallback: search for logo_*
-        if not logo_file:
-            logos = list(job_dir.glob("logo_*.png")) + list(job_dir.glob("logo_*.jpg")) + list(job_dir.glob("logo_*.jpeg"))
-            if logos:
-                logo_file = str(logos[0])
-        if logo_file:
-            try:
-                from src.logo import overlay_logo
-                out_with_logo = job_dir / f"{Path(video_path).stem}_processed_logo.mp4"
-                overlay_logo(str(out_video), logo_file, str(out_with_logo), position=logo_pos or "bottom-left")
-                out_video = out_with_logo
-            except Exception as e:
-                # log error but continue
-                (job_dir / "logo_overlay_error.txt").write_text(str(e))
+        run_stages(job_dir, stages, only=names, progress=progress)
+        if (job_dir / "s3.json").exists():
+            update_job(job_id, **json.loads((job_dir / "s3.json").read_text()))
+    except Exception as e:
+        record_error(job_id, "tts_pipeline", e)
+    return True
 
-    except Exception:
-        pass
 
-    return str(out_video)
+def _deliver_original(job_id: str, job_dir: Path, file_path: str):
+    from src.jobstore import update_job
+    out_path = job_dir / f"{Path(file_path).stem}_processed.mp4"
+    shutil.copy(file_path, out_path)
+    update_job(job_id, output=str(out_path))
+    return False
+
+
+def plan_fanout(job_id: str, file_path: str, batch_size: int = None):
+    """Uncached synthesis requests of a job split into batches of `batch_size` lines.
+
+    Each batch can be synthesized by a different worker (synthesize_batch); once all of them
+    are in the shared TTS cache, the synthesize stage only has to mix.
+    """
+    batch_size = max(1, batch_size or TTS_FANOUT_BATCH)
+    job_dir = Path("data/uploads") / job_id
+    meta = _read_meta(job_dir)
+    transcript_file = _transcript_for_tts(job_dir, meta.get("translate", True))
+    if not transcript_file.exists():
+        return []
+    mapping = job_dir / "speakers_mapping.json"
+    speakers_map = json.loads(mapping.read_text()) if mapping.exists() else None
+    _, requests_map = plan_synthesis(job_dir, transcript_file, meta.get("voice_gender", "auto"), speakers_map, meta.get("tts_backend"))
+    missing = [
+        {k: data[k] for k in ("text", "voice_id", "voice_gender", "backend")}
+        for data in requests_map.values() if not data.get("cached")
+    ]
+    return [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+
+
+def synthesize_batch(job_id: str, items):
+    """Synthesize planned requests into the TTS cache (no mixing). Returns how many succeeded."""
+    job_dir = Path("data/uploads") / job_id
+    job_dir.mkdir(parents=True, exist_ok=True)
+    items = [dict(data, segments=[]) for data in items]
+    asyncio.run(_synthesize_and_place(_get_engines(items), job_dir, [], items, []))
+    return sum(1 for data in items if data.get("cached"))
+
+
+def process_job(job_id: str, file_path: str, meta: dict):
+    """Full processing pipeline for a job in one process (no broker, or a single-task Celery job).
+    Performs transcription, translation, diarization, gender detection and synthesis.
+    Every stage is checkpointed in the job dir, so rerunning a job only redoes what changed.
+    With a broker, tasks.enqueue_job runs the same JOB_STEPS as separate tasks on per-resource queues.
+    """
+    from src.jobstore import get_job, create_job, set_status
+    # Register the job (in case the API did not)
+    if get_job(job_id) is None:
+        create_job(job_id, meta)
+    for index in range(len(JOB_STEPS)):
+        if not run_job_step(job_id, file_path, index):
+            break
+    set_status(job_id, "done")
+    return get_job(job_id)
+
+
+def synthesize_and_mix(job_dir: str, video_path: str, voice_gender: str = "auto", use_translated: bool = True, speakers_map: dict = None):
+    """
+    Generate TTS for (translated) segments, mix them into a single audio track and overlay onto the video.
+    Runs the synthesize and render stages; stages whose inputs did not change
+    (e.g. an unchanged speaker mapping) are reused from their checkpoints.
+    """
+    job_dir = Path(job_dir)
+    if not _transcript_for_tts(job_dir, use_translated).exists():
+        raise RuntimeError("Transcript not available for TTS generation")
+
+    # save speaker->voice mapping if provided
+    if speakers_map:
+        (job_dir / "speakers_mapping.json").write_text(json.dumps(speakers_map, ensure_ascii=False))
+
+    meta = _read_meta(job_dir)
+    meta["voice_gender"] = voice_gender
+    meta["translate"] = use_translated
+    run_stages(job_dir, build_stages(job_dir, video_path, meta), only=RENDER_STAGES, progress=_stage_progress(job_dir))
+    return final_output(job_dir, video_path)
@@ -0,0 +1,70 @@
+import os
+import subprocess
+from pathlib import Path
+
+from src.logo import POS_MAP
+
+# x264 settings for renders that need a video encode (logo overlay)
+RENDER_PRESET = os.getenv("RENDER_PRESET", "veryfast")
+RENDER_CRF = int(os.getenv("RENDER_CRF", "20"))
+RENDER_THREADS = int(os.getenv("RENDER_THREADS", "0"))
+RENDER_AUDIO_BITRATE = os.getenv("RENDER_AUDIO_BITRATE", "192k")
+# EBU R128 loudness normalization of the dubbed track
+RENDER_LOUDNORM = os.getenv("RENDER_LOUDNORM", "0") not in ("0", "false", "")
+LOUDNORM_FILTER = "loudnorm=I=-16:TP=-1.5:LRA=11"
+# logo renders of videos longer than RENDER_SEGMENT_MIN_DURATION seconds are split into this many
+# keyframe-aligned chunks encoded in parallel (0/1 = single ffmpeg process)
+RENDER_SEGMENTS = int(os.getenv("RENDER_SEGMENTS", "0"))
+RENDER_SEGMENT_MIN_DURATION = float(os.getenv("RENDER_SEGMENT_MIN_DURATION", "600"))
+
+
+def build_render_command(video_path: str, audio_path: str, out_path: str, logo_path: str = None,
+                         position: str = "bottom-left", scale: float = 0.15, loudnorm: bool = RENDER_LOUDNORM,
+                         preset: str = RENDER_PRESET, crf: int = RENDER_CRF, threads: int = RENDER_THREADS):
+    cmd = ["ffmpeg", "-y", "-i", str(video_path), "-i", str(audio_path)]
+    filters = []
+    if logo_path:
+        cmd += ["-i", str(logo_path)]
+        pos = POS_MAP.get(position, POS_MAP["bottom-left"])
+        filters.append(f"[2]scale=trunc(iw*{scale}):-1[logo];[0:v][logo]overlay={pos}[v]")
+    if loudnorm:
+        filters.append(f"[1:a]{LOUDNORM_FILTER}[a]")
+    if filters:
+        cmd += ["-filter_complex", ";".join(filters)]
+    cmd += ["-map", "[v]" if logo_path else "0:v:0", "-map", "[a]" if loudnorm else "1:a:0"]
+    if logo_path:
+        cmd += ["-c:v", "libx264", "-preset", preset, "-crf", str(crf), "-pix_fmt", "yuv420p"]
+        if threads:
+            cmd += ["-threads", str(threads)]
+    else:
+        # nothing to draw on the picture: keep the original video stream untouched
+        cmd += ["-c:v", "copy"]
+    cmd += ["-c:a", "aac", "-b:a", RENDER_AUDIO_BITRATE, "-shortest", "-movflags", "+faststart", str(out_path)]
+    return cmd
+
+
+def render_final(video_path: str, audio_path: str, out_path: str, logo_path: str = None, **options):
+    """Produce the deliverable in one ffmpeg run: dubbed audio track, optional loudness
+    normalization and optional logo overlay share one filter graph, so the video is encoded
+    at most once (and stream-copied when there is no logo).
+    """
+    out_path = Path(out_path)
+    tmp = out_path.with_name(out_path.stem + ".tmp" + out_path.suffix)
+    segments = options.pop("segments", RENDER_SEGMENTS)
+    if logo_path and segments > 1 and _long_enough(video_path):
+        from src.logo import overlay_logo_parallel
+        overlay_logo_parallel(
+            video_path, logo_path, tmp, position=options.get("position", "bottom-left"), scale=options.get("scale", 0.15),
+            segments=segments, audio_path=audio_path,
+            audio_filter=LOUDNORM_FILTER if options.get("loudnorm", RENDER_LOUDNORM) else None,
+            preset=options.get("preset", RENDER_PRESET), crf=options.get("crf", RENDER_CRF), audio_bitrate=RENDER_AUDIO_BITRATE,
+        )
+    else:
+        subprocess.run(build_render_command(video_path, audio_path, tmp, logo_path, **options), check=True)
+    os.replace(tmp, out_path)
+    return str(out_path)
+
+
+def _long_enough(video_path: str):
+    from src.mixer import probe_duration
+    return (probe_duration(video_path) or 0) >= RENDER_SEGMENT_MIN_DURATION
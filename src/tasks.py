@@ -1,40 +1,82 @@
-import json
 from pathlib import Path
 
-from src.celery_app import celery_app
-from src.processor import process_job, synthesize_and_mix
+from celery import chain, chord, group
+
+from src.celery_app import celery_app, PRIORITIES
+from src.jobstore import get_job, set_status, record_error
+from src.processor import process_job, run_job_step, JOB_STEPS, TTS_QUEUE, TTS_FANOUT_BATCH
 
 
 @celery_app.task(bind=True)
 def process_video_task(self, job_id: str, file_path: str):
-    job_dir = Path("data/uploads") / job_id
-    meta = {}
-    if (job_dir / "meta.json").exists():
-        meta = json.loads((job_dir / "meta.json").read_text())
+    meta = get_job(job_id) or {}
     try:
         process_job(job_id, file_path, meta)
     except Exception as e:
-        meta.setdefault("errors", {})["celery_task"] = str(e)
-        meta["status"] = "failed"
-        (job_dir / "meta.json").write_text(json.dumps(meta))
+        record_error(job_id, "celery_task", e, status="failed")
         raise
 
 
 @celery_app.task(bind=True)
-def synthesize_with_mapping_task(self, job_id: str, mapping: dict):
-    job_dir = Path("data/uploads") / job_id
-    meta = {}
-    if (job_dir / "meta.json").exists():
-        meta = json.loads((job_dir / "meta.json").read_text())
+def job_step_task(self, proceed: bool, job_id: str, file_path: str, index: int, fanout: bool = True):
+    """One step of a split job (see processor.JOB_STEPS); `proceed` is the previous step's result.
+
+    With TTS_FANOUT_BATCH set, the synthesize step first replaces itself with a chord: the
+    uncached lines are synthesized in batches by any free tts-io worker, and the callback (this
+    step again, `fanout=False`) then finds every line in the shared cache and only mixes.
+    """
+    if not proceed:
+        return False
+    batches = []
+    if fanout and TTS_FANOUT_BATCH > 0 and "synthesize" in JOB_STEPS[index][1]:
+        from src.processor import plan_fanout
+        try:
+            batches = plan_fanout(job_id, file_path, TTS_FANOUT_BATCH)
+        except Exception as e:
+            # planning problems are reported by the synthesize stage itself
+            (Path("data/uploads") / job_id / "tts_fanout_error.txt").write_text(str(e))
+    if len(batches) > 1:
+        level = PRIORITIES.get((get_job(job_id) or {}).get("priority") or "normal", PRIORITIES["normal"])
+        header = group(synthesize_batch_task.s(job_id, batch).set(queue=TTS_QUEUE, priority=level) for batch in batches)
+        callback = job_step_task.si(True, job_id, file_path, index, fanout=False).set(queue=JOB_STEPS[index][0], priority=level)
+        # the rest of the chain continues after the callback
+        return self.replace(chord(header, callback))
     try:
-        original = job_dir / meta.get("filename")
-        out = synthesize_and_mix(job_dir, str(original), voice_gender=meta.get("voice_gender", "auto"), use_translated=meta.get("translate", True), speakers_map=mapping)
-        meta["status"] = "done"
-        meta["output"] = str(out)
-        (job_dir / "meta.json").write_text(json.dumps(meta))
+        return run_job_step(job_id, file_path, index)
     except Exception as e:
-        meta = json.loads((job_dir / "meta.json").read_text())
-        meta["status"] = "failed"
-        meta.setdefault("errors", {})["synthesize_with_mapping"] = str(e)
-        (job_dir / "meta.json").write_text(json.dumps(meta))
+        record_error(job_id, "celery_task", e, status="failed")
         raise
+
+
+@celery_app.task
+def synthesize_batch_task(job_id: str, items: list):
+    """Synthesize one fan-out batch into the TTS cache; returns the number of lines written."""
+    from src.processor import synthesize_batch
+    return synthesize_batch(job_id, items)
+
+
+@celery_app.task
+def finish_job_task(proceed: bool, job_id: str):
+    set_status(job_id, "done")
+
+
+def enqueue_job(job_id: str, file_path: str, priority: str = None, steps=None):
+    """Run a job as a chain of per-stage tasks, each routed to the queue of its resource class.
+
+    A worker slot is only held for one stage, so long movies and short clips interleave on
+    every queue, and `priority` ("high", "normal", "low") orders them within each queue.
+    `steps` limits the chain to some JOB_STEPS indices (e.g. re-synthesis after a voice change).
+    """
+    level = PRIORITIES.get(priority or "normal", PRIORITIES["normal"])
+    indices = list(range(len(JOB_STEPS))) if steps is None else list(steps)
+    signatures = [
+        job_step_task.s(*(((True,) if pos == 0 else ()) + (job_id, file_path, index))).set(queue=JOB_STEPS[index][0], priority=level)
+        for pos, index in enumerate(indices)
+    ]
+    return chain(*signatures, finish_job_task.s(job_id).set(priority=level)).apply_async()
+
+
+def enqueue_resynthesis(job_id: str, file_path: str, priority: str = None):
+    """Re-run synthesis, render and upload (speakers_mapping.json already updated)."""
+    first = next(i for i, (_, names) in enumerate(JOB_STEPS) if "synthesize" in names)
+    return enqueue_job(job_id, file_path, priority, steps=range(first, len(JOB_STEPS)))
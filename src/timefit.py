@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+
+# fastest allowed playback of a dubbed line (1.25 = 25% faster) before it is shifted/trimmed instead
+TIMEFIT_MAX_RATIO = float(os.getenv("TIMEFIT_MAX_RATIO", "1.25"))
+# how far a line may start before its segment when the previous line leaves a gap (seconds)
+TIMEFIT_MAX_SHIFT = float(os.getenv("TIMEFIT_MAX_SHIFT", "0.3"))
+# fade-out applied where an overlong line is cut (seconds)
+TIMEFIT_FADE = float(os.getenv("TIMEFIT_FADE", "0.03"))
+
+N_FFT = 1024
+HOP = N_FFT // 4
+
+
+def time_stretch(y, rate: float, n_fft: int = N_FFT, hop: int = HOP):
+    """Pitch-preserving time stretch: `rate` > 1 plays faster (output is len(y) / rate samples).
+
+    Phase vocoder without Python loops: one batched rFFT over all frames, magnitudes interpolated
+    at fractional frame positions, phases accumulated with cumsum, and overlap-add via bincount.
+    """
+    y = np.asarray(y, dtype=np.float32)
+    out_len = int(round(len(y) / rate))
+    if rate == 1.0 or len(y) < n_fft:
+        return y[:out_len]
+    window = np.hanning(n_fft + 1)[:-1]
+    pad = n_fft // 2
+    x = np.pad(y, (pad, pad + n_fft))
+    frames = np.lib.stride_tricks.sliding_window_view(x, n_fft)[::hop] * window
+    spec = np.fft.rfft(frames, axis=1)
+
+    steps = np.arange(0, spec.shape[0] - 1, rate)
+    idx = steps.astype(int)
+    alpha = (steps - idx)[:, None]
+    mag = (1 - alpha) * np.abs(spec[idx]) + alpha * np.abs(spec[idx + 1])
+    # expected phase advance per hop for each bin, plus the wrapped deviation actually measured
+    omega = 2 * np.pi * hop * np.arange(spec.shape[1]) / n_fft
+    dphi = np.angle(spec[idx + 1]) - np.angle(spec[idx]) - omega
+    dphi -= 2 * np.pi * np.round(dphi / (2 * np.pi))
+    advance = np.cumsum(dphi + omega, axis=0)
+    phase = np.angle(spec[0]) + np.vstack([np.zeros((1, spec.shape[1])), advance[:-1]])
+
+    out_frames = np.fft.irfft(mag * np.exp(1j * phase), n=n_fft, axis=1) * window
+    positions = (np.arange(len(steps))[:, None] * hop + np.arange(n_fft)).ravel()
+    out = np.bincount(positions, weights=out_frames.ravel(), minlength=len(steps) * hop + n_fft)
+    # squared Hann windows at 75% overlap sum to a constant
+    out /= (window ** 2).sum() / hop
+    out = out[pad:pad + out_len]
+    if len(out) < out_len:
+        out = np.pad(out, (0, out_len - len(out)))
+    return out.astype(np.float32)
+
+
+def compute_slots(segments, duration: float = None):
+    """Time window each segment's line may occupy: `[(earliest, latest)]` in segment order.
+
+    A line may start as early as the end of the previous segment and run until the next one
+    starts (or to the end of the video for the last line), but never less than its own span.
+    """
+    order = sorted(range(len(segments)), key=lambda i: float(segments[i].get("start", 0)))
+    slots = [None] * len(segments)
+    for pos, i in enumerate(order):
+        start = float(segments[i].get("start", 0))
+        end = float(segments[i].get("end", start))
+        prev_end = float(segments[order[pos - 1]].get("end", 0)) if pos > 0 else 0.0
+        if pos + 1 < len(order):
+            next_start = float(segments[order[pos + 1]].get("start", end))
+        else:
+            next_start = duration if duration else float("inf")
+        slots[i] = (min(prev_end, start), max(next_start, end))
+    return slots
+
+
+def fit_clip(samples, sample_rate: int, start: float, slot, max_ratio: float = TIMEFIT_MAX_RATIO,
+             max_shift: float = TIMEFIT_MAX_SHIFT, fade: float = TIMEFIT_FADE):
+    """Make a clip placed at `start` end before `slot[1]`.
+
+    In order: speed it up by at most `max_ratio`, move it earlier into the gap before it
+    (at most `max_shift`), and finally cut it with a short fade-out. Returns
+    `(samples, start, rate)`.
+    """
+    earliest, latest = slot
+    duration = len(samples) / sample_rate
+    available = latest - start
+    if duration <= available or available <= 0:
+        return samples, start, 1.0
+    rate = min(duration / available, max_ratio)
+    if rate > 1.0:
+        samples = time_stretch(samples, rate)
+        duration = len(samples) / sample_rate
+    if duration > available:
+        start = max(earliest, start - max_shift, latest - duration)
+        available = latest - start
+    if duration > available:
+        keep = int(available * sample_rate)
+        samples = np.array(samples[:keep], dtype=np.float32)
+        n = min(int(fade * sample_rate), keep)
+        if n:
+            samples[-n:] *= np.linspace(1.0, 0.0, n, dtype=np.float32)
+    return samples, start, rate
@@ -1,51 +1,277 @@
+import hashlib
 import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import ctranslate2
+except Exception:
+    ctranslate2 = None
+
+try:
+    import transformers
+except Exception:
+    transformers = None
 
+# default backend; a job can override it with its `translate_backend` field
+TRANSLATE_BACKEND = os.getenv("TRANSLATE_BACKEND", "google")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+GOOGLE_TRANSLATE_URL = os.getenv("GOOGLE_TRANSLATE_URL", "https://translation.googleapis.com/language/translate/v2")
+# per-request limits of the v2 API: at most 128 `q` values, ~5k characters recommended
+TRANSLATE_MAX_SEGMENTS = int(os.getenv("TRANSLATE_MAX_SEGMENTS", "128"))
+TRANSLATE_MAX_CHARS = int(os.getenv("TRANSLATE_MAX_CHARS", "5000"))
+TRANSLATE_CONCURRENCY = int(os.getenv("TRANSLATE_CONCURRENCY", "4"))
+TRANSLATE_MAX_RETRIES = int(os.getenv("TRANSLATE_MAX_RETRIES", "4"))
+TRANSLATE_TIMEOUT = float(os.getenv("TRANSLATE_TIMEOUT", "60"))
+# persistent (text, source, target) -> translation store shared by all jobs on this host
+TRANSLATE_CACHE_PATH = Path(os.getenv("TRANSLATE_CACHE_PATH", "data/translate_cache.sqlite"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# local backend: CTranslate2 conversion of a Marian/OPUS-MT model; `{source}`/`{target}` are
+# filled in per language pair, e.g. models/opus-mt-{source}-{target}
+TRANSLATE_LOCAL_MODEL = os.getenv("TRANSLATE_LOCAL_MODEL", "models/opus-mt-{source}-{target}")
+TRANSLATE_LOCAL_DEVICE = os.getenv("TRANSLATE_LOCAL_DEVICE", "cpu")
+TRANSLATE_LOCAL_THREADS = int(os.getenv("TRANSLATE_LOCAL_THREADS", "0"))
+# sentences per forward pass; inputs are sorted by length first so batches need little padding
+TRANSLATE_LOCAL_BATCH = int(os.getenv("TRANSLATE_LOCAL_BATCH", "32"))
+
+_local = threading.local()
+_session = None
+_session_lock = threading.Lock()
+
+
+def _db():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        TRANSLATE_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(TRANSLATE_CACHE_PATH), timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            " key TEXT PRIMARY KEY, source TEXT NOT NULL, target TEXT NOT NULL,"
+            " text TEXT NOT NULL, translated TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        _local.conn = conn
+    return conn
+
+
+def _cache_key(text: str, source: str, target: str, backend: str = "google"):
+    # Google keys predate backends and keep their original form
+    prefix = "" if backend == "google" else f"{backend}|"
+    return hashlib.sha256(f"{prefix}{source or 'auto'}|{target}|{text}".encode("utf-8")).hexdigest()
+
+
+def cache_get_many(texts, source: str, target: str, backend: str = "google"):
+    """Cached translations for `texts` as `{text: translated}` (misses are absent)."""
+    conn = _db()
+    found = {}
+    keys = {_cache_key(t, source, target, backend): t for t in texts}
+    items = list(keys.items())
+    # stay under SQLite's bound-parameter limit
+    for i in range(0, len(items), 500):
+        chunk = items[i:i + 500]
+        rows = conn.execute(
+            f"SELECT key, translated FROM translations WHERE key IN ({','.join('?' * len(chunk))})",
+            [k for k, _ in chunk],
+        ).fetchall()
+        for key, translated in rows:
+            found[keys[key]] = translated
+    return found
+
+
+def cache_put_many(pairs, source: str, target: str, backend: str = "google"):
+    conn = _db()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(
+            "INSERT OR REPLACE INTO translations (key, source, target, text, translated, created) VALUES (?, ?, ?, ?, ?, ?)",
+            [(_cache_key(t, source, target, backend), source or "auto", target, t, tr, now) for t, tr in pairs],
+        )
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def _get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            # keep-alive pool large enough for every concurrent batch
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(TRANSLATE_CONCURRENCY, 1))
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def make_batches(texts, max_segments: int = TRANSLATE_MAX_SEGMENTS, max_chars: int = TRANSLATE_MAX_CHARS):
+    """Greedily group `texts` into lists that respect both per-request limits.
+
+    A single text longer than `max_chars` still gets its own batch.
+    """
+    batches, current, size = [], [], 0
+    for t in texts:
+        if current and (len(current) >= max_segments or size + len(t) > max_chars):
+            batches.append(current)
+            current, size = [], 0
+        current.append(t)
+        size += len(t)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _post(payload):
+    session = _get_session()
+    for attempt in range(TRANSLATE_MAX_RETRIES + 1):
+        try:
+            r = session.post(GOOGLE_TRANSLATE_URL, params={"key": GOOGLE_API_KEY}, data=payload, timeout=TRANSLATE_TIMEOUT)
+        except requests.RequestException:
+            if attempt >= TRANSLATE_MAX_RETRIES:
+                raise
+        else:
+            if r.ok:
+                return r.json()
+            if r.status_code not in RETRY_STATUSES or attempt >= TRANSLATE_MAX_RETRIES:
+                raise RuntimeError(f"Translation API error: {r.status_code} {r.text}")
+        time.sleep(min(2 ** attempt, 30) * (0.5 + random.random() / 2))
+
+
+class GoogleTranslator:
+    """Google Cloud Translation v2 over a shared keep-alive session."""
+
+    name = "google"
+    concurrency = TRANSLATE_CONCURRENCY
 
+    def __init__(self):
+        if not GOOGLE_API_KEY:
+            raise RuntimeError("GOOGLE_API_KEY is not set")
 
-def translate_segments(segments, target_language: str):
+    def batches(self, texts):
+        return make_batches(texts)
+
+    def translate_batch(self, batch, target: str, source: str = None):
+        payload = [("q", t) for t in batch] + [("target", target), ("format", "text")]
+        if source:
+            payload.append(("source", source))
+        translations = _post(payload).get("data", {}).get("translations", [])
+        if len(translations) == len(batch):
+            return [tr.get("translatedText", "") for tr in translations]
+        if len(batch) == 1:
+            return [""]
+        # count mismatch: retry the halves instead of falling back to one call per line
+        mid = len(batch) // 2
+        return self.translate_batch(batch[:mid], target, source) + self.translate_batch(batch[mid:], target, source)
+
+
+class LocalTranslator:
+    """Offline CPU translation with a CTranslate2 Marian model per language pair.
+
+    Models are loaded once per worker process and reused by every job; all texts of a call
+    are sorted by token count and translated `TRANSLATE_LOCAL_BATCH` at a time.
+    """
+
+    name = "local"
+    # one call at a time: CTranslate2 already spreads a batch over TRANSLATE_LOCAL_THREADS
+    concurrency = 1
+
+    def __init__(self, model_template: str = TRANSLATE_LOCAL_MODEL, device: str = TRANSLATE_LOCAL_DEVICE):
+        if ctranslate2 is None or transformers is None:
+            raise RuntimeError("Local translation requires ctranslate2 and transformers")
+        self.model_template = model_template
+        self.device = device
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _model(self, source: str, target: str):
+        if "{source}" in self.model_template and not source:
+            raise RuntimeError("Local translation needs the source language")
+        path = self.model_template.format(source=source, target=target)
+        with self._lock:
+            if path not in self._models:
+                if not Path(path).exists():
+                    raise RuntimeError(f"Translation model not found: {path}")
+                translator = ctranslate2.Translator(path, device=self.device, intra_threads=TRANSLATE_LOCAL_THREADS)
+                tokenizer = transformers.AutoTokenizer.from_pretrained(path)
+                self._models[path] = (translator, tokenizer)
+            return self._models[path]
+
+    def batches(self, texts):
+        # the model batches internally, so the whole call is one unit of work
+        return [list(texts)] if texts else []
+
+    def translate_batch(self, batch, target: str, source: str = None):
+        translator, tokenizer = self._model(source, target)
+        tokens = [tokenizer.convert_ids_to_tokens(tokenizer.encode(t)) for t in batch]
+        order = sorted(range(len(batch)), key=lambda i: len(tokens[i]))
+        out = [""] * len(batch)
+        for start in range(0, len(order), TRANSLATE_LOCAL_BATCH):
+            idx = order[start:start + TRANSLATE_LOCAL_BATCH]
+            results = translator.translate_batch([tokens[i] for i in idx], max_batch_size=TRANSLATE_LOCAL_BATCH)
+            for i, res in zip(idx, results):
+                ids = tokenizer.convert_tokens_to_ids(res.hypotheses[0])
+                out[i] = tokenizer.decode(ids, skip_special_tokens=True)
+        return out
+
+
+BACKENDS = {
+    "google": GoogleTranslator,
+    "local": LocalTranslator,
+}
+
+_translators = {}
+_translators_lock = threading.Lock()
+
+
+def get_translator(name: str = None):
+    """Process-wide translator instance for backend `name` (default TRANSLATE_BACKEND)."""
+    name = name or TRANSLATE_BACKEND
+    if name not in BACKENDS:
+        raise RuntimeError(f"Unknown translation backend: {name}")
+    with _translators_lock:
+        if name not in _translators:
+            _translators[name] = BACKENDS[name]()
+        return _translators[name]
+
+
+def translate_texts(texts, target: str, source: str = None, backend: str = None):
+    """Translate `texts`, returning translations in the same order.
+
+    Identical lines are translated once and cached lines are not sent at all; the rest are
+    split into the backend's batches and run `concurrency` at a time.
+    """
+    backend = backend or TRANSLATE_BACKEND
+    unique = list(dict.fromkeys(t for t in texts if t.strip()))
+    done = cache_get_many(unique, source, target, backend)
+    missing = [t for t in unique if t not in done]
+    if missing:
+        translator = get_translator(backend)
+        batches = translator.batches(missing)
+        with ThreadPoolExecutor(max_workers=max(1, min(translator.concurrency, len(batches)))) as ex:
+            for batch, result in zip(batches, ex.map(lambda b: translator.translate_batch(b, target, source), batches)):
+                pairs = [(t, tr) for t, tr in zip(batch, result) if tr]
+                cache_put_many(pairs, source, target, backend)
+                done.update(pairs)
+    return [done.get(t, "") for t in texts]
+
+
+def translate_segments(segments, target_language: str, source_language: str = None, backend: str = None):
     """Translate a list of segments in-place and return new list with `translated` field."""
     if not target_language:
         return segments
-    if not GOOGLE_API_KEY:
-        raise RuntimeError("GOOGLE_API_KEY is not set")
-
-    url = f"https://translation.googleapis.com/language/translate/v2?key={GOOGLE_API_KEY}"
-
-    texts = [s.get("text", "") for s in segments]
-    # Build form data: multiple 'q' fields
-    data = {
-        "target": target_language,
-        "format": "text",
-    }
-    # requests will encode lists as multiple fields when using tuples
-    payload = []
-    for t in texts:
-        payload.append(("q", t))
-    payload.append(("target", target_language))
-    payload.append(("format", "text"))
-
-    r = requests.post(url, data=payload)
-    if not r.ok:
-        raise RuntimeError(f"Translation API error: {r.status_code} {r.text}")
-
-    data = r.json()
-    translations = data.get("data", {}).get("translations", [])
-    if len(translations) != len(segments):
-        # If mismatch, try minimal fallback: translate segment by segment
-        translations = []
-        for t in texts:
-            r = requests.post(url, data={"q": t, "target": target_language, "format": "text"})
-            if not r.ok:
-                translations.append({"translatedText": ""})
-            else:
-                translations.append(r.json().get("data", {}).get("translations", [])[0])
-
+    translations = translate_texts([(s.get("text") or "").strip() for s in segments], target_language, source_language, backend)
     out_segments = []
     for s, tr in zip(segments, translations):
         s2 = s.copy()
-        s2["translated"] = tr.get("translatedText", "")
+        s2["translated"] = tr
         out_segments.append(s2)
-
     return out_segments
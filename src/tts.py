@@ -1,77 +1,170 @@
+import asyncio
 import os
-import requests
+import random
+import time
 from pathlib import Path
 
+try:
+    import httpx
+except Exception:
+    httpx = None
+
 ELEVEN_API_KEY = os.getenv("ELEVENLABS_API_KEY")
 ELEVEN_BASE = os.getenv("ELEVENLABS_BASE_URL", "https://api.elevenlabs.io")
 ELEVEN_VOICE_ID = os.getenv("ELEVENLABS_VOICE_ID")
+# concurrent requests allowed by the account plan
+ELEVEN_MAX_IN_FLIGHT = int(os.getenv("ELEVENLABS_MAX_IN_FLIGHT", "4"))
+# request start rate (requests/second, 0 = only limited by in-flight count)
+ELEVEN_RATE = float(os.getenv("ELEVENLABS_RATE", "0"))
+ELEVEN_MAX_RETRIES = int(os.getenv("ELEVENLABS_MAX_RETRIES", "5"))
+ELEVEN_TIMEOUT = float(os.getenv("ELEVENLABS_TIMEOUT", "60"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# default engine for jobs and speakers that do not choose one: "elevenlabs" or "local"
+TTS_BACKEND = os.getenv("TTS_BACKEND", "elevenlabs")
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, up to `capacity` banked."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncElevenTTS:
+    """asyncio ElevenLabs client for synthesizing many lines at once.
+
+    One pooled keep-alive HTTP client, at most `max_in_flight` concurrent requests (match the
+    plan's concurrency quota), optional `rate` limit via a token bucket, and exponential
+    backoff with jitter on 429/5xx and transport errors (honouring Retry-After). Point
+    `base_url` at a local stub (scripts/tts_stub_server.py) to exercise it without the API.
+
+        async with AsyncElevenTTS() as tts:
+            results = await tts.synthesize_many([{"text": ..., "out_path": ...}, ...])
+    """
 
+    name = "elevenlabs"
 
-class ElevenTTS:
-    def __init__(self, api_key: str = None, base_url: str = None, default_voice: str = None):
+    def __init__(self, api_key: str = None, base_url: str = None, default_voice: str = None,
+                 max_in_flight: int = ELEVEN_MAX_IN_FLIGHT, rate: float = ELEVEN_RATE,
+                 max_retries: int = ELEVEN_MAX_RETRIES, timeout: float = ELEVEN_TIMEOUT):
+        if httpx is None:
+            raise RuntimeError("httpx is not installed")
         self.api_key = api_key or ELEVEN_API_KEY
         self.base = base_url or ELEVEN_BASE
         self.default_voice = default_voice or ELEVEN_VOICE_ID
         if not self.api_key:
             raise RuntimeError("ELEVENLABS_API_KEY is not set")
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate)
+        self._sem = None
+        self._client = None
 
-    def _get_default_voice(self):
-        # Try to get first available voice
-        url = f"{self.base}/v1/voices"
-        headers = {"xi-api-key": self.api_key}
-        r = requests.get(url, headers=headers)
-        if r.ok:
-            j = r.json()
-            voices = j.get("voices", [])
-            if voices:
-                return voices[0].get("voice_id") or voices[0].get("id")
-        return None
-
-    def pick_voice_by_gender(self, gender: str = None):
-        """Try to pick a voice that matches gender hint (best-effort)."""
-        if gender is None:
-            return self._get_default_voice()
-        url = f"{self.base}/v1/voices"
-        headers = {"xi-api-key": self.api_key}
-        r = requests.get(url, headers=headers)
-        if not r.ok:
-            return self._get_default_voice()
-        voices = r.json().get("voices", [])
-        # Heuristic: look for gender words in voice name or description
-        g = gender.lower()
-        for v in voices:
-            name = (v.get("name") or "").lower()
-            if g in name:
-                return v.get("voice_id") or v.get("id")
-        # fallback: return first voice
-        if voices:
-            return voices[0].get("voice_id") or voices[0].get("id")
-        return None
-
-    def synthesize_to_wav(self, text: str, out_path: str, voice_id: str = None, model: str = None, voice_gender: str = None):
-        voice = voice_id or self.default_voice or self._get_default_voice()
-        if voice_gender and not voice_id:
-            candidate = self.pick_voice_by_gender(voice_gender)
-            if candidate:
-                voice = candidate
+    async def __aenter__(self):
+        self._sem = asyncio.Semaphore(self.max_in_flight)
+        self._client = httpx.AsyncClient(
+            base_url=self.base,
+            headers={"xi-api-key": self.api_key},
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_in_flight, max_keepalive_connections=self.max_in_flight),
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._client.aclose()
+        self._client = None
+
+    def _backoff(self, attempt: int, retry_after: str = None):
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return min(30.0, 0.5 * (2 ** attempt)) * (0.5 + random.random() / 2)
+
+    async def _request(self, method: str, url: str, out_path: Path = None, **kwargs):
+        """Send a request with rate limiting and retries; stream the body to `out_path` if given."""
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                async with self._sem:
+                    async with self._client.stream(method, url, **kwargs) as r:
+                        if r.status_code < 400:
+                            if out_path is None:
+                                await r.aread()
+                                return r
+                            out_path.parent.mkdir(parents=True, exist_ok=True)
+                            with out_path.open("wb") as f:
+                                async for chunk in r.aiter_bytes(8192):
+                                    f.write(chunk)
+                            return r
+                        body = (await r.aread()).decode("utf-8", "replace")
+                        retry_after = r.headers.get("retry-after")
+                        if r.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                            raise RuntimeError(f"ElevenLabs TTS error: {r.status_code} {body}")
+            except httpx.TransportError:
+                if attempt >= self.max_retries:
+                    raise
+                retry_after = None
+            await asyncio.sleep(self._backoff(attempt, retry_after))
+            attempt += 1
+
+    async def pick_voice_by_gender(self, gender: str = None, key: str = None):
+        from src.voices import get_catalog
+        catalog = get_catalog(self.api_key, self.base)
+        # the first call per process fetches /v1/voices; later ones are dictionary lookups
+        return await asyncio.to_thread(catalog.resolve, gender, key)
+
+    async def synthesize_to_wav(self, text: str, out_path: str, voice_id: str = None, model: str = None, voice_gender: str = None):
+        voice = voice_id or (await self.pick_voice_by_gender(voice_gender) if voice_gender else None) \
+            or self.default_voice or await self.pick_voice_by_gender(None)
         if not voice:
             raise RuntimeError("No voice available for ElevenLabs API")
-        url = f"{self.base}/v1/text-to-speech/{voice}"
-        headers = {
-            "xi-api-key": self.api_key,
-            "Content-Type": "application/json",
-            "Accept": "audio/wav",
-        }
         payload = {"text": text}
         if model:
             payload["model_id"] = model
-        r = requests.post(url, json=payload, headers=headers, stream=True, timeout=60)
-        if not r.ok:
-            raise RuntimeError(f"ElevenLabs TTS error: {r.status_code} {r.text}")
         out_path = Path(out_path)
-        out_path.parent.mkdir(parents=True, exist_ok=True)
-        with out_path.open("wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
+        await self._request("POST", f"/v1/text-to-speech/{voice}", out_path=out_path, json=payload,
+                            headers={"Accept": "audio/wav"})
         return str(out_path)
+
+    async def synthesize_many(self, items):
+        """Synthesize `items` (dicts with text, out_path and optional voice_id/voice_gender/model).
+
+        Returns one result per item, in order: the written path or the raised exception.
+        """
+        return await asyncio.gather(*[
+            self.synthesize_to_wav(it["text"], it["out_path"], voice_id=it.get("voice_id"),
+                                   model=it.get("model"), voice_gender=it.get("voice_gender"))
+            for it in items
+        ], return_exceptions=True)
+
+
+def get_tts(backend: str = None, **kwargs):
+    """Async TTS engine for `backend` (default TTS_BACKEND); all engines share one interface."""
+    backend = backend or TTS_BACKEND
+    if backend == "elevenlabs":
+        return AsyncElevenTTS(**kwargs)
+    if backend == "local":
+        from src.tts_local import LocalTTS
+        return LocalTTS(**kwargs)
+    raise RuntimeError(f"Unknown TTS backend: {backend}")
@@ -1,26 +1,279 @@
 import hashlib
-from pathlib import Path
+import os
 import shutil
+import sqlite3
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
 
-CACHE_DIR = Path("data/tts_cache")
+CACHE_DIR = Path(os.getenv("TTS_CACHE_DIR", "data/tts_cache"))
 CACHE_DIR.mkdir(parents=True, exist_ok=True)
+# byte budget for cached audio; least recently used entries are evicted above it (0 = unbounded)
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(20 * 1024 ** 3)))
+# storage format for new entries: wav (as received), flac (lossless) or opus (smallest)
+TTS_CACHE_FORMAT = os.getenv("TTS_CACHE_FORMAT", "wav")
+INDEX_PATH = CACHE_DIR / "index.sqlite"
+# shared L2 tier in S3/MinIO so every worker reuses lines synthesized anywhere in the fleet
+TTS_CACHE_S3 = os.getenv("TTS_CACHE_S3", "1") not in ("0", "false", "")
+TTS_CACHE_S3_BUCKET = os.getenv("TTS_CACHE_S3_BUCKET") or os.getenv("S3_BUCKET")
+TTS_CACHE_S3_PREFIX = os.getenv("TTS_CACHE_S3_PREFIX", "tts_cache/")
+TTS_CACHE_S3_WORKERS = int(os.getenv("TTS_CACHE_S3_WORKERS", "16"))
+
+_ENCODE_ARGS = {
+    "flac": ["-c:a", "flac"],
+    "opus": ["-c:a", "libopus", "-b:a", "48k"],
+}
+
+_local = threading.local()
+_s3_client = None
+
+
+def _db():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(str(INDEX_PATH), timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, last_access REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO stats VALUES ('total_bytes', 0)")
+        _local.conn = conn
+    return conn
 
 
-def _make_key(text: str, voice_id: str = None, voice_gender: str = None, model: str = None):
-    key_src = (text or "") + "|" + (voice_id or "") + "|" + (voice_gender or "") + "|" + (model or "")
+@contextmanager
+def _tx(conn):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def _make_key(text: str, voice_id: str = None, voice_gender: str = None, model: str = None, backend: str = None):
+    # ElevenLabs keys predate backends and keep their original form
+    prefix = "" if (backend or "elevenlabs") == "elevenlabs" else f"{backend}|"
+    key_src = prefix + (text or "") + "|" + (voice_id or "") + "|" + (voice_gender or "") + "|" + (model or "")
     return hashlib.sha256(key_src.encode("utf-8")).hexdigest()
 
 
-def get_cached(text: str, voice_id: str = None, voice_gender: str = None, model: str = None):
-    key = _make_key(text, voice_id, voice_gender, model)
-    path = CACHE_DIR / f"{key}.wav"
-    if path.exists():
-        return str(path)
+def _shard_path(key: str, ext: str):
+    # two levels of 256 directories keep every directory small even with millions of entries
+    return CACHE_DIR / key[:2] / key[2:4] / f"{key}.{ext}"
+
+
+def _index(conn, key: str, path: Path):
+    now = time.time()
+    size = path.stat().st_size
+    rel = str(path.relative_to(CACHE_DIR))
+    with _tx(conn):
+        old = conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (key, path, size, created, last_access, hits) VALUES (?, ?, ?, ?, ?, 0)",
+            (key, rel, size, now, now),
+        )
+        conn.execute("UPDATE stats SET value = value + ? WHERE name = 'total_bytes'", (size - (old[0] if old else 0),))
+
+
+def _adopt_unindexed(conn, key: str):
+    """Index a file that exists on disk but not in the index (legacy flat layout or lost index)."""
+    for candidate in [_shard_path(key, ext) for ext in ("wav", "flac", "opus")] + [CACHE_DIR / f"{key}.wav"]:
+        if candidate.exists():
+            if candidate.parent == CACHE_DIR:
+                dest = _shard_path(key, "wav")
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(candidate, dest)
+                candidate = dest
+            _index(conn, key, candidate)
+            return candidate
     return None
 
 
-def store_cache(src_wav: str, text: str, voice_id: str = None, voice_gender: str = None, model: str = None):
-    key = _make_key(text, voice_id, voice_gender, model)
-    dest = CACHE_DIR / f"{key}.wav"
-    shutil.copy(src_wav, dest)
+def lookup(key: str):
+    """Return the cached file for `key` (recording the hit) or None."""
+    conn = _db()
+    row = conn.execute("SELECT path FROM entries WHERE key = ?", (key,)).fetchone()
+    if row:
+        path = CACHE_DIR / row[0]
+        if path.exists():
+            conn.execute("UPDATE entries SET last_access = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+            return str(path)
+        _forget(conn, key)
+    path = _adopt_unindexed(conn, key)
+    return str(path) if path else None
+
+
+def _forget(conn, key: str):
+    with _tx(conn):
+        row = conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+        if row:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            conn.execute("UPDATE stats SET value = value - ? WHERE name = 'total_bytes'", (row[0],))
+
+
+def _encode_into(src: Path, dest: Path, fmt: str, move: bool):
+    tmp = dest.with_name(dest.name + f".{os.getpid()}.tmp")
+    cmd = ["ffmpeg", "-v", "error", "-y", "-i", str(src)] + _ENCODE_ARGS[fmt] + ["-f", "ogg" if fmt == "opus" else fmt, str(tmp)]
+    subprocess.run(cmd, check=True)
+    os.replace(tmp, dest)
+    if move:
+        src.unlink(missing_ok=True)
+
+
+def _move_into(src: Path, dest: Path, move: bool):
+    tmp = dest.with_name(dest.name + f".{os.getpid()}.tmp")
+    if move:
+        try:
+            os.replace(src, tmp)
+        except OSError:
+            # different filesystem: fall back to copy + delete
+            shutil.move(str(src), str(tmp))
+    else:
+        shutil.copyfile(src, tmp)
+    # rename is atomic, so readers never see a partially written entry
+    os.replace(tmp, dest)
+
+
+def store(key: str, src_wav: str, move: bool = True, fmt: str = None):
+    fmt = fmt or TTS_CACHE_FORMAT
+    if fmt not in _ENCODE_ARGS:
+        fmt = "wav"
+    src = Path(src_wav)
+    dest = _shard_path(key, fmt)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    if fmt == "wav":
+        _move_into(src, dest, move)
+    else:
+        _encode_into(src, dest, fmt, move)
+    conn = _db()
+    _index(conn, key, dest)
+    _remote_put(key, dest, fmt)
+    evict()
+    return str(dest)
+
+
+def evict(max_bytes: int = None):
+    """Delete least recently used entries until the cache fits in 90% of `max_bytes`."""
+    max_bytes = TTS_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    if not max_bytes:
+        return 0
+    conn = _db()
+    total = conn.execute("SELECT value FROM stats WHERE name = 'total_bytes'").fetchone()[0]
+    if total <= max_bytes:
+        return 0
+    target = int(max_bytes * 0.9)
+    removed = 0
+    while total > target:
+        rows = conn.execute("SELECT key, path, size FROM entries ORDER BY last_access LIMIT 256").fetchall()
+        if not rows:
+            break
+        for key, rel, size in rows:
+            (CACHE_DIR / rel).unlink(missing_ok=True)
+            _forget(conn, key)
+            total -= size
+            removed += 1
+            if total <= target:
+                break
+    return removed
+
+
+def stats():
+    conn = _db()
+    count, hits = conn.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM entries").fetchone()
+    total = conn.execute("SELECT value FROM stats WHERE name = 'total_bytes'").fetchone()[0]
+    return {"entries": count, "bytes": total, "hits": hits, "max_bytes": TTS_CACHE_MAX_BYTES}
+
+
+def _s3():
+    """S3 client for the shared tier, or None when it is not configured."""
+    if not (TTS_CACHE_S3 and TTS_CACHE_S3_BUCKET):
+        return None
+    global _s3_client
+    if _s3_client is None:
+        # boto3 clients are thread-safe, so one is shared by all prefetch threads
+        try:
+            from src.storage import get_s3_client
+            _s3_client = get_s3_client()
+        except Exception:
+            return None
+    return _s3_client
+
+
+def _s3_key(key: str):
+    return f"{TTS_CACHE_S3_PREFIX}{key[:2]}/{key}"
+
+
+def _remote_put(key: str, path: Path, fmt: str):
+    s3 = _s3()
+    if s3 is None:
+        return
+    try:
+        s3.upload_file(str(path), TTS_CACHE_S3_BUCKET, _s3_key(key), ExtraArgs={"Metadata": {"format": fmt}})
+    except Exception:
+        # the local entry is still valid; another worker will just synthesize it again
+        pass
+
+
+def _remote_fetch(key: str):
+    """Download `key` from the shared tier into the local cache; None if it is not there."""
+    s3 = _s3()
+    if s3 is None:
+        return None
+    try:
+        head = s3.head_object(Bucket=TTS_CACHE_S3_BUCKET, Key=_s3_key(key))
+    except Exception:
+        return None
+    fmt = (head.get("Metadata") or {}).get("format", "wav")
+    dest = _shard_path(key, fmt)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(dest.name + f".{os.getpid()}.{threading.get_ident()}.dl")
+    try:
+        s3.download_file(TTS_CACHE_S3_BUCKET, _s3_key(key), str(tmp))
+        os.replace(tmp, dest)
+    except Exception:
+        tmp.unlink(missing_ok=True)
+        return None
+    _index(_db(), key, dest)
     return str(dest)
+
+
+def lookup_many(keys):
+    """Resolve many keys at once: local index first, then the shared tier for all misses in parallel.
+
+    Returns `{key: path or None}`. Remote hits are downloaded into the local cache.
+    """
+    found = {key: lookup(key) for key in keys}
+    missing = [k for k, v in found.items() if v is None]
+    if missing and _s3() is not None:
+        with ThreadPoolExecutor(max_workers=max(1, min(TTS_CACHE_S3_WORKERS, len(missing)))) as ex:
+            for key, path in zip(missing, ex.map(_remote_fetch, missing)):
+                found[key] = path
+    return found
+
+
+def get_cached(text: str, voice_id: str = None, voice_gender: str = None, model: str = None, backend: str = None):
+    key = _make_key(text, voice_id, voice_gender, model, backend)
+    return lookup(key) or _remote_fetch(key)
+
+
+def get_cached_many(items):
+    """`items` are dicts with text and optional voice_id/voice_gender/model/backend; returns paths (or None) in order."""
+    keys = [_make_key(it.get("text"), it.get("voice_id"), it.get("voice_gender"), it.get("model"), it.get("backend")) for it in items]
+    found = lookup_many(keys)
+    return [found[k] for k in keys]
+
+
+def store_cache(src_wav: str, text: str, voice_id: str = None, voice_gender: str = None, model: str = None, move: bool = True,
+                backend: str = None):
+    """Add a synthesized file to the cache. By default the file is renamed into place (not copied)."""
+    return store(_make_key(text, voice_id, voice_gender, model, backend), src_wav, move=move)
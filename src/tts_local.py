@@ -0,0 +1,187 @@
+import asyncio
+import hashlib
+import os
+import queue
+import threading
+import wave
+from concurrent.futures import Future
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import torch
+except Exception:
+    torch = None
+
+try:
+    import transformers
+except Exception:
+    transformers = None
+
+# VITS checkpoint (Hugging Face id or local dir) used when a voice does not name one
+TTS_LOCAL_MODEL = os.getenv("TTS_LOCAL_MODEL", "facebook/mms-tts-rus")
+# gender -> voices, e.g. "female=kakao-enterprise/vits-vctk#4|kakao-enterprise/vits-vctk#10,male=kakao-enterprise/vits-vctk#1";
+# a voice is "<model>" or "<model>#<speaker id>" for multi-speaker checkpoints
+TTS_LOCAL_VOICES = {
+    k.strip(): [v for v in vs.split("|") if v]
+    for k, vs in (item.split("=", 1) for item in os.getenv("TTS_LOCAL_VOICES", "").split(",") if "=" in item)
+}
+TTS_LOCAL_BATCH = int(os.getenv("TTS_LOCAL_BATCH", "8"))
+# how long the batcher waits for more lines before running a partial batch (seconds)
+TTS_LOCAL_BATCH_WAIT = float(os.getenv("TTS_LOCAL_BATCH_WAIT", "0.05"))
+TTS_LOCAL_THREADS = int(os.getenv("TTS_LOCAL_THREADS", "0"))
+
+VOICE_PREFIX = "local:"
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def parse_voice(voice: str = None):
+    """`local:<model>#<speaker>` -> (model, speaker id or None)."""
+    voice = (voice or "")[len(VOICE_PREFIX):] if (voice or "").startswith(VOICE_PREFIX) else (voice or "")
+    model, _, speaker = voice.partition("#")
+    return model or TTS_LOCAL_MODEL, int(speaker) if speaker else None
+
+
+def resolve_voice(gender: str = None, key: str = None):
+    """Local voice id for `gender`; with a `key` the choice is a stable hash, as in VoiceCatalog.resolve."""
+    candidates = TTS_LOCAL_VOICES.get((gender or "").lower()) or []
+    if not candidates:
+        return VOICE_PREFIX + TTS_LOCAL_MODEL
+    idx = int(hashlib.sha1(key.encode("utf-8")).hexdigest(), 16) % len(candidates) if key else 0
+    return VOICE_PREFIX + candidates[idx]
+
+
+def get_model(name: str = None):
+    """Load a VITS model and tokenizer once per process."""
+    if torch is None or transformers is None:
+        raise RuntimeError("Local TTS requires torch and transformers")
+    name = name or TTS_LOCAL_MODEL
+    with _models_lock:
+        if name not in _models:
+            if TTS_LOCAL_THREADS:
+                torch.set_num_threads(TTS_LOCAL_THREADS)
+            model = transformers.VitsModel.from_pretrained(name).eval()
+            tokenizer = transformers.AutoTokenizer.from_pretrained(name)
+            _models[name] = (model, tokenizer)
+        return _models[name]
+
+
+def write_wav(path: Path, samples, sample_rate: int):
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(pcm.tobytes())
+
+
+class LocalSynthesizer:
+    """Resident VITS model with a batching request queue (same scheme as asr.TranscriptionService).
+
+    Lines submitted from any thread are drained by one service thread up to `batch_size` at a
+    time and synthesized per speaker in a single padded forward pass.
+    """
+
+    def __init__(self, model_name: str = None, batch_size: int = TTS_LOCAL_BATCH, batch_wait: float = TTS_LOCAL_BATCH_WAIT):
+        self.model_name = model_name or TTS_LOCAL_MODEL
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait
+        self.model, self.tokenizer = get_model(self.model_name)
+        self.sample_rate = self.model.config.sampling_rate
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name=f"tts-{self.model_name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str, out_path: str, speaker_id: int = None):
+        fut = Future()
+        self._queue.put((text, Path(out_path), speaker_id, fut))
+        return fut
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get(timeout=self.batch_wait))
+            except queue.Empty:
+                pass
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        groups = {}
+        for item in batch:
+            if item[3].set_running_or_notify_cancel():
+                groups.setdefault(item[2], []).append(item)
+        for speaker_id, items in groups.items():
+            try:
+                waves = self._forward([text for text, _, _, _ in items], speaker_id)
+            except Exception:
+                # fall back to one-by-one so a single bad line does not fail the whole batch
+                waves = None
+            for i, (text, out_path, _, fut) in enumerate(items):
+                try:
+                    samples = waves[i] if waves is not None else self._forward([text], speaker_id)[0]
+                    write_wav(out_path, samples, self.sample_rate)
+                    fut.set_result(str(out_path))
+                except Exception as e:
+                    fut.set_exception(e)
+
+    def _forward(self, texts, speaker_id: int = None):
+        inputs = self.tokenizer(texts, return_tensors="pt", padding=True)
+        kwargs = {"speaker_id": speaker_id} if speaker_id is not None else {}
+        with torch.no_grad():
+            out = self.model(**inputs, **kwargs)
+        waveforms = out.waveform.cpu().numpy()
+        lengths = out.sequence_lengths.cpu().numpy() if out.sequence_lengths is not None else [waveforms.shape[1]] * len(texts)
+        return [w[:int(n)] for w, n in zip(waveforms, lengths)]
+
+
+_synthesizers = {}
+_synthesizers_lock = threading.Lock()
+
+
+def get_synthesizer(model_name: str = None):
+    model_name = model_name or TTS_LOCAL_MODEL
+    with _synthesizers_lock:
+        if model_name not in _synthesizers:
+            _synthesizers[model_name] = LocalSynthesizer(model_name)
+        return _synthesizers[model_name]
+
+
+class LocalTTS:
+    """CPU TTS with the same async interface as tts.AsyncElevenTTS.
+
+    Concurrent `synthesize_to_wav` calls are batched by the per-model LocalSynthesizer, so
+    pipelined synthesis (processor._synthesize_and_place) gets several lines per forward pass.
+    """
+
+    name = "local"
+
+    def __init__(self):
+        if torch is None or transformers is None:
+            raise RuntimeError("Local TTS requires torch and transformers")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return None
+
+    async def pick_voice_by_gender(self, gender: str = None, key: str = None):
+        return resolve_voice(gender, key)
+
+    async def synthesize_to_wav(self, text: str, out_path: str, voice_id: str = None, model: str = None, voice_gender: str = None):
+        model_name, speaker_id = parse_voice(voice_id or resolve_voice(voice_gender))
+        synth = await asyncio.to_thread(get_synthesizer, model or model_name)
+        return await asyncio.wrap_future(synth.submit(text, out_path, speaker_id))
+
+    async def synthesize_many(self, items):
+        return await asyncio.gather(*[
+            self.synthesize_to_wav(it["text"], it["out_path"], voice_id=it.get("voice_id"),
+                                   model=it.get("model"), voice_gender=it.get("voice_gender"))
+            for it in items
+        ], return_exceptions=True)
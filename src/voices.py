@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+
+try:
+    import redis
+except Exception:
+    redis = None
+
+# seconds a fetched catalog is considered fresh; stale entries are served while a refresh runs
+VOICE_CATALOG_TTL = float(os.getenv("VOICE_CATALOG_TTL", "3600"))
+# optional shared tier so all workers reuse one /v1/voices fetch
+VOICE_CATALOG_REDIS_URL = os.getenv("VOICE_CATALOG_REDIS_URL") or os.getenv("CELERY_BROKER_URL")
+REDIS_KEY = "anime:voices:{base}"
+
+
+def _parse_voice(v: dict):
+    labels = v.get("labels") or {}
+    gender = (labels.get("gender") or "").lower()
+    name = v.get("name") or ""
+    if gender not in ("male", "female"):
+        # Heuristic: look for gender words in voice name
+        lowered = name.lower()
+        gender = "female" if "female" in lowered else "male" if "male" in lowered else ""
+    return {"voice_id": v.get("voice_id") or v.get("id"), "name": name, "gender": gender, "labels": labels}
+
+
+class VoiceCatalog:
+    """Memoized ElevenLabs voice list with a gender index.
+
+    `resolve()` is a dictionary lookup after the first fetch. The list is kept for
+    `ttl` seconds in-process (and in Redis when configured); once stale it is still served
+    while a background thread refreshes it, so synthesis never waits on /v1/voices twice.
+    """
+
+    def __init__(self, api_key: str, base_url: str, ttl: float = VOICE_CATALOG_TTL, redis_url: str = VOICE_CATALOG_REDIS_URL):
+        self.api_key = api_key
+        self.base = base_url
+        self.ttl = ttl
+        self.session = requests.Session()
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._voices = None
+        self._by_gender = {}
+        self._fetched_at = 0.0
+        self._redis = None
+        if redis is not None and redis_url and redis_url.startswith(("redis://", "rediss://")):
+            try:
+                self._redis = redis.Redis.from_url(redis_url)
+            except Exception:
+                self._redis = None
+
+    def _fetch(self):
+        r = self.session.get(f"{self.base}/v1/voices", headers={"xi-api-key": self.api_key}, timeout=30)
+        if not r.ok:
+            raise RuntimeError(f"ElevenLabs voices error: {r.status_code} {r.text}")
+        return [_parse_voice(v) for v in r.json().get("voices", [])]
+
+    def _load_shared(self):
+        if self._redis is None:
+            return None
+        try:
+            raw = self._redis.get(REDIS_KEY.format(base=self.base))
+            return json.loads(raw) if raw else None
+        except Exception:
+            return None
+
+    def _store_shared(self, voices):
+        if self._redis is None:
+            return
+        try:
+            self._redis.set(REDIS_KEY.format(base=self.base), json.dumps(voices), ex=int(self.ttl))
+        except Exception:
+            pass
+
+    def _set(self, voices, fetched_at: float = None):
+        by_gender = {}
+        for v in voices:
+            if v["voice_id"]:
+                by_gender.setdefault(v["gender"], []).append(v["voice_id"])
+        for ids in by_gender.values():
+            ids.sort()
+        self._voices = voices
+        self._by_gender = by_gender
+        self._fetched_at = fetched_at or time.time()
+
+    def refresh(self):
+        voices = self._fetch()
+        self._store_shared(voices)
+        with self._lock:
+            self._set(voices)
+        return voices
+
+    def _refresh_in_background(self):
+        def run():
+            try:
+                self.refresh()
+            except Exception:
+                pass
+            finally:
+                self._refreshing = False
+        self._refreshing = True
+        threading.Thread(target=run, name="voice-catalog-refresh", daemon=True).start()
+
+    def voices(self):
+        with self._lock:
+            if self._voices is None:
+                shared = self._load_shared()
+                if shared is not None:
+                    self._set(shared)
+            voices, age = self._voices, time.time() - self._fetched_at
+        if voices is None:
+            return self.refresh()
+        if age > self.ttl and not self._refreshing:
+            self._refresh_in_background()
+        return voices
+
+    def by_gender(self, gender: str = None):
+        self.voices()
+        return list(self._by_gender.get((gender or "").lower(), []))
+
+    def default_voice(self):
+        voices = self.voices()
+        return voices[0]["voice_id"] if voices else None
+
+    def resolve(self, gender: str = None, key: str = None):
+        """Pick a voice id for `gender`.
+
+        With a `key` (e.g. job + speaker) the choice is a stable hash into the sorted voices of
+        that gender, so one speaker keeps one voice and different speakers are spread out;
+        without a key the first matching voice is used.
+        """
+        candidates = self.by_gender(gender) if gender else []
+        if not candidates:
+            return self.default_voice()
+        if key is None:
+            return candidates[0]
+        idx = int(hashlib.sha1(key.encode("utf-8")).hexdigest(), 16) % len(candidates)
+        return candidates[idx]
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(api_key: str, base_url: str):
+    """Process-wide catalog per (API key, base URL)."""
+    with _catalogs_lock:
+        cat = _catalogs.get((api_key, base_url))
+        if cat is None:
+            cat = VoiceCatalog(api_key, base_url)
+            _catalogs[(api_key, base_url)] = cat
+        return cat
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# keep the suite off shared state: a private TTS cache, no S3 tier, a private SQLite job store
+os.environ["TTS_CACHE_DIR"] = tempfile.mkdtemp(prefix="tts_cache_")
+os.environ["TTS_CACHE_S3"] = "0"
+os.environ.pop("CELERY_BROKER_URL", None)
+os.environ.pop("JOBSTORE_URL", None)
+os.environ["JOBSTORE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="jobstore_"), "jobs.sqlite")
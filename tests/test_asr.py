@@ -0,0 +1,67 @@
+import numpy as np
+
+from src.asr import split_on_silence, stitch_results
+
+SR = 16000
+
+
+def _speech_with_pauses(pauses, total):
+    """int16 noise at speech level with silent gaps at the given (start, end) seconds."""
+    rng = np.random.default_rng(0)
+    y = (rng.standard_normal(int(total * SR)) * 3000).astype(np.int16)
+    for start, end in pauses:
+        y[int(start * SR):int(end * SR)] = 0
+    return y
+
+
+def test_split_on_silence_cuts_inside_pauses():
+    pauses = [(7.0, 8.0), (16.0, 17.0)]
+    y = _speech_with_pauses(pauses, 24.0)
+    ranges = split_on_silence(y, SR, min_chunk=5, max_chunk=10)
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(y)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+    cuts = [end / SR for _, end in ranges[:-1]]
+    assert len(cuts) == 2
+    for cut, (start, end) in zip(cuts, pauses):
+        assert start <= cut <= end
+
+
+def test_split_on_silence_respects_chunk_bounds():
+    y = _speech_with_pauses([], 60.0)
+    ranges = split_on_silence(y, SR, min_chunk=5, max_chunk=10)
+    for start, end in ranges[:-1]:
+        assert 5 <= (end - start) / SR <= 10
+    assert ranges[-1][1] == len(y)
+
+
+def test_split_on_silence_short_and_empty_input():
+    y = _speech_with_pauses([], 3.0)
+    assert split_on_silence(y, SR, min_chunk=5, max_chunk=10) == [(0, len(y))]
+    assert split_on_silence(np.zeros(0, dtype=np.int16), SR) == []
+    assert split_on_silence(np.zeros(10, dtype=np.int16), SR) == [(0, 10)]
+
+
+def test_stitch_results_offsets_timestamps():
+    first = {"text": " a b", "language": "ja", "segments": [
+        {"id": 0, "start": 0.0, "end": 1.0, "seek": 0, "text": " a"},
+        {"id": 1, "start": 1.5, "end": 2.0, "seek": 0, "text": " b",
+         "words": [{"word": " b", "start": 1.5, "end": 2.0}]},
+    ]}
+    second = {"text": " c", "language": "ja", "segments": [
+        {"id": 0, "start": 0.5, "end": 1.0, "seek": 0, "text": " c"},
+    ]}
+    third = {"text": "", "language": "en", "segments": []}
+    out = stitch_results([first, second, third], [0.0, 60.0, 120.0])
+    assert out["text"] == " a b c"
+    assert out["language"] == "ja"
+    assert [s["id"] for s in out["segments"]] == [0, 1, 2]
+    assert [(s["start"], s["end"]) for s in out["segments"]] == [(0.0, 1.0), (1.5, 2.0), (60.5, 61.0)]
+    assert out["segments"][2]["seek"] == 6000
+    assert out["segments"][1]["words"][0]["start"] == 1.5
+    # inputs are not modified
+    assert second["segments"][0]["start"] == 0.5
+
+
+def test_stitch_results_empty():
+    assert stitch_results([], []) == {"text": "", "segments": [], "language": None}
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from src.gender import _frames, yin_f0
+
+SR = 16000
+
+
+@pytest.mark.parametrize("f0", [90.0, 120.0, 220.0, 310.0])
+def test_yin_f0_sine(f0):
+    t = np.arange(SR) / SR
+    y = (0.5 * np.sin(2 * np.pi * f0 * t)).astype(np.float32)
+    frames = _frames(y, 800, 320)
+    est, voiced = yin_f0(frames, SR)
+    assert voiced.all()
+    assert np.allclose(est, f0, rtol=0.01)
+
+
+def test_yin_f0_harmonic_voice_picks_fundamental():
+    t = np.arange(SR) / SR
+    y = sum(np.sin(2 * np.pi * 140.0 * k * t) / k for k in (1, 2, 3)).astype(np.float32)
+    est, voiced = yin_f0(_frames(y, 800, 320), SR)
+    assert voiced.all()
+    assert np.median(est) == pytest.approx(140.0, rel=0.01)
+
+
+def test_yin_f0_noise_is_unvoiced():
+    y = np.random.default_rng(0).standard_normal(SR).astype(np.float32)
+    _, voiced = yin_f0(_frames(y, 800, 320), SR)
+    assert voiced.mean() < 0.1
+
+
+def test_yin_f0_no_frames():
+    frames = _frames(np.zeros(100, dtype=np.float32), 800, 320)
+    est, voiced = yin_f0(frames, SR)
+    assert est.shape == voiced.shape == (0,)
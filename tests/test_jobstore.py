@@ -0,0 +1,82 @@
+import json
+import threading
+
+import pytest
+
+from src import jobstore
+from src.jobstore import SqliteJobStore, _flatten, _unflatten
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    s = SqliteJobStore(tmp_path / "jobs.sqlite")
+    monkeypatch.setattr(jobstore, "_store", s)
+    monkeypatch.setattr(jobstore, "UPLOAD_DIR", tmp_path / "uploads")
+    return s
+
+
+def test_flatten_roundtrip():
+    fields = {"status": "processing", "errors": {"tts": "boom"}, "progress": {"transcribe": 50.0}, "meta": {"a": 1}}
+    flat = _flatten(fields)
+    assert flat == {"status": "processing", "errors.tts": "boom", "progress.transcribe": 50.0, "meta": {"a": 1}}
+    assert _unflatten(flat) == fields
+
+
+def test_field_updates_do_not_clobber(store, tmp_path):
+    store.update("j", {"status": "processing", "filename": "a.mp4"})
+    # a second store on the same file behaves like another process
+    other = SqliteJobStore(tmp_path / "jobs.sqlite")
+
+    def write(s, prefix):
+        for i in range(50):
+            s.update("j", {f"progress.{prefix}": float(i), f"{prefix}_count": i})
+
+    threads = [threading.Thread(target=write, args=(store, "asr")), threading.Thread(target=write, args=(other, "tts"))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    job = store.get("j")
+    assert job["filename"] == "a.mp4" and job["status"] == "processing"
+    assert job["progress"] == {"asr": 49.0, "tts": 49.0}
+    assert job["asr_count"] == job["tts_count"] == 49
+
+
+def test_errors_and_progress_helpers(store):
+    jobstore.create_job("j", {"status": "queued"})
+    jobstore.set_progress("j", "transcribe", 33.333)
+    jobstore.record_error("j", "translate", ValueError("bad"))
+    jobstore.record_error("j", "tts", "quota", status="failed")
+    job = jobstore.get_job("j")
+    assert job["progress"] == {"transcribe": 33.3}
+    assert job["errors"] == {"translate": "bad", "tts": "quota"}
+    assert job["status"] == "failed"
+    assert job["created"] <= job["updated"]
+
+
+def test_list_and_count_by_status(store):
+    for i, status in enumerate(["queued", "done", "queued", "failed"]):
+        jobstore.create_job(f"j{i}", {"status": status})
+    jobstore.set_status("j0", "processing")
+    assert jobstore.count_jobs() == 4
+    assert jobstore.count_jobs("queued") == 1
+    assert jobstore.list_jobs("queued") == ["j2"]
+    assert jobstore.list_jobs("processing") == ["j0"]
+    assert jobstore.count_jobs("missing") == 0
+    # newest first, paged
+    assert jobstore.list_jobs(limit=2) == ["j3", "j2"]
+    assert jobstore.list_jobs(limit=2, offset=2) == ["j1", "j0"]
+
+
+def test_get_job_imports_legacy_meta(store, tmp_path):
+    job_dir = tmp_path / "uploads" / "old"
+    job_dir.mkdir(parents=True)
+    (job_dir / "meta.json").write_text(json.dumps({"status": "done", "filename": "ep.mp4", "errors": {"tts": "x"}}))
+    assert jobstore.get_job("missing") is None
+    job = jobstore.get_job("old")
+    assert job["status"] == "done" and job["filename"] == "ep.mp4" and job["job_id"] == "old"
+    assert job["errors"] == {"tts": "x"}
+    assert jobstore.list_jobs("done") == ["old"]
+    # imported once: later reads come from the store
+    (job_dir / "meta.json").unlink()
+    assert jobstore.get_job("old")["filename"] == "ep.mp4"
@@ -0,0 +1,119 @@
+import wave
+
+import numpy as np
+
+from src import mixer
+from src.mixer import StemSet, Timeline
+
+SR = 8000
+
+
+def _clip(value, seconds):
+    return np.full(int(seconds * SR), value, dtype=np.float32)
+
+
+def _read_pcm(path):
+    with wave.open(str(path)) as w:
+        assert (w.getnchannels(), w.getsampwidth(), w.getframerate()) == (1, 2, SR)
+        return np.frombuffer(w.readframes(w.getnframes()), "<i2")
+
+
+def test_timeline_sums_overlaps_and_grows():
+    timeline = Timeline(1.0, SR)
+    timeline.add(_clip(0.25, 0.5), 0.25)
+    timeline.add(_clip(0.25, 0.5), 0.5, gain=2.0)
+    timeline.add(_clip(0.1, 1.0), 1.5)
+    timeline.add(_clip(0.3, 0.5), -0.25)
+    out = timeline.render()
+    assert len(out) == int(2.5 * SR)
+    assert np.allclose(out[:SR // 4], 0.3)
+    assert np.allclose(out[SR // 4:SR // 2], 0.25)
+    assert np.allclose(out[SR // 2:3 * SR // 4], 0.75)
+    assert np.allclose(out[int(1.5 * SR):], 0.1)
+
+
+def test_timeline_render_scales_only_above_ceiling():
+    timeline = Timeline(1.0, SR)
+    timeline.add(_clip(0.6, 0.5), 0.0)
+    assert np.allclose(timeline.render(ceiling=0.9)[:SR // 2], 0.6)
+    timeline.add(_clip(0.6, 0.25), 0.0)
+    out = timeline.render(ceiling=0.9)
+    assert np.isclose(np.abs(out).max(), 0.9)
+    assert np.allclose(out[SR // 4:SR // 2], 0.45)
+
+
+def test_write_wav_in_blocks_matches_whole_track(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    timeline = Timeline(3.0, SR)
+    for start in (0.0, 0.7, 1.1, 2.5):
+        timeline.add(rng.uniform(-0.8, 0.8, SR).astype(np.float32), start)
+    expected = (np.clip(timeline.render(), -1.0, 1.0) * 32767.0).astype("<i2")
+    monkeypatch.setattr(mixer, "WAV_BLOCK_SAMPLES", 1000)
+    pcm = _read_pcm(timeline.write_wav(tmp_path / "mix.wav"))
+    assert len(pcm) == timeline.length
+    assert np.abs(pcm.astype(np.int32) - expected).max() <= 1
+    assert np.abs(pcm).max() <= int(mixer.MIX_CEILING * 32767) + 1
+
+
+def test_write_wav_empty(tmp_path):
+    assert len(_read_pcm(Timeline(0.0, SR).write_wav(tmp_path / "empty.wav"))) == 0
+
+
+def _stems(path):
+    stems = StemSet(str(path), sample_rate=SR)
+    stems.add("A", _clip(0.1, 0.5), 0.0)
+    stems.add("A", _clip(0.2, 0.5), 2.0)
+    stems.add("B", _clip(0.3, 1.0), 1.0)
+    stems.save("A", "key-a", [["a1"], ["a2"]])
+    stems.save("B", "key-b", [["b1"]])
+    stems.write_manifest()
+    return stems
+
+
+def _mix(stems, duration=3.0):
+    timeline = Timeline(duration, SR)
+    stems.mix_into(timeline)
+    return timeline.render()
+
+
+def test_stemset_mix_matches_direct_mix(tmp_path):
+    direct = Timeline(3.0, SR)
+    direct.add(_clip(0.1, 0.5), 0.0)
+    direct.add(_clip(0.2, 0.5), 2.0)
+    direct.add(_clip(0.3, 1.0), 1.0)
+    assert np.allclose(_mix(_stems(tmp_path)), direct.render())
+
+
+def test_stemset_reload_and_reusable(tmp_path):
+    _stems(tmp_path)
+    stems = StemSet(str(tmp_path), sample_rate=SR)
+    assert stems.reusable("A", "key-a")
+    assert not stems.reusable("A", "other")
+    assert not stems.reusable("C", "key-a")
+    assert stems.stems["A"]["plan"] == [["a1"], ["a2"]]
+    assert stems.stems["A"]["clips"] == [[0, SR // 2], [2 * SR, SR // 2]]
+    # a different sample rate invalidates every stem
+    assert not StemSet(str(tmp_path), sample_rate=SR * 2).reusable("A", "key-a")
+
+
+def test_stemset_replace_one_speaker(tmp_path):
+    _stems(tmp_path)
+    stems = StemSet(str(tmp_path), sample_rate=SR)
+    stems.add("B", _clip(0.4, 0.5), 1.5)
+    stems.save("B", "key-b2", [["b2"]])
+    stems.write_manifest()
+    mixed = _mix(StemSet(str(tmp_path), sample_rate=SR))
+    assert np.allclose(mixed[int(1.0 * SR):int(1.5 * SR)], 0.0)
+    assert np.allclose(mixed[int(1.5 * SR):int(2.0 * SR)], 0.4)
+    assert np.allclose(mixed[:SR // 2], 0.1)
+
+
+def test_stemset_keep_only(tmp_path):
+    stems = _stems(tmp_path)
+    path_b = stems._path("B")
+    stems.keep_only({"A"})
+    stems.write_manifest()
+    assert not path_b.exists()
+    reloaded = StemSet(str(tmp_path), sample_rate=SR)
+    assert list(reloaded.stems) == ["A"]
+    assert np.allclose(_mix(reloaded)[SR:2 * SR], 0.0)
@@ -0,0 +1,36 @@
+import json
+
+from src.notify import append_event, parse_events, read_events
+
+
+def _line(event):
+    return (json.dumps(event) + "\n").encode("utf-8")
+
+
+def test_parse_events_offsets():
+    a, b = _line({"type": "a"}), _line({"type": "b"})
+    events = parse_events(a + b, offset=100)
+    assert events == [(100 + len(a), {"type": "a"}), (100 + len(a) + len(b), {"type": "b"})]
+
+
+def test_parse_events_leaves_partial_line():
+    a = _line({"type": "a"})
+    events = parse_events(a + b'{"type": "b"', offset=0)
+    assert events == [(len(a), {"type": "a"})]
+    assert parse_events(b'{"type": "b"') == []
+
+
+def test_parse_events_skips_blank_and_invalid_lines():
+    a = _line({"type": "a"})
+    chunk = b"\n" + b"not json\n" + a
+    assert parse_events(chunk) == [(len(chunk), {"type": "a"})]
+
+
+def test_read_events_resumes_from_offset(tmp_path):
+    assert read_events(str(tmp_path)) == []
+    append_event(str(tmp_path), "progress", percent=10)
+    first = read_events(str(tmp_path))
+    assert [e["percent"] for _, e in first] == [10]
+    append_event(str(tmp_path), "progress", percent=20)
+    rest = read_events(str(tmp_path), first[-1][0])
+    assert [e["percent"] for _, e in rest] == [20]
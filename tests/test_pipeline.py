@@ -0,0 +1,112 @@
+import pytest
+
+from src.pipeline import CHECKPOINT_DIR, Stage, run_stages
+
+
+class Counter:
+    """Stage body that copies its input upper-cased and counts runs; `result` is what it returns."""
+
+    def __init__(self, src, dest, result=None):
+        self.src, self.dest, self.result = src, dest, result
+        self.runs = 0
+
+    def __call__(self, job_dir):
+        self.runs += 1
+        (job_dir / self.dest).write_text((job_dir / self.src).read_text().upper())
+        return self.result
+
+
+@pytest.fixture
+def job_dir(tmp_path):
+    (tmp_path / "in.txt").write_text("hello")
+    return tmp_path
+
+
+def _stages(job_dir, params, first=None, second=None):
+    first = first or Counter("in.txt", "mid.txt")
+    second = second or Counter("mid.txt", "out.txt")
+    return [
+        Stage("first", first, inputs=[job_dir / "in.txt"], outputs=[job_dir / "mid.txt"], params=params),
+        Stage("second", second, inputs=[job_dir / "mid.txt"], outputs=[job_dir / "out.txt"]),
+    ], first, second
+
+
+def test_unchanged_inputs_are_cached(job_dir):
+    stages, first, second = _stages(job_dir, {"lang": "ru"})
+    assert run_stages(job_dir, stages) == {"first": "done", "second": "done"}
+    assert run_stages(job_dir, stages) == {"first": "cached", "second": "cached"}
+    assert (first.runs, second.runs) == (1, 1)
+    assert run_stages(job_dir, stages, force=True) == {"first": "done", "second": "done"}
+    assert (first.runs, second.runs) == (2, 2)
+
+
+def test_changed_input_reruns_downstream(job_dir):
+    stages, first, second = _stages(job_dir, {"lang": "ru"})
+    run_stages(job_dir, stages)
+    (job_dir / "in.txt").write_text("hello, world")
+    assert run_stages(job_dir, stages) == {"first": "done", "second": "done"}
+    assert (job_dir / "out.txt").read_text() == "HELLO, WORLD"
+
+
+def test_changed_param_reruns_only_when_output_changes(job_dir):
+    stages, first, second = _stages(job_dir, {"lang": "ru"})
+    run_stages(job_dir, stages)
+    stages, _, _ = _stages(job_dir, lambda d: {"lang": "en"}, first, second)
+    # same text written again: the second stage's input hash is unchanged
+    assert run_stages(job_dir, stages) == {"first": "done", "second": "cached"}
+    assert (first.runs, second.runs) == (2, 1)
+
+
+def test_missing_output_reruns(job_dir):
+    stages, first, _ = _stages(job_dir, {})
+    run_stages(job_dir, stages)
+    (job_dir / "mid.txt").unlink()
+    assert run_stages(job_dir, stages, only=("first",)) == {"first": "done"}
+    assert first.runs == 2
+
+
+def test_optional_failure_is_logged_and_pipeline_continues(job_dir):
+    def boom(_):
+        raise RuntimeError("no logo")
+
+    stages = [
+        Stage("logo", boom, optional=True),
+        Stage("copy", Counter("in.txt", "out.txt"), inputs=[job_dir / "in.txt"], outputs=[job_dir / "out.txt"]),
+    ]
+    assert run_stages(job_dir, stages) == {"logo": "failed", "copy": "done"}
+    assert (job_dir / "logo_error.txt").read_text() == "no logo"
+    assert not (job_dir / CHECKPOINT_DIR / "logo.json").exists()
+
+
+def test_required_failure_raises(job_dir):
+    def boom(_):
+        raise RuntimeError("asr died")
+
+    with pytest.raises(RuntimeError, match="asr died"):
+        run_stages(job_dir, [Stage("transcribe", boom)])
+
+
+def test_when_false_skips(job_dir):
+    body = Counter("in.txt", "out.txt")
+    progress = []
+    stages = [Stage("logo", body, outputs=[job_dir / "out.txt"], when=lambda d: (d / "logo.png").exists())]
+    assert run_stages(job_dir, stages, progress=lambda name, pct: progress.append((name, pct))) == {"logo": "skipped"}
+    assert body.runs == 0 and progress == [("logo", 100)]
+    (job_dir / "logo.png").write_bytes(b"")
+    assert run_stages(job_dir, stages) == {"logo": "done"}
+
+
+def test_partial_result_leaves_no_checkpoint(job_dir):
+    body = Counter("in.txt", "out.txt", result=False)
+    stages = [Stage("synthesize", body, inputs=[job_dir / "in.txt"], outputs=[job_dir / "out.txt"])]
+    assert run_stages(job_dir, stages) == {"synthesize": "partial"}
+    assert (job_dir / "out.txt").exists()
+    assert not (job_dir / CHECKPOINT_DIR / "synthesize.json").exists()
+    assert run_stages(job_dir, stages) == {"synthesize": "partial"}
+    body.result = None
+    assert run_stages(job_dir, stages) == {"synthesize": "done"}
+    # a later partial run drops the checkpoint of the complete one
+    body.result = False
+    assert run_stages(job_dir, stages, force=True) == {"synthesize": "partial"}
+    assert not (job_dir / CHECKPOINT_DIR / "synthesize.json").exists()
+    assert body.runs == 4
@@ -0,0 +1,101 @@
+import json
+import uuid
+import wave
+
+import numpy as np
+import pytest
+
+from src import mixer, processor, tts
+from src.pipeline import run_stages
+
+SR = 16000
+
+
+def _read_wav(path, sample_rate=mixer.MIX_SAMPLE_RATE):
+    with wave.open(str(path)) as w:
+        x = np.frombuffer(w.readframes(w.getnframes()), "<i2").astype(np.float32) / 32768
+    t = np.arange(int(len(x) * sample_rate / SR)) * SR / sample_rate
+    return np.interp(t, np.arange(len(x)), x).astype(np.float32)
+
+
+class FakeTTS:
+    """Tone per gender, length per text; texts in `fail` raise once."""
+
+    name = "elevenlabs"
+
+    def __init__(self):
+        self.calls = []
+        self.fail = set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return None
+
+    async def synthesize_to_wav(self, text, out_path, voice_id=None, model=None, voice_gender=None):
+        self.calls.append((text, voice_gender))
+        if text in self.fail:
+            self.fail.discard(text)
+            raise RuntimeError("synthesis failed")
+        t = np.arange(int(SR * (0.3 + 0.01 * len(text)))) / SR
+        tone = np.sin(2 * np.pi * (220 if voice_gender == "male" else 440) * t) * 8000
+        with wave.open(str(out_path), "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(SR)
+            w.writeframes(tone.astype("<i2").tobytes())
+
+
+@pytest.fixture
+def job(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    engine = FakeTTS()
+    monkeypatch.setattr(tts, "get_tts", lambda name=None, **kwargs: engine)
+    monkeypatch.setattr(mixer, "decode_clip", _read_wav)
+    job_dir = tmp_path / "data" / "uploads" / uuid.uuid4().hex
+    job_dir.mkdir(parents=True)
+    tag = uuid.uuid4().hex[:8]  # unique lines, so the shared TTS cache starts cold
+    segments = [
+        {"start": i * 1.5, "end": i * 1.5 + 1.0, "text": f"{tag} line {i}", "speakers": ["A" if i % 2 else "B"]}
+        for i in range(8)
+    ]
+    (job_dir / "transcript.json").write_text(json.dumps({"segments": segments}))
+    (job_dir / "video.mp4").write_bytes(b"")
+    return job_dir, engine, segments
+
+
+def _synthesize(job_dir, mapping):
+    (job_dir / "speakers_mapping.json").write_text(json.dumps(mapping))
+    meta = {"translate": False, "voice_gender": "auto"}
+    stages = processor.build_stages(job_dir, job_dir / "video.mp4", meta)
+    return run_stages(job_dir, stages, only=("synthesize",))["synthesize"]
+
+
+def test_failed_line_is_retried_and_remap_only_redoes_changed_speaker(job):
+    job_dir, engine, segments = job
+    engine.fail.add(segments[3]["text"])
+
+    assert _synthesize(job_dir, {"A": "male", "B": "female"}) == "partial"
+    plan = json.loads((job_dir / "tts_plan.json").read_text())
+    assert sorted(it["segment"] for it in plan) == [0, 1, 2, 4, 5, 6, 7]
+
+    # same inputs again: the stage is not cached, only the failed line is synthesized
+    engine.calls.clear()
+    assert _synthesize(job_dir, {"A": "male", "B": "female"}) == "done"
+    assert engine.calls == [(segments[3]["text"], "male")]
+    assert len(json.loads((job_dir / "tts_plan.json").read_text())) == 8
+    assert _synthesize(job_dir, {"A": "male", "B": "female"}) == "cached"
+
+    # assign voices again: only speaker B's lines are redone
+    engine.calls.clear()
+    assert _synthesize(job_dir, {"A": "male", "B": "male"}) == "done"
+    assert sorted(engine.calls) == sorted((segments[i]["text"], "male") for i in (0, 2, 4, 6))
+
+    # the sum of stems equals mixing every line from scratch
+    full = mixer.Timeline(0.0)
+    processor.synthesize_segments(job_dir, job_dir / "transcript.json", "auto", {"A": "male", "B": "male"}, timeline=full)
+    with wave.open(str(job_dir / "tts_mixed.wav")) as w:
+        mixed = np.frombuffer(w.readframes(w.getnframes()), "<i2")
+    expected = (np.clip(full.render(), -1.0, 1.0) * 32767.0).astype("<i2")
+    assert np.array_equal(mixed, expected)
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from src.timefit import compute_slots, fit_clip, time_stretch
+
+SR = 16000
+
+
+def _tone(seconds, f0=440.0):
+    t = np.arange(int(seconds * SR)) / SR
+    return (0.5 * np.sin(2 * np.pi * f0 * t)).astype(np.float32)
+
+
+def _peak_hz(y):
+    spec = np.abs(np.fft.rfft(y * np.hanning(len(y))))
+    return np.argmax(spec) * SR / len(y)
+
+
+@pytest.mark.parametrize("rate", [0.8, 1.2, 1.5])
+def test_time_stretch_length_and_pitch(rate):
+    y = _tone(2.0)
+    out = time_stretch(y, rate)
+    assert out.dtype == np.float32
+    assert len(out) == int(round(len(y) / rate))
+    middle = out[len(out) // 4:3 * len(out) // 4]
+    assert _peak_hz(middle) == pytest.approx(440.0, abs=5)
+
+
+def test_time_stretch_identity_and_short_input():
+    y = _tone(0.5)
+    assert np.array_equal(time_stretch(y, 1.0), y)
+    short = y[:100]
+    assert len(time_stretch(short, 2.0)) == 50
+
+
+def test_compute_slots():
+    segments = [
+        {"start": 5.0, "end": 7.0},
+        {"start": 1.0, "end": 3.0},
+        {"start": 8.0, "end": 9.5},
+    ]
+    assert compute_slots(segments, duration=12.0) == [(3.0, 8.0), (0.0, 5.0), (7.0, 12.0)]
+    assert compute_slots(segments)[2] == (7.0, float("inf"))
+
+
+def test_compute_slots_overlapping_segments_keep_their_span():
+    segments = [{"start": 1.0, "end": 4.0}, {"start": 3.0, "end": 5.0}]
+    assert compute_slots(segments, duration=6.0) == [(0.0, 4.0), (3.0, 6.0)]
+
+
+def test_fit_clip_fits_unchanged():
+    y = _tone(1.0)
+    out, start, rate = fit_clip(y, SR, 2.0, (1.0, 4.0))
+    assert out is y and start == 2.0 and rate == 1.0
+
+
+def test_fit_clip_speeds_up_within_ratio():
+    y = _tone(1.2)
+    out, start, rate = fit_clip(y, SR, 2.0, (2.0, 3.0), max_ratio=1.25)
+    assert rate == pytest.approx(1.2)
+    assert start == 2.0
+    assert len(out) / SR <= 1.0 + 1e-3
+
+
+def test_fit_clip_shifts_earlier_then_trims():
+    y = _tone(2.0)
+    out, start, rate = fit_clip(y, SR, 2.0, (1.5, 3.0), max_ratio=1.25, max_shift=0.3, fade=0.03)
+    assert rate == 1.25
+    assert start == pytest.approx(1.7)
+    assert start + len(out) / SR == pytest.approx(3.0, abs=1 / SR)
+    # cut with a fade-out
+    assert out[-1] == 0.0
+
+
+def test_fit_clip_no_room():
+    y = _tone(1.0)
+    out, start, rate = fit_clip(y, SR, 3.0, (1.0, 3.0))
+    assert out is y and start == 3.0 and rate == 1.0
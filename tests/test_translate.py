@@ -0,0 +1,24 @@
+from src.translate import make_batches
+
+
+def test_make_batches_segment_limit():
+    texts = [str(i) for i in range(7)]
+    batches = make_batches(texts, max_segments=3, max_chars=1000)
+    assert batches == [["0", "1", "2"], ["3", "4", "5"], ["6"]]
+
+
+def test_make_batches_char_limit():
+    texts = ["aaaa", "bbbb", "cc", "dddddd"]
+    assert make_batches(texts, max_segments=10, max_chars=10) == [["aaaa", "bbbb", "cc"], ["dddddd"]]
+
+
+def test_make_batches_oversized_text_gets_own_batch():
+    texts = ["a", "x" * 50, "b"]
+    assert make_batches(texts, max_segments=10, max_chars=10) == [["a"], ["x" * 50], ["b"]]
+
+
+def test_make_batches_keeps_order_and_items():
+    texts = [("t%d" % i) * (i % 5 + 1) for i in range(40)]
+    batches = make_batches(texts, max_segments=4, max_chars=30)
+    assert [t for b in batches for t in b] == texts
+    assert make_batches([]) == []
@@ -0,0 +1,94 @@
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+import pytest
+
+from src import tts_cache
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    # the suite's private cache directory (see conftest); start every test from an empty index
+    tts_cache.evict(1)
+    yield
+
+
+def _file(tmp_path, size, name=None):
+    path = tmp_path / (name or f"{uuid.uuid4().hex}.wav")
+    path.write_bytes(b"x" * size)
+    return path
+
+
+def _indexed_bytes():
+    conn = tts_cache._db()
+    return conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+
+def test_evict_removes_least_recently_used_down_to_90_percent(tmp_path):
+    keys = [uuid.uuid4().hex for _ in range(5)]
+    paths = [tts_cache.store(k, str(_file(tmp_path, 1000))) for k in keys]
+    # touching the oldest entry makes it the most recently used
+    assert tts_cache.lookup(keys[0]) == paths[0]
+    assert tts_cache.evict(5000) == 0
+    assert tts_cache.evict(4000) == 2
+    assert [tts_cache.lookup(k) is not None for k in keys] == [True, False, False, True, True]
+    assert not any(os.path.exists(p) for p in paths[1:3])
+    assert tts_cache.stats()["bytes"] == 3000
+
+
+def test_total_bytes_tracks_store_and_forget(tmp_path):
+    key = uuid.uuid4().hex
+    tts_cache.store(key, str(_file(tmp_path, 700)))
+    tts_cache.store(uuid.uuid4().hex, str(_file(tmp_path, 300)))
+    assert tts_cache.stats()["bytes"] == _indexed_bytes() == 1000
+    # replacing an entry counts only its new size
+    tts_cache.store(key, str(_file(tmp_path, 200)))
+    assert tts_cache.stats()["bytes"] == _indexed_bytes() == 500
+    tts_cache._forget(tts_cache._db(), key)
+    tts_cache._forget(tts_cache._db(), key)
+    assert tts_cache.stats()["bytes"] == _indexed_bytes() == 300
+    assert tts_cache.stats()["entries"] == 1
+
+
+def test_legacy_flat_file_is_moved_into_shard():
+    key = uuid.uuid4().hex
+    legacy = tts_cache.CACHE_DIR / f"{key}.wav"
+    legacy.write_bytes(b"y" * 123)
+    path = tts_cache.lookup(key)
+    assert path == str(tts_cache._shard_path(key, "wav"))
+    assert not legacy.exists()
+    assert tts_cache.stats()["bytes"] == 123
+    # now indexed: found again without touching the flat layout
+    assert tts_cache.lookup(key) == path
+
+
+def test_store_move_false_keeps_callers_file(tmp_path):
+    src = _file(tmp_path, 50)
+    path = tts_cache.store_cache(str(src), "hello", voice_id="v1", move=False)
+    assert src.exists() and Path(path).read_bytes() == src.read_bytes()
+    assert tts_cache.get_cached("hello", voice_id="v1") == path
+    moved = _file(tmp_path, 60)
+    tts_cache.store_cache(str(moved), "hello", voice_id="v2")
+    assert not moved.exists()
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg not installed")
+def test_encoded_store_move_false_keeps_callers_file(tmp_path):
+    import wave
+    src = tmp_path / "line.wav"
+    with wave.open(str(src), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(16000)
+        w.writeframes(b"\x00\x00" * 1600)
+    path = tts_cache.store(uuid.uuid4().hex, str(src), move=False, fmt="flac")
+    assert path.endswith(".flac")
+    assert src.exists()
+
+
+def test_backend_is_part_of_the_key():
+    assert tts_cache._make_key("hi", "v", None, "m") == tts_cache._make_key("hi", "v", None, "m", "elevenlabs")
+    assert tts_cache._make_key("hi", "v", None, "m", "local") != tts_cache._make_key("hi", "v", None, "m")
+    assert tts_cache._make_key("hi", "v", None, "m1") != tts_cache._make_key("hi", "v", None, "m2")
@@ -0,0 +1,131 @@
+import hashlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src import jobstore, main
+from src.jobstore import get_job
+
+
+class FakeExecutor:
+    """Stands in for the local process pool: records submissions instead of running them."""
+
+    def __init__(self, capacity=8):
+        self.capacity = capacity
+        self.submitted = []
+
+    def depth(self):
+        return {"running": 0, "queued": len(self.submitted), "workers": 1, "capacity": self.capacity}
+
+    def submit(self, fn, job_id, *args):
+        if len(self.submitted) >= self.capacity:
+            raise main.QueueFull("Local job queue is full")
+        self.submitted.append((fn, job_id, args))
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "UPLOAD_DIR", tmp_path)
+    monkeypatch.setattr(jobstore, "UPLOAD_DIR", tmp_path)
+    executor = FakeExecutor()
+    monkeypatch.setattr(main, "get_executor", lambda: executor)
+    c = TestClient(main.app)
+    c.executor = executor
+    return c
+
+
+def _init(client, size):
+    r = client.post("/api/uploads", json={"filename": "ep01.mp4", "size": size, "target_language": "ru"})
+    assert r.status_code == 200
+    assert r.json()["offset"] == 0
+    return r.json()["upload_id"]
+
+
+def _put(client, upload_id, offset, data):
+    return client.put(f"/api/uploads/{upload_id}", params={"offset": offset}, content=data)
+
+
+def _part(upload_id):
+    return main.UPLOAD_DIR / upload_id / "ep01.mp4.part"
+
+
+def test_put_at_wrong_offset_returns_current_offset(client):
+    upload_id = _init(client, 10)
+    assert _put(client, upload_id, 0, b"abcd").json()["offset"] == 4
+    r = _put(client, upload_id, 0, b"abcd")
+    assert r.status_code == 409
+    assert r.json()["offset"] == 4
+    r = _put(client, upload_id, 6, b"ef")
+    assert r.status_code == 409
+    assert r.json()["offset"] == 4
+    assert client.get(f"/api/uploads/{upload_id}").json()["offset"] == 4
+
+
+def test_put_past_declared_size_is_rejected_and_truncated(client):
+    upload_id = _init(client, 6)
+    _put(client, upload_id, 0, b"abc")
+    r = _put(client, upload_id, 3, b"defgh")
+    assert r.status_code == 413
+    assert _part(upload_id).read_bytes() == b"abc"
+    assert _put(client, upload_id, 3, b"def").json()["offset"] == 6
+
+
+def test_finalize_incomplete_upload(client):
+    upload_id = _init(client, 6)
+    _put(client, upload_id, 0, b"abc")
+    r = client.post(f"/api/uploads/{upload_id}/finalize", json={})
+    assert r.status_code == 409
+    assert r.json()["offset"] == 3
+    assert client.executor.submitted == []
+
+
+def test_finalize_with_bad_checksum(client):
+    upload_id = _init(client, 3)
+    _put(client, upload_id, 0, b"abc")
+    r = client.post(f"/api/uploads/{upload_id}/finalize", json={"sha256": "0" * 64})
+    assert r.status_code == 422
+    assert _part(upload_id).exists()
+    assert client.executor.submitted == []
+
+
+def test_finalize_creates_and_queues_job(client):
+    upload_id = _init(client, 6)
+    _put(client, upload_id, 0, b"abc")
+    _put(client, upload_id, 3, b"def")
+    r = client.post(f"/api/uploads/{upload_id}/finalize", json={"sha256": hashlib.sha256(b"abcdef").hexdigest().upper()})
+    assert r.status_code == 200
+    assert r.json() == {"job_id": upload_id, "filename": "ep01.mp4", "status": "queued"}
+    assert (main.UPLOAD_DIR / upload_id / "ep01.mp4").read_bytes() == b"abcdef"
+    assert not _part(upload_id).exists()
+    job = get_job(upload_id)
+    assert job["status"] == "queued" and job["target_language"] == "ru"
+    [(fn, job_id, args)] = client.executor.submitted
+    assert fn is main.process_video and job_id == upload_id
+    assert client.post(f"/api/uploads/{upload_id}/finalize", json={}).status_code == 409
+    assert _put(client, upload_id, 6, b"x").status_code == 409
+
+
+def test_finalize_on_full_queue_can_be_retried(client):
+    upload_id = _init(client, 3)
+    _put(client, upload_id, 0, b"abc")
+    client.executor.capacity = 0
+    r = client.post(f"/api/uploads/{upload_id}/finalize", json={})
+    assert r.status_code == 429 and r.headers["Retry-After"]
+    assert _part(upload_id).exists()
+    client.executor.capacity = 1
+    assert client.post(f"/api/uploads/{upload_id}/finalize", json={}).status_code == 200
+    assert len(client.executor.submitted) == 1
+
+
+def test_finalize_reopens_upload_when_queue_fills_after_check(client, monkeypatch):
+    upload_id = _init(client, 3)
+    _put(client, upload_id, 0, b"abc")
+    # capacity looks free, but the pool refuses the submission
+    monkeypatch.setattr(client.executor, "depth", lambda: {"running": 0, "queued": 0, "workers": 1, "capacity": 1})
+    client.executor.capacity = 0
+    assert client.post(f"/api/uploads/{upload_id}/finalize", json={}).status_code == 429
+    assert _part(upload_id).read_bytes() == b"abc"
+    assert get_job(upload_id)["status"] == "queued"
+    client.executor.capacity = 1
+    assert client.post(f"/api/uploads/{upload_id}/finalize", json={}).status_code == 200
+    assert (main.UPLOAD_DIR / upload_id / "ep01.mp4").read_bytes() == b"abc"